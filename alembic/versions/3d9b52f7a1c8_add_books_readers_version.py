@@ -0,0 +1,30 @@
+"""Add books and readers version
+
+Revision ID: 3d9b52f7a1c8
+Revises: a4e1b7c90d35
+Create Date: 2026-10-18 13:05:41.532817
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3d9b52f7a1c8'
+down_revision: Union[str, None] = 'a4e1b7c90d35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('books', sa.Column('version', sa.Integer(), server_default=sa.text('1'), nullable=False))
+    op.add_column('readers', sa.Column('version', sa.Integer(), server_default=sa.text('1'), nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('readers', 'version')
+    op.drop_column('books', 'version')
@@ -0,0 +1,41 @@
+"""Add active borrow index and readers active_borrow_count
+
+Revision ID: a4e1b7c90d35
+Revises: 0f3c6a91d2b4
+Create Date: 2026-10-18 11:48:03.120945
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a4e1b7c90d35'
+down_revision: Union[str, None] = '0f3c6a91d2b4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_borrowed_books_active', 'borrowed_books', ['reader_id', 'book_id'], unique=False,
+                    postgresql_where=sa.text('return_date IS NULL'))
+    op.add_column('readers', sa.Column('active_borrow_count', sa.Integer(), server_default=sa.text('0'),
+                                       nullable=False))
+    op.execute(
+        "UPDATE readers SET active_borrow_count = open_borrows.count "
+        "FROM (SELECT reader_id, count(*) AS count FROM borrowed_books "
+        "WHERE return_date IS NULL GROUP BY reader_id) AS open_borrows "
+        "WHERE readers.id = open_borrows.reader_id"
+    )
+    op.create_check_constraint('ck_readers_active_borrow_count', 'readers', 'active_borrow_count >= 0')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('ck_readers_active_borrow_count', 'readers', type_='check')
+    op.drop_column('readers', 'active_borrow_count')
+    op.drop_index('ix_borrowed_books_active', table_name='borrowed_books',
+                  postgresql_where=sa.text('return_date IS NULL'))
@@ -0,0 +1,73 @@
+"""Add circulation summary tables
+
+Revision ID: c81f4e2d7a60
+Revises: 3d9b52f7a1c8
+Create Date: 2026-10-18 15:22:09.417351
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c81f4e2d7a60'
+down_revision: Union[str, None] = '3d9b52f7a1c8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('daily_circulation',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('shard', sa.SmallInteger(), nullable=False),
+    sa.Column('borrows', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('returns', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('cancelled', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'shard')
+    )
+    op.create_table('book_circulation',
+    sa.Column('book_id', sa.Integer(), nullable=False),
+    sa.Column('borrow_count', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('last_borrowed', sa.Date(), nullable=True),
+    sa.ForeignKeyConstraint(['book_id'], ['books.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('book_id')
+    )
+    op.create_index('ix_book_circulation_borrow_count', 'book_circulation', ['borrow_count'], unique=False)
+    op.create_table('reader_circulation',
+    sa.Column('reader_id', sa.BIGINT(), nullable=False),
+    sa.Column('borrow_count', sa.Integer(), server_default=sa.text('0'), nullable=False),
+    sa.Column('last_borrowed', sa.Date(), nullable=True),
+    sa.ForeignKeyConstraint(['reader_id'], ['readers.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('reader_id')
+    )
+    op.create_index('ix_reader_circulation_borrow_count', 'reader_circulation', ['borrow_count'], unique=False)
+
+    # Backfill from the existing history, 16 is STATS_SHARDS in library/crud/stats.py
+    op.execute(
+        "INSERT INTO daily_circulation (day, shard, borrows, returns, cancelled) "
+        "SELECT day, shard, sum(borrows), sum(returns), 0 FROM ("
+        "SELECT borrow_date AS day, reader_id % 16 AS shard, 1 AS borrows, 0 AS returns FROM borrowed_books "
+        "UNION ALL "
+        "SELECT return_date, reader_id % 16, 0, 1 FROM borrowed_books WHERE return_date IS NOT NULL"
+        ") AS events GROUP BY day, shard"
+    )
+    op.execute(
+        "INSERT INTO book_circulation (book_id, borrow_count, last_borrowed) "
+        "SELECT book_id, count(*), max(borrow_date) FROM borrowed_books GROUP BY book_id"
+    )
+    op.execute(
+        "INSERT INTO reader_circulation (reader_id, borrow_count, last_borrowed) "
+        "SELECT reader_id, count(*), max(borrow_date) FROM borrowed_books GROUP BY reader_id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_reader_circulation_borrow_count', table_name='reader_circulation')
+    op.drop_table('reader_circulation')
+    op.drop_index('ix_book_circulation_borrow_count', table_name='book_circulation')
+    op.drop_table('book_circulation')
+    op.drop_table('daily_circulation')
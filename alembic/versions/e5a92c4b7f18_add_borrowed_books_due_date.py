@@ -0,0 +1,37 @@
+"""Add borrowed_books due_date, overdue_notified_at and overdue index
+
+Revision ID: e5a92c4b7f18
+Revises: c81f4e2d7a60
+Create Date: 2026-10-18 17:04:36.512208
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a92c4b7f18'
+down_revision: Union[str, None] = 'c81f4e2d7a60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('borrowed_books', sa.Column('due_date', sa.Date(), nullable=True))
+    op.add_column('borrowed_books', sa.Column('overdue_notified_at', sa.DateTime(timezone=True), nullable=True))
+    # Existing loans are due LOAN_DAYS (14) after they started
+    op.execute("UPDATE borrowed_books SET due_date = borrow_date + 14")
+    op.alter_column('borrowed_books', 'due_date', existing_type=sa.Date(), nullable=False)
+    op.create_index('ix_borrowed_books_overdue', 'borrowed_books', ['due_date', 'id'], unique=False,
+                    postgresql_where=sa.text('return_date IS NULL AND overdue_notified_at IS NULL'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_borrowed_books_overdue', table_name='borrowed_books',
+                  postgresql_where=sa.text('return_date IS NULL AND overdue_notified_at IS NULL'))
+    op.drop_column('borrowed_books', 'overdue_notified_at')
+    op.drop_column('borrowed_books', 'due_date')
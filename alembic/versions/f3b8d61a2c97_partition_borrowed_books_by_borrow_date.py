@@ -0,0 +1,113 @@
+"""Partition borrowed_books by borrow_date
+
+Revision ID: f3b8d61a2c97
+Revises: e5a92c4b7f18
+Create Date: 2026-10-18 19:37:52.081446
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b8d61a2c97'
+down_revision: Union[str, None] = 'e5a92c4b7f18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COLUMNS = 'id, book_id, reader_id, borrow_date, return_date, due_date, overdue_notified_at'
+
+
+def borrowed_books_columns() -> list:
+    return [
+        sa.Column('id', sa.Integer(), server_default=sa.text("nextval('borrowed_books_id_seq'::regclass)"),
+                  nullable=False),
+        sa.Column('book_id', sa.Integer(), nullable=False),
+        sa.Column('reader_id', sa.BIGINT(), nullable=False),
+        sa.Column('borrow_date', sa.Date(), nullable=False),
+        sa.Column('return_date', sa.Date(), nullable=True),
+        sa.Column('due_date', sa.Date(), nullable=False),
+        sa.Column('overdue_notified_at', sa.DateTime(timezone=True), nullable=True),
+        sa.ForeignKeyConstraint(['book_id'], ['books.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['reader_id'], ['readers.id'], ondelete='CASCADE'),
+    ]
+
+
+def create_borrowed_books_indexes() -> None:
+    op.create_index('ix_borrowed_books_active', 'borrowed_books', ['reader_id', 'book_id'], unique=False,
+                    postgresql_where=sa.text('return_date IS NULL'))
+    op.create_index('ix_borrowed_books_overdue', 'borrowed_books', ['due_date', 'id'], unique=False,
+                    postgresql_where=sa.text('return_date IS NULL AND overdue_notified_at IS NULL'))
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # The old table is renamed out of the way and copied into the partitioned one, which takes over its id sequence
+    op.rename_table('borrowed_books', 'borrowed_books_unpartitioned')
+    op.execute('ALTER TABLE borrowed_books_unpartitioned '
+               'RENAME CONSTRAINT borrowed_books_pkey TO borrowed_books_unpartitioned_pkey')
+    op.drop_index('ix_borrowed_books_id', table_name='borrowed_books_unpartitioned')
+    op.drop_index('ix_borrowed_books_active', table_name='borrowed_books_unpartitioned',
+                  postgresql_where=sa.text('return_date IS NULL'))
+    op.drop_index('ix_borrowed_books_overdue', table_name='borrowed_books_unpartitioned',
+                  postgresql_where=sa.text('return_date IS NULL AND overdue_notified_at IS NULL'))
+
+    op.create_table('borrowed_books',
+    *borrowed_books_columns(),
+    sa.PrimaryKeyConstraint('id', 'borrow_date'),
+    postgresql_partition_by='RANGE (borrow_date)'
+    )
+    op.execute('ALTER SEQUENCE borrowed_books_id_seq OWNED BY borrowed_books.id')
+
+    # One partition per year from the oldest borrow through next year, and a default one for anything else
+    op.execute("""
+        DO $$
+        DECLARE
+            year integer;
+        BEGIN
+            FOR year IN
+                SELECT generate_series(
+                    coalesce(extract(year FROM min(borrow_date))::integer, extract(year FROM current_date)::integer),
+                    extract(year FROM current_date)::integer + 1
+                ) FROM borrowed_books_unpartitioned
+            LOOP
+                EXECUTE format('CREATE TABLE borrowed_books_%s PARTITION OF borrowed_books FOR VALUES FROM (%L) TO (%L)',
+                               year, make_date(year, 1, 1), make_date(year + 1, 1, 1));
+            END LOOP;
+        END
+        $$
+    """)
+    op.execute('CREATE TABLE borrowed_books_default PARTITION OF borrowed_books DEFAULT')
+    op.execute(f'INSERT INTO borrowed_books ({COLUMNS}) SELECT {COLUMNS} FROM borrowed_books_unpartitioned')
+    op.drop_table('borrowed_books_unpartitioned')
+
+    # Built after the copy, on the parent so every partition gets its own
+    create_borrowed_books_indexes()
+    op.create_index('ix_borrowed_books_open', 'borrowed_books', ['borrow_date'], unique=False,
+                    postgresql_where=sa.text('return_date IS NULL'))
+    op.create_index('ix_borrowed_books_reader_history', 'borrowed_books', ['reader_id', 'borrow_date'], unique=False)
+    op.execute('ANALYZE borrowed_books')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.rename_table('borrowed_books', 'borrowed_books_partitioned')
+    op.execute('ALTER TABLE borrowed_books_partitioned '
+               'RENAME CONSTRAINT borrowed_books_pkey TO borrowed_books_partitioned_pkey')
+    for index in ('ix_borrowed_books_active', 'ix_borrowed_books_overdue', 'ix_borrowed_books_open',
+                  'ix_borrowed_books_reader_history'):
+        op.drop_index(index, table_name='borrowed_books_partitioned')
+
+    op.create_table('borrowed_books',
+    *borrowed_books_columns(),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute('ALTER SEQUENCE borrowed_books_id_seq OWNED BY borrowed_books.id')
+    op.execute(f'INSERT INTO borrowed_books ({COLUMNS}) SELECT {COLUMNS} FROM borrowed_books_partitioned')
+    # Drops every partition with it, detached (archived) years are left alone
+    op.drop_table('borrowed_books_partitioned')
+
+    op.create_index('ix_borrowed_books_id', 'borrowed_books', ['id'], unique=False)
+    create_borrowed_books_indexes()
@@ -0,0 +1,124 @@
+"""Benchmark for the lend-time active-borrow checks.
+
+Builds a scratch copy of borrowed_books with --rows rows of history and times the checks lend_book used to run
+(count of open borrows per reader plus the duplicate check, without any index but the primary key) against the
+current ones (readers.active_borrow_count plus the duplicate check through the partial ix_borrowed_books_active).
+
+    python -m benchmarks.active_borrows --rows 10000000
+
+Everything is created in its own schema, which is dropped afterwards unless --keep is given.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from library.config import DBConfig
+
+SCHEMA = "bench_active_borrows"
+
+OLD_CHECKS = (
+    "SELECT count(*) FROM borrowed_books WHERE reader_id = :reader_id AND return_date IS NULL",
+    "SELECT EXISTS (SELECT 1 FROM borrowed_books "
+    "WHERE reader_id = :reader_id AND book_id = :book_id AND return_date IS NULL)",
+)
+NEW_CHECKS = (
+    "SELECT active_borrow_count FROM readers WHERE id = :reader_id",
+    "SELECT EXISTS (SELECT 1 FROM borrowed_books "
+    "WHERE reader_id = :reader_id AND book_id = :book_id AND return_date IS NULL)",
+)
+
+
+async def build(conn, rows: int, readers: int, books: int, active_ratio: float, seed: float) -> None:
+    await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    await conn.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+    await conn.execute(text(f"SET search_path TO {SCHEMA}"))
+    await conn.execute(text(
+        "CREATE TABLE readers (id bigint PRIMARY KEY, active_borrow_count integer NOT NULL DEFAULT 0)"
+    ))
+    await conn.execute(text(
+        "CREATE TABLE borrowed_books (id bigserial PRIMARY KEY, book_id integer NOT NULL, "
+        "reader_id bigint NOT NULL, borrow_date date NOT NULL, return_date date)"
+    ))
+    await conn.execute(text("SELECT setseed(:seed)"), {"seed": seed})
+    await conn.execute(text("INSERT INTO readers (id) SELECT generate_series(1, :readers)"), {"readers": readers})
+    await conn.execute(text(
+        "INSERT INTO borrowed_books (book_id, reader_id, borrow_date, return_date) "
+        "SELECT (random() * (:books - 1))::int + 1, (random() * (:readers - 1))::bigint + 1, d, "
+        "CASE WHEN random() < :active_ratio THEN NULL ELSE d + 14 END "
+        "FROM (SELECT current_date - (random() * 3650)::int AS d FROM generate_series(1, :rows)) AS days"
+    ), {"books": books, "readers": readers, "active_ratio": active_ratio, "rows": rows})
+    await conn.execute(text("ANALYZE borrowed_books"))
+    await conn.execute(text("ANALYZE readers"))
+
+
+async def migrate(conn) -> None:
+    await conn.execute(text(
+        "CREATE INDEX ix_borrowed_books_active ON borrowed_books (reader_id, book_id) WHERE return_date IS NULL"
+    ))
+    await conn.execute(text(
+        "UPDATE readers SET active_borrow_count = open_borrows.count "
+        "FROM (SELECT reader_id, count(*) AS count FROM borrowed_books "
+        "WHERE return_date IS NULL GROUP BY reader_id) AS open_borrows "
+        "WHERE readers.id = open_borrows.reader_id"
+    ))
+    await conn.execute(text("ANALYZE borrowed_books"))
+    await conn.execute(text("ANALYZE readers"))
+
+
+# Runs both checks for every sample and returns the latency of each lend check in milliseconds.
+async def measure(conn, checks: tuple[str, ...], samples: list[tuple[int, int]]) -> list[float]:
+    timings = []
+    for reader_id, book_id in samples:
+        started = time.perf_counter()
+        for check in checks:
+            await conn.execute(text(check), {"reader_id": reader_id, "book_id": book_id})
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def summary(timings: list[float]) -> str:
+    return (f"median {statistics.median(timings):9.3f} ms   "
+            f"p95 {statistics.quantiles(timings, n=20, method='inclusive')[-1]:9.3f} ms   max {max(timings):9.3f} ms")
+
+
+async def main(args) -> None:
+    engine = create_async_engine(DBConfig.DB_URL)
+    rng = random.Random(args.seed)
+    samples = [(rng.randint(1, args.readers), rng.randint(1, args.books)) for _ in range(args.samples)]
+
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            print(f"Building {args.rows:,} borrow records for {args.readers:,} readers ...")
+            # setseed() takes a value between -1 and 1
+            await build(conn, args.rows, args.readers, args.books, args.active_ratio, (args.seed % 1000) / 1000)
+
+            before = await measure(conn, OLD_CHECKS, samples)
+            print(f"before  {summary(before)}")
+
+            print("Adding the partial index and the active_borrow_count counter ...")
+            await migrate(conn)
+
+            after = await measure(conn, NEW_CHECKS, samples)
+            print(f"after   {summary(after)}")
+            print(f"speedup {statistics.median(before) / statistics.median(after):.0f}x (median)")
+        finally:
+            if not args.keep:
+                await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000_000, help="borrow records to generate")
+    parser.add_argument("--readers", type=int, default=1_000_000)
+    parser.add_argument("--books", type=int, default=500_000)
+    parser.add_argument("--active-ratio", type=float, default=0.02, help="share of borrows not returned yet")
+    parser.add_argument("--samples", type=int, default=50, help="lend checks to time before and after")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="keep the scratch schema")
+    asyncio.run(main(parser.parse_args()))
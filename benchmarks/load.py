@@ -0,0 +1,311 @@
+"""Load test for the HTTP API.
+
+Drives the app with a fixed number of concurrent clients and reports throughput and p50/p95/p99 latency per
+scenario: register/login, listing and fetching books, lending and returning (one by one and in circulation
+batches), and the borrow listings. Throughput counts requests, ops/s counts the lends and returns inside batches.
+
+    python -m benchmarks.load                                   # in process, through httpx ASGITransport
+    python -m benchmarks.load --serve --workers 4               # against a local uvicorn started for the run
+    python -m benchmarks.load --url http://127.0.0.1:8000       # against an already running server
+
+Results are written as JSON (--output). Given --baseline, the run is compared with an earlier result and the
+script exits with status 1 when a scenario's p95 or throughput regressed by more than --tolerance.
+
+It writes to the configured database (a bench user, --books books and one reader per client), so point it at a
+local or scratch Postgres. The books and readers are deleted afterwards unless --keep is given.
+"""
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+import httpx
+
+SCENARIOS = ("auth", "list_books", "get_book", "lend_return", "circulation_batch", "borrows")
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+# Latencies (ms) and failures of one scenario
+class Recorder:
+    def __init__(self):
+        self.latencies = []
+        self.errors = {}
+        self.operations = 0
+
+    # operations is how many lends or returns the request carries, for batches
+    async def call(self, client: httpx.AsyncClient, method: str, url: str, expect: int = 200, operations: int = 1,
+                   **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies.append((time.perf_counter() - started) * 1000)
+        self.operations += operations
+        if response.status_code != expect:
+            self.errors[response.status_code] = self.errors.get(response.status_code, 0) + 1
+        return response
+
+
+# Everything the scenarios need, created once before the measured runs
+class Fixture:
+    def __init__(self, client: httpx.AsyncClient, run_id: str):
+        self.client = client
+        self.run_id = run_id
+        self.headers = {}
+        self.book_ids = []
+        self.reader_ids = []
+        # Readers each circulation_batch client lends to, one book per reader per batch
+        self.batch_readers = []
+
+    async def setup(self, books: int, readers: int, batch_size: int = 0) -> None:
+        user = {"email": f"bench-{self.run_id}@example.com", "password": "benchmark-password"}
+        await self.client.post("/auth/register/", json=user)
+        response = await self.client.post("/auth/login/", json=user)
+        response.raise_for_status()
+        self.headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        # Enough copies that concurrent lends never run out
+        lines = "".join(
+            json.dumps({"title": f"Bench book {i}", "author": "Load Test", "isbn": f"bench-{self.run_id}-{i}",
+                        "copy": 1_000_000}) + "\n"
+            for i in range(books)
+        )
+        response = await self.client.post("/books/bulk", content=lines, headers={
+            **self.headers, "Content-Type": "application/x-ndjson",
+        })
+        response.raise_for_status()
+
+        cursor = ""
+        prefix = f"bench-{self.run_id}-"
+        while cursor is not None:
+            page = (await self.client.get("/books/", params={"cursor": cursor, "limit": 1000},
+                                          headers=self.headers)).json()
+            self.book_ids.extend(book["id"] for book in page["items"] if (book["isbn"] or "").startswith(prefix))
+            cursor = page["next_cursor"]
+
+        for i in range(readers):
+            response = await self.client.post("/readers/create", headers=self.headers, json={
+                "full_name": f"Bench reader {i}", "email": f"bench-{self.run_id}-{i}@example.com",
+            })
+            response.raise_for_status()
+            reader_id = response.json()["id"]
+            self.reader_ids.append(reader_id)
+            # Some history for the borrow listings
+            for book_id in random.sample(self.book_ids, min(3, len(self.book_ids))):
+                borrow = (await self.client.post("/books/lend", headers=self.headers,
+                                                 json={"book_id": book_id, "reader_id": reader_id})).json()
+                await self.client.post("/books/return", headers=self.headers,
+                                       json={"borrow_id": borrow["id"], "reader_id": reader_id})
+
+        for worker in range(readers if batch_size else 0):
+            group = []
+            for i in range(batch_size):
+                response = await self.client.post("/readers/create", headers=self.headers, json={
+                    "full_name": f"Bench batch reader {worker}-{i}",
+                    "email": f"bench-{self.run_id}-batch-{worker}-{i}@example.com",
+                })
+                response.raise_for_status()
+                group.append(response.json()["id"])
+            self.batch_readers.append(group)
+
+    async def teardown(self) -> None:
+        for reader_id in self.reader_ids + [reader_id for group in self.batch_readers for reader_id in group]:
+            await self.client.delete(f"/readers/delete/{reader_id}", headers=self.headers)
+        for book_id in self.book_ids:
+            await self.client.delete(f"/books/delete/{book_id}", headers=self.headers)
+
+
+# One unit of work per scenario, worker is the index of the client running it
+async def run_step(scenario: str, fixture: Fixture, recorder: Recorder, worker: int, step: int) -> None:
+    client, headers = fixture.client, fixture.headers
+    if scenario == "auth":
+        user = {"email": f"bench-{uuid.uuid4().hex}@example.com", "password": "benchmark-password"}
+        await recorder.call(client, "POST", "/auth/register/", json=user)
+        await recorder.call(client, "POST", "/auth/login/", json=user)
+    elif scenario == "list_books":
+        await recorder.call(client, "GET", "/books/", params={"cursor": "", "limit": 20}, headers=headers)
+    elif scenario == "get_book":
+        await recorder.call(client, "GET", f"/books/{random.choice(fixture.book_ids)}", headers=headers)
+    elif scenario == "lend_return":
+        reader_id = fixture.reader_ids[worker]
+        response = await recorder.call(client, "POST", "/books/lend", headers=headers,
+                                       json={"book_id": random.choice(fixture.book_ids), "reader_id": reader_id})
+        if response.status_code == 200:
+            await recorder.call(client, "POST", "/books/return", headers=headers,
+                                json={"borrow_id": response.json()["id"], "reader_id": reader_id})
+    elif scenario == "circulation_batch":
+        lends = [{"op": "lend", "book_id": random.choice(fixture.book_ids), "reader_id": reader_id}
+                 for reader_id in fixture.batch_readers[worker]]
+        response = await recorder.call(client, "POST", "/books/circulation/batch", headers=headers,
+                                       json={"operations": lends}, operations=len(lends))
+        if response.status_code == 200:
+            returns = [{"op": "return", "borrow_id": result["borrow"]["id"], "reader_id": result["borrow"]["reader_id"]}
+                       for result in response.json()["results"] if result["borrow"]]
+            if returns:
+                await recorder.call(client, "POST", "/books/circulation/batch", headers=headers,
+                                    json={"operations": returns}, operations=len(returns))
+    elif scenario == "borrows":
+        reader_id = random.choice(fixture.reader_ids)
+        await recorder.call(client, "GET", f"/books/borrows/{reader_id}", headers=headers,
+                            params={"expand": "book", "limit": 20})
+
+
+# Runs steps from concurrency clients until requests steps are done, returns the scenario's report
+async def run_scenario(scenario: str, fixture: Fixture, concurrency: int, requests: int) -> dict:
+    recorder = Recorder()
+    remaining = iter(range(requests))
+
+    async def worker(index: int) -> None:
+        for step in remaining:
+            await run_step(scenario, fixture, recorder, index, step)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(index) for index in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return report(recorder, elapsed)
+
+
+def report(recorder: Recorder, elapsed: float) -> dict:
+    latencies = recorder.latencies
+    percentiles = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies),
+        "errors": {str(status): count for status, count in recorder.errors.items()},
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "ops_per_second": round(recorder.operations / elapsed, 2) if elapsed else 0.0,
+        "mean_ms": round(statistics.fmean(latencies), 3) if latencies else 0.0,
+        "p50_ms": round(percentiles[49], 3) if latencies else 0.0,
+        "p95_ms": round(percentiles[94], 3) if latencies else 0.0,
+        "p99_ms": round(percentiles[98], 3) if latencies else 0.0,
+        "max_ms": round(max(latencies), 3) if latencies else 0.0,
+    }
+
+
+# Scenarios whose p95 grew or throughput dropped by more than tolerance compared with the baseline
+def regressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    found = []
+    for scenario, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(scenario)
+        if not previous:
+            continue
+        if previous["p95_ms"] and current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            found.append(f"{scenario}: p95 {previous['p95_ms']:.1f} -> {current['p95_ms']:.1f} ms")
+        if previous["throughput"] and current["throughput"] < previous["throughput"] * (1 - tolerance):
+            found.append(f"{scenario}: throughput {previous['throughput']:.1f} -> {current['throughput']:.1f} req/s")
+    return found
+
+
+def print_table(scenarios: dict) -> None:
+    print(f"{'scenario':<18} {'requests':>8} {'errors':>6} {'req/s':>9} {'ops/s':>9} {'p50 ms':>9} {'p95 ms':>9} "
+          f"{'p99 ms':>9}")
+    for name, result in scenarios.items():
+        print(f"{name:<18} {result['requests']:>8} {sum(result['errors'].values()):>6} {result['throughput']:>9.1f} "
+              f"{result['ops_per_second']:>9.1f} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+              f"{result['p99_ms']:>9.2f}")
+
+
+# Starts uvicorn in a subprocess and waits until it answers
+async def serve(port: int, workers: int) -> subprocess.Popen:
+    server = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers", str(workers),
+        "--log-level", "warning",
+    ])
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.get(f"http://127.0.0.1:{port}/docs")
+                return server
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    server.terminate()
+    raise RuntimeError("uvicorn did not start")
+
+
+async def main(args) -> int:
+    random.seed(args.seed)
+    server = None
+    application = None
+    if args.serve:
+        server = await serve(args.port, args.workers)
+        transport, base_url = None, f"http://127.0.0.1:{args.port}"
+    elif args.url:
+        transport, base_url = None, args.url
+    else:
+        import main as application
+        await application.on_startup()
+        transport, base_url = httpx.ASGITransport(app=application.app), "http://bench"
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    run_id = uuid.uuid4().hex[:8]
+    scenarios = {}
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url=base_url, limits=limits, timeout=60) as client:
+            fixture = Fixture(client, run_id)
+            print(f"Setting up {args.books} books and {args.concurrency} readers (run {run_id}) ...")
+            batch_size = args.batch_size if "circulation_batch" in args.scenarios else 0
+            await fixture.setup(args.books, args.concurrency, batch_size)
+            try:
+                for scenario in args.scenarios:
+                    requests = args.auth_requests if scenario == "auth" else args.requests
+                    await run_scenario(scenario, fixture, args.concurrency, min(requests, args.warmup))
+                    scenarios[scenario] = await run_scenario(scenario, fixture, args.concurrency, requests)
+            finally:
+                if not args.keep:
+                    await fixture.teardown()
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        if application is not None:
+            await application.on_shutdown()
+
+    results = {
+        "run_id": run_id,
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "target": "uvicorn" if args.serve else args.url or "asgi",
+        "python": platform.python_version(),
+        "settings": {"concurrency": args.concurrency, "requests": args.requests, "auth_requests": args.auth_requests,
+                     "books": args.books, "batch_size": args.batch_size, "workers": args.workers if args.serve else None, "seed": args.seed},
+        "scenarios": scenarios,
+    }
+    print_table(scenarios)
+
+    output = Path(args.output) if args.output else RESULTS_DIR / f"load-{run_id}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2) + "\n")
+    print(f"Results written to {output}")
+
+    if args.baseline:
+        found = regressions(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running server instead of the in-process app")
+    parser.add_argument("--serve", action="store_true", help="start a local uvicorn for the run")
+    parser.add_argument("--port", type=int, default=8765, help="port for --serve")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for --serve")
+    parser.add_argument("--concurrency", type=int, default=20, help="clients sending requests at the same time")
+    parser.add_argument("--requests", type=int, default=2000, help="steps per scenario")
+    parser.add_argument("--auth-requests", type=int, default=100, help="steps of the bcrypt-bound auth scenario")
+    parser.add_argument("--warmup", type=int, default=100, help="unmeasured steps before each scenario")
+    parser.add_argument("--books", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=50, help="lends per circulation batch")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="where to write the JSON results (default benchmarks/results/)")
+    parser.add_argument("--baseline", help="earlier JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95/throughput regression (0.2 = 20%%)")
+    parser.add_argument("--keep", action="store_true", help="keep the books and readers created for the run")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,102 @@
+"""Micro-benchmark for the list endpoint serialization.
+
+Times turning a page of books into response bytes the way GET /books/ used to (Book objects validated by FastAPI's
+response_model, then encoded by JSONResponse with the json module) against the current path (rows of the listed
+columns validated and dumped in one TypeAdapter call), and checks both produce the same bytes.
+
+    python -m benchmarks.serialization --page-size 100
+
+By default the pages are built in memory, so only serialization is measured. With --db each round also runs the
+list query against the configured database (Book objects through the ORM before, column rows now), which needs
+at least --page-size books.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from collections import namedtuple
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_model_field
+from sqlalchemy.future import select
+from library.crud.book import BOOK_CACHE_COLUMNS, get_books
+from library.database import AsyncSessionLocal, engine
+from library.models import Book
+from library.schemas import BookOut
+from library.serialization import dump_json
+
+# Stands in for the Row tuples get_books returns, which also expose the columns as attributes
+BookRow = namedtuple("BookRow", BOOK_CACHE_COLUMNS)
+
+RESPONSE_FIELD = create_model_field(name="Response_get_books_list", type_=list[BookOut], mode="serialization")
+
+
+async def old_serialize(books: list) -> bytes:
+    content = await serialize_response(field=RESPONSE_FIELD, response_content=books)
+    return JSONResponse(content).body
+
+
+async def new_serialize(rows: list) -> bytes:
+    return dump_json(list[BookOut], rows)
+
+
+def sample_values(count: int) -> list[dict]:
+    return [
+        {"id": i, "title": f"Book title number {i}", "description": "A fairly ordinary description. " * 4,
+         "author": f"Author {i % 97}", "year": 1900 + i % 120, "isbn": f"978-{i:010d}", "copy": i % 7, "version": 1}
+        for i in range(1, count + 1)
+    ]
+
+
+# Times fn over rounds calls and returns the latency of each in milliseconds
+async def measure(fn, rounds: int) -> list[float]:
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+
+def summary(timings: list[float]) -> str:
+    return (f"median {statistics.median(timings):8.3f} ms   "
+            f"p95 {statistics.quantiles(timings, n=20, method='inclusive')[-1]:8.3f} ms")
+
+
+async def main(args) -> None:
+    if args.db:
+        async with AsyncSessionLocal() as session:
+            async def before():
+                result = await session.execute(select(Book).order_by(Book.id).limit(args.page_size))
+                books = result.scalars().all()
+                body = await old_serialize(books)
+                session.expunge_all()
+                return body
+
+            async def after():
+                return await new_serialize(await get_books(session, 0, args.page_size))
+
+            assert await before() == await after(), "the two paths produced different bytes"
+            old = await measure(before, args.rounds)
+            new = await measure(after, args.rounds)
+        await engine.dispose()
+    else:
+        values = sample_values(args.page_size)
+        books = [Book(**book) for book in values]
+        rows = [BookRow(**book) for book in values]
+        assert await old_serialize(books) == await new_serialize(rows), "the two paths produced different bytes"
+        old = await measure(lambda: old_serialize(books), args.rounds)
+        new = await measure(lambda: new_serialize(rows), args.rounds)
+
+    print(f"page of {args.page_size} books{' with the query' if args.db else ''}, {args.rounds} rounds")
+    print(f"before  {summary(old)}")
+    print(f"after   {summary(new)}")
+    print(f"speedup {statistics.median(old) / statistics.median(new):.1f}x (median)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--page-size", type=int, default=100, help="books per page")
+    parser.add_argument("--rounds", type=int, default=500)
+    parser.add_argument("--db", action="store_true", help="include the list query against the configured database")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,147 @@
+import csv
+import json
+from typing import AsyncIterator
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from library.crud.book import (BOOK_IMPORT_COLUMNS, create_book_import_table, upsert_books_chunk, invalidate_books,
+                               clear_book_cache)
+from library.database import after_commit
+from library.schemas import BookCreate
+
+# Rows validated and copied at a time, memory use is bounded by this and not by the upload size
+IMPORT_CHUNK_SIZE = 5000
+# Only the first errors are reported in full, the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+MAX_LINE_BYTES = 1024 * 1024
+# Updated books remembered for invalidation, an import updating more clears the whole book cache instead
+MAX_INVALIDATED_BOOKS = 10_000
+
+CSV_CONTENT_TYPES = ("text/csv",)
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+# Splits the request body into lines as it arrives.
+async def iter_lines(request: Request) -> AsyncIterator[bytes]:
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line
+        if len(buffer) > MAX_LINE_BYTES:
+            raise HTTPException(status_code=400, detail="Line too long")
+    if buffer:
+        yield buffer
+
+
+# Yields (line number, record, error) for a CSV body with a header row.
+# A record may span several lines when a quoted field contains newlines.
+async def iter_csv_records(request: Request) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    header = None
+    pending, start = "", 0
+    line_no = 0
+    async for raw in iter_lines(request):
+        line_no += 1
+        try:
+            line = raw.decode("utf-8-sig" if line_no == 1 else "utf-8")
+        except UnicodeDecodeError:
+            yield line_no, None, "Line is not valid UTF-8"
+            continue
+
+        if not pending:
+            start = line_no
+        pending += line + "\n"
+        if pending.count('"') % 2:
+            continue
+
+        record, pending = next(csv.reader([pending])), ""
+        if not any(value.strip() for value in record):
+            continue
+        if header is None:
+            header = [name.strip() for name in record]
+            continue
+        if len(record) != len(header):
+            yield start, None, f"Expected {len(header)} fields, got {len(record)}"
+            continue
+        # Empty cells fall back to the schema defaults
+        yield start, {name: value for name, value in zip(header, record) if value != ""}, None
+
+    if pending:
+        yield start, None, "Unterminated quoted field"
+
+
+# Yields (line number, record, error) for a body with one JSON object per line.
+async def iter_ndjson_records(request: Request) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    line_no = 0
+    async for raw in iter_lines(request):
+        line_no += 1
+        if not raw.strip():
+            continue
+        try:
+            record = json.loads(raw)
+        except ValueError:
+            yield line_no, None, "Invalid JSON"
+            continue
+        if not isinstance(record, dict):
+            yield line_no, None, "Expected a JSON object"
+            continue
+        yield line_no, record, None
+
+
+def iter_import_records(request: Request) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in CSV_CONTENT_TYPES:
+        return iter_csv_records(request)
+    if content_type in NDJSON_CONTENT_TYPES:
+        return iter_ndjson_records(request)
+    raise HTTPException(status_code=415, detail="Send the catalog as text/csv or application/x-ndjson")
+
+
+# Validates the records with BookCreate chunk by chunk, copies the valid ones into the staging table and
+# upserts them on isbn. Invalid rows are skipped and reported by line number.
+async def import_books(session: AsyncSession, records: AsyncIterator[tuple[int, dict | None, str | None]]) -> dict:
+    report = {"inserted": 0, "updated": 0, "failed": 0, "errors": [], "errors_truncated": False}
+    updated_ids = []
+    clear_cache = False
+
+    def reject(line_no: int, errors: list[str]) -> None:
+        report["failed"] += 1
+        if len(report["errors"]) < MAX_REPORTED_ERRORS:
+            report["errors"].append({"line": line_no, "errors": errors})
+        else:
+            report["errors_truncated"] = True
+
+    async def flush(chunk: list[tuple]) -> None:
+        nonlocal clear_cache
+        inserted, updated = await upsert_books_chunk(session, chunk)
+        report["inserted"] += inserted
+        report["updated"] += len(updated)
+        if len(updated_ids) + len(updated) > MAX_INVALIDATED_BOOKS:
+            clear_cache = True
+            updated_ids.clear()
+        elif not clear_cache:
+            updated_ids.extend(updated)
+
+    await create_book_import_table(session)
+    chunk = []
+    async for line_no, record, error in records:
+        if error is not None:
+            reject(line_no, [error])
+            continue
+        try:
+            book = BookCreate.model_validate(record).model_dump()
+        except ValidationError as exc:
+            reject(line_no, [f"{'.'.join(map(str, e['loc'])) or 'row'}: {e['msg']}" for e in exc.errors()])
+            continue
+
+        chunk.append((line_no, *(book[column] for column in BOOK_IMPORT_COLUMNS[1:])))
+        if len(chunk) >= IMPORT_CHUNK_SIZE:
+            await flush(chunk)
+            chunk = []
+
+    if chunk:
+        await flush(chunk)
+    # Only after the commit, so a concurrent miss cannot put the old values back
+    after_commit(session, clear_book_cache if clear_cache else lambda: invalidate_books(*updated_ids))
+    return report
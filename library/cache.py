@@ -0,0 +1,202 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+# A bounded in-process LRU cache whose entries also expire ttl seconds after they were stored.
+# It is only used from the event loop thread, so it needs no locking.
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    # Like get, but without touching the LRU order or the hit counters
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            return default
+        return entry[1]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Async cache backends behind a common get/set/delete interface, values are JSON-compatible dicts.
+# The local backend is per process, so other workers only see an invalidation once their entry expires.
+class LocalCacheBackend:
+    def __init__(self, maxsize: int, ttl: float):
+        self.cache = TTLCache(maxsize, ttl)
+
+    async def get(self, key: str) -> dict | None:
+        return self.cache.get(key)
+
+    async def set(self, key: str, value: dict) -> None:
+        self.cache.set(key, value)
+
+    # Concurrent writers may finish out of order, an entry is only replaced by a newer version of it
+    async def set_if_newer(self, key: str, value: dict) -> None:
+        current = self.cache.peek(key)
+        if current is None or current["version"] < value["version"]:
+            self.cache.set(key, value)
+
+    async def delete(self, *keys: str) -> None:
+        for key in keys:
+            self.cache.pop(key)
+
+    async def clear(self) -> None:
+        self.cache.clear()
+
+    def stats(self) -> dict:
+        return {"backend": "local", **self.cache.stats()}
+
+
+# Shared cache in Redis (or anything speaking its protocol), so every worker sees the same entries and invalidations.
+# A failing Redis is treated as a miss, the database stays the source of truth.
+class RedisCacheBackend:
+    def __init__(self, client, ttl: float, prefix: str = ""):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @classmethod
+    def from_url(cls, url: str, ttl: float, prefix: str = ""):
+        from redis import asyncio as redis
+
+        return cls(redis.from_url(url), ttl, prefix)
+
+    async def get(self, key: str) -> dict | None:
+        try:
+            value = await self.client.get(self.prefix + key)
+        except Exception:
+            self.errors += 1
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(value)
+
+    async def set(self, key: str, value: dict) -> None:
+        try:
+            await self.client.set(self.prefix + key, json.dumps(value, default=str), px=int(self.ttl * 1000))
+        except Exception:
+            self.errors += 1
+
+    # Compare-and-set under WATCH, if another writer gets in between the entry is dropped instead
+    async def set_if_newer(self, key: str, value: dict) -> None:
+        from redis.exceptions import WatchError
+
+        try:
+            async with self.client.pipeline() as pipe:
+                await pipe.watch(self.prefix + key)
+                current = await pipe.get(self.prefix + key)
+                if current is not None and json.loads(current)["version"] >= value["version"]:
+                    return
+                pipe.multi()
+                pipe.set(self.prefix + key, json.dumps(value, default=str), px=int(self.ttl * 1000))
+                await pipe.execute()
+        except WatchError:
+            await self.delete(key)
+        except Exception:
+            self.errors += 1
+
+    async def delete(self, *keys: str) -> None:
+        if not keys:
+            return
+        try:
+            await self.client.delete(*(self.prefix + key for key in keys))
+        except Exception:
+            self.errors += 1
+
+    # Drops every entry under this backend's prefix, in batches so Redis is never blocked for long
+    async def clear(self) -> None:
+        try:
+            batch = []
+            async for key in self.client.scan_iter(match=self.prefix + "*", count=1000):
+                batch.append(key)
+                if len(batch) >= 1000:
+                    await self.client.delete(*batch)
+                    batch = []
+            if batch:
+                await self.client.delete(*batch)
+        except Exception:
+            self.errors += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "redis",
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+# Disabled cache, every lookup is a miss
+class NullCacheBackend:
+    async def get(self, key: str) -> dict | None:
+        return None
+
+    async def set(self, key: str, value: dict) -> None:
+        pass
+
+    async def set_if_newer(self, key: str, value: dict) -> None:
+        pass
+
+    async def delete(self, *keys: str) -> None:
+        pass
+
+    async def clear(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"backend": "none"}
+
+
+def create_cache_backend(backend: str, maxsize: int, ttl: float, redis_url: str | None = None, prefix: str = ""):
+    if backend == "redis":
+        return RedisCacheBackend.from_url(redis_url, ttl, prefix)
+    if backend == "local":
+        return LocalCacheBackend(maxsize, ttl)
+    return NullCacheBackend()
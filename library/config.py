@@ -16,5 +16,72 @@ class DBConfig:
     DB_PORT = getenv("DB_PORT")
     DB_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 
+    # Engine and pool tuning, size the pool so that workers * (pool size + overflow) fits max_connections
+    DB_ECHO = getenv("DB_ECHO", "false").lower() in ("1", "true", "yes")
+    DB_POOL_SIZE = int(getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW = int(getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT = float(getenv("DB_POOL_TIMEOUT", "30"))
+    DB_POOL_RECYCLE = int(getenv("DB_POOL_RECYCLE", "1800"))
+    DB_POOL_PRE_PING = getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+    # Prepared statements asyncpg keeps per connection, 0 disables them (needed behind pgbouncer in transaction mode)
+    DB_STATEMENT_CACHE_SIZE = int(getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+    # Server-side statement_timeout in milliseconds, 0 means no limit
+    DB_STATEMENT_TIMEOUT = int(getenv("DB_STATEMENT_TIMEOUT", "0"))
 
+    # Optional read replicas as comma separated host:port pairs, they share the primary's credentials and database
+    DB_REPLICA_URLS = [
+        f"postgresql+asyncpg://{DB_USER}:{DB_PASSWORD}@{replica.strip()}/{DB_NAME}"
+        for replica in getenv("DB_REPLICA_HOSTS", "").split(",") if replica.strip()
+    ]
+    # A replica further behind than this many seconds is skipped and reads go to the primary
+    DB_REPLICA_MAX_LAG = float(getenv("DB_REPLICA_MAX_LAG", "5"))
+    # Seconds between replica lag checks, which run in the background and not on the request path
+    DB_REPLICA_LAG_CHECK_INTERVAL = float(getenv("DB_REPLICA_LAG_CHECK_INTERVAL", "1"))
+    # A replica that does not answer the lag check within this many seconds is treated as unavailable
+    DB_REPLICA_LAG_CHECK_TIMEOUT = float(getenv("DB_REPLICA_LAG_CHECK_TIMEOUT", "1"))
+    # After a write the client reads from the primary for this many seconds (read your writes)
+    DB_READ_YOUR_WRITES_WINDOW = float(getenv("DB_READ_YOUR_WRITES_WINDOW", "5"))
+    # Report each request's statement count, rows and database time in a Server-Timing header
+    DB_SERVER_TIMING = getenv("DB_SERVER_TIMING", "true").lower() in ("1", "true", "yes")
 
+
+# Takes authentication settings from environment variables
+class AuthConfig:
+    # Verified token subjects are mapped to their user for this many seconds (0 size disables the cache)
+    PRINCIPAL_CACHE_SIZE = int(getenv("AUTH_CACHE_SIZE", "10000"))
+    PRINCIPAL_CACHE_TTL = float(getenv("AUTH_CACHE_TTL", "60"))
+    # Trust the token claims and skip the per-request user lookup entirely
+    STATELESS = getenv("AUTH_STATELESS", "false").lower() in ("1", "true", "yes")
+    # bcrypt cost and the process pool it runs in (0 workers means one per CPU)
+    BCRYPT_ROUNDS = int(getenv("BCRYPT_ROUNDS", "12"))
+    BCRYPT_WORKERS = int(getenv("BCRYPT_WORKERS", "0"))
+    # Password operations queued or running at once before new ones are rejected with 503
+    BCRYPT_MAX_PENDING = int(getenv("BCRYPT_MAX_PENDING", "64"))
+    # Where logouts and revoked token versions are kept: local to each worker and lost on restart, or redis
+    # (REDIS_URL) shared by all workers. AUTH_STATELESS requires redis.
+    REVOCATION_BACKEND = getenv("AUTH_REVOCATION_BACKEND", "local")
+
+
+# Takes cache settings from environment variables
+class CacheConfig:
+    # local is an in-process LRU per worker, redis is shared by all workers, none disables caching
+    BOOK_CACHE_BACKEND = getenv("BOOK_CACHE_BACKEND", "local")
+    BOOK_CACHE_SIZE = int(getenv("BOOK_CACHE_SIZE", "10000"))
+    BOOK_CACHE_TTL = float(getenv("BOOK_CACHE_TTL", "30"))
+    REDIS_URL = getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+# Takes background job settings from environment variables
+class JobConfig:
+    # Flags open loans past their due date and notifies their readers, every OVERDUE_SCAN_INTERVAL seconds
+    OVERDUE_SCAN_ENABLED = getenv("OVERDUE_SCAN_ENABLED", "true").lower() in ("1", "true", "yes")
+    OVERDUE_SCAN_INTERVAL = float(getenv("OVERDUE_SCAN_INTERVAL", "300"))
+    # Loans flagged per transaction and the pause between chunks, which keeps the scan from hogging the database
+    OVERDUE_SCAN_CHUNK_SIZE = int(getenv("OVERDUE_SCAN_CHUNK_SIZE", "500"))
+    OVERDUE_SCAN_PAUSE = float(getenv("OVERDUE_SCAN_PAUSE", "0.1"))
+    # Notifications sent at the same time
+    OVERDUE_NOTIFY_CONCURRENCY = int(getenv("OVERDUE_NOTIFY_CONCURRENCY", "4"))
+    # How often each worker re-reads the oldest open loan, which bounds the partitions open-loan queries read
+    OPEN_LOANS_REFRESH_INTERVAL = float(getenv("OPEN_LOANS_REFRESH_INTERVAL", "60"))
+    # Jobs use their own small pool, so they never take connections from requests
+    JOB_DB_POOL_SIZE = int(getenv("JOB_DB_POOL_SIZE", "1"))
@@ -1,45 +1,222 @@
+import asyncio
+from sqlalchemy import text, func, literal_column, update, Boolean, Row
+from sqlalchemy.dialects.postgresql import insert, websearch_to_tsquery
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
-from library.models import Book
+from library.cache import create_cache_backend
+from library.config import CacheConfig
+from library.crud.stats import record_cancelled_borrows
+from library.database import after_commit
+from library.models import Book, BorrowedBook, Reader
 
+# Columns of the staging table bulk imports are copied into, line is the source line for error reports
+BOOK_IMPORT_COLUMNS = ("line", "title", "author", "description", "year", "isbn", "copy")
 
-async def get_books(session: AsyncSession, skip: int = 0, limit: int = 10) -> list[Book]:
-    result = await session.execute(select(Book).offset(skip).limit(limit))
-    books = result.scalars().all()
+# Columns kept in the book cache, enough to serve BookOut and the book's ETag
+BOOK_CACHE_COLUMNS = ("id", "title", "description", "author", "year", "isbn", "copy", "version")
+# The same columns for the list queries, which return plain rows instead of Book objects
+BOOK_LIST_COLUMNS = tuple(getattr(Book, column) for column in BOOK_CACHE_COLUMNS)
+
+book_cache = create_cache_backend(CacheConfig.BOOK_CACHE_BACKEND, CacheConfig.BOOK_CACHE_SIZE,
+                                  CacheConfig.BOOK_CACHE_TTL, CacheConfig.REDIS_URL, prefix="book:")
+# Database loads in flight per book id, concurrent misses for the same book wait for the first one.
+# The future holds the cached columns, None when the book does not exist, or False when the load failed.
+book_loads: dict[int, asyncio.Future] = {}
+book_load_stats = {"loads": 0, "coalesced": 0}
+
+
+# The list queries return Row tuples of BOOK_LIST_COLUMNS, read only and never added to the session.
+async def get_books(session: AsyncSession, skip: int = 0, limit: int = 10) -> list[Row]:
+    result = await session.execute(select(*BOOK_LIST_COLUMNS).order_by(Book.id).offset(skip).limit(limit))
+    books = result.all()
+    return books
+
+
+# Keyset pagination: seeks past after_id on the primary key, so a deep page costs the same as the first one.
+async def get_books_after(session: AsyncSession, after_id: int | None = None, limit: int = 10) -> list[Row]:
+    stmt = select(*BOOK_LIST_COLUMNS).order_by(Book.id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(Book.id > after_id)
+    result = await session.execute(stmt)
+    books = result.all()
     return books
 
 
-async def get_book_by_id(session: AsyncSession, book_id: int) -> Book:
+# Full-text search over title, author and description through the GIN-indexed search_vector, best matches first.
+# The query uses web search syntax: quoted phrases, "or" and -excluded words.
+async def search_books(session: AsyncSession, query: str, skip: int = 0, limit: int = 10) -> list[Row]:
+    ts_query = websearch_to_tsquery("english", query)
+    rank = func.ts_rank_cd(Book.search_vector, ts_query)
+    result = await session.execute(
+        select(*BOOK_LIST_COLUMNS)
+        .where(Book.search_vector.op("@@")(ts_query))
+        .order_by(rank.desc(), Book.id)
+        .offset(skip)
+        .limit(limit)
+    )
+    books = result.all()
+    return books
+
+
+# (id, version) of the rows get_books or get_books_after return for the same arguments, to tag a page without loading it.
+async def get_book_versions(session: AsyncSession, skip: int = 0, limit: int = 10,
+                            after_id: int | None = None) -> list[tuple[int, int]]:
+    stmt = select(Book.id, Book.version).order_by(Book.id).offset(skip).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(Book.id > after_id)
+    result = await session.execute(stmt)
+    return result.all()
+
+
+# With cached=True the book may come from the book cache, as a detached Book that must not be modified.
+# A miss loads it once however many requests ask for it at the same time, and stores it in the cache.
+async def get_book_by_id(session: AsyncSession, book_id: int, cached: bool = False) -> Book:
+    if cached:
+        return await get_cached_book(session, book_id)
     result = await session.execute(select(Book).filter(Book.id == book_id))
     book = result.scalar_one_or_none()
     return book
 
 
+async def get_cached_book(session: AsyncSession, book_id: int) -> Book | None:
+    values = await book_cache.get(str(book_id))
+    if values is not None:
+        return Book(**values)
+
+    load = book_loads.get(book_id)
+    if load is not None:
+        book_load_stats["coalesced"] += 1
+        values = await asyncio.shield(load)
+        if values is not False:
+            return Book(**values) if values is not None else None
+        return await get_book_by_id(session, book_id)
+
+    load = asyncio.get_running_loop().create_future()
+    book_loads[book_id] = load
+    book_load_stats["loads"] += 1
+    try:
+        book = await get_book_by_id(session, book_id)
+        values = book_cache_entry(book) if book is not None else None
+        if values is not None:
+            await book_cache.set_if_newer(str(book_id), values)
+        load.set_result(values)
+        return book
+    finally:
+        if not load.done():
+            load.set_result(False)
+        del book_loads[book_id]
+
+
+def book_cache_entry(book) -> dict:
+    return {column: getattr(book, column) for column in BOOK_CACHE_COLUMNS}
+
+
+# Write-through: registered with after_commit with the book's new values (a Book or any object with the cached columns)
+async def cache_book(book) -> None:
+    await book_cache.set_if_newer(str(book.id), book_cache_entry(book))
+
+
+async def invalidate_books(*book_ids: int) -> None:
+    await book_cache.delete(*(str(book_id) for book_id in book_ids))
+
+
+async def clear_book_cache() -> None:
+    await book_cache.clear()
+
+
+def get_book_cache_stats() -> dict:
+    return {**book_cache.stats(), **book_load_stats, "loading": len(book_loads)}
+
+
 async def create_book_db(session: AsyncSession, book_data: dict) -> Book:
     book = Book(**book_data)
     session.add(book)
-    await session.commit()
-    await session.refresh(book)
+    await session.flush()
+    after_commit(session, lambda: cache_book(book))
     return book
 
 
+# A single UPDATE ... RETURNING, the version is bumped in SQL so concurrent writers never reuse one.
 async def update_book_db(session: AsyncSession, book_id: int, book_data: dict) -> Book:
-    book = await get_book_by_id(session, book_id)
+    result = await session.execute(
+        update(Book)
+        .where(Book.id == book_id)
+        .values(**book_data, version=Book.version + 1)
+        .returning(Book)
+        .execution_options(populate_existing=True)
+    )
+    book = result.scalar_one_or_none()
     if book:
-        for key, value in book_data.items():
-            setattr(book, key, value)
-
-        await session.commit()
-        await session.refresh(book)
-        return book
-    return None
+        after_commit(session, lambda: cache_book(book))
+    return book
 
 
 async def delete_book_db(session: AsyncSession, book_id: int) -> bool:
     book = await get_book_by_id(session, book_id)
     if book:
+        # Open borrows of the book are removed by the cascade, so their readers get the slots back
+        open_borrows = (
+            select(BorrowedBook.reader_id, func.count().label("count"))
+            .where(BorrowedBook.book_id == book_id, BorrowedBook.return_date.is_(None))
+            .group_by(BorrowedBook.reader_id)
+            .subquery()
+        )
+        result = await session.execute(
+            update(Reader)
+            .where(Reader.id == open_borrows.c.reader_id)
+            .values(active_borrow_count=Reader.active_borrow_count - open_borrows.c.count)
+            .returning(open_borrows.c.count)
+        )
+        await record_cancelled_borrows(session, sum(result.scalars()))
         await session.delete(book)
-        await session.commit()
+        await session.flush()
+        after_commit(session, lambda: invalidate_books(book_id))
         return True
 
     return False
+
+
+# Creates the per-transaction staging table used by bulk imports.
+async def create_book_import_table(session: AsyncSession) -> None:
+    await session.execute(text(
+        "CREATE TEMPORARY TABLE IF NOT EXISTS book_import ("
+        "line bigint NOT NULL, title varchar NOT NULL, author varchar NOT NULL, description varchar, "
+        "year integer, isbn varchar, copy integer NOT NULL"
+        ") ON COMMIT DROP"
+    ))
+
+
+# Loads validated rows into the staging table with COPY, then upserts them into books on isbn.
+# Within one chunk the last row wins for a repeated isbn, rows without isbn are always inserted.
+# Returns how many books were inserted and the ids of the updated ones.
+async def upsert_books_chunk(session: AsyncSession, records: list[tuple]) -> tuple[int, list[int]]:
+    connection = await session.connection()
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        "book_import", records=records, columns=BOOK_IMPORT_COLUMNS
+    )
+
+    staged = text(
+        "SELECT DISTINCT ON (coalesce(isbn, 'line:' || line)) title, author, description, year, isbn, copy "
+        "FROM book_import ORDER BY coalesce(isbn, 'line:' || line), line DESC"
+    ).columns(Book.title, Book.author, Book.description, Book.year, Book.isbn, Book.copy).subquery("staged")
+
+    stmt = insert(Book).from_select(
+        ["title", "author", "description", "year", "isbn", "copy"], select(staged)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Book.isbn],
+        set_={
+            **{column: stmt.excluded[column] for column in ("title", "author", "description", "year", "copy")},
+            "version": Book.version + 1,
+        },
+    )
+    upserted = stmt.returning(Book.id, literal_column("xmax = 0", Boolean).label("inserted")).cte("upserted")
+
+    result = await session.execute(select(
+        func.count().filter(upserted.c.inserted),
+        func.array_agg(upserted.c.id).filter(~upserted.c.inserted),
+    ))
+    inserted, updated = result.one()
+    await session.execute(text("TRUNCATE book_import"))
+    return inserted, updated or []
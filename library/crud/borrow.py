@@ -1,73 +1,301 @@
-from datetime import date
-from sqlalchemy import select, func
+from datetime import date, timedelta
+from enum import Enum
+from functools import lru_cache
+from sqlalchemy import select, update, insert, exists, true, bindparam, BIGINT, Date, Integer, SmallInteger, \
+    TextClause
+from sqlalchemy.engine import Row
 from sqlalchemy.ext.asyncio import AsyncSession
-from library.models import BorrowedBook
+from sqlalchemy.orm import joinedload
+from library.crud.book import BOOK_CACHE_COLUMNS, cache_book
+from library.crud.stats import record_borrow, record_return, lock_circulation_summaries, stats_shard
+from library import partitions
+from library.database import after_commit, precompile
+from library.models import BorrowedBook, Book, Reader
 
-# Counts how many books a reader has borrowed, but not yet returned.
-async def count_active_borrows(session: AsyncSession, reader_id: int) -> int:
-    result = await session.execute(
-        select(func.count()).select_from(BorrowedBook)
-        .where(BorrowedBook.reader_id == reader_id, BorrowedBook.return_date == None)
-    )
-    return result.scalar()
-
-# Creates a new borrow record for a book.
-async def create_borrow_record(session: AsyncSession, book_id: int, reader_id: int) -> BorrowedBook:
-    borrow = BorrowedBook(
-        book_id=book_id,
-        reader_id=reader_id,
-        borrow_date=date.today(),
-    )
-    session.add(borrow)
-    await session.commit()
-    await session.refresh(borrow)
-    return borrow
-
-# If reader borrowed a book, then decrease the number of copies by 1 else increases by 1
-async def update_book_copies(session: AsyncSession, book, decrement: bool = True):
-    book.copy += -1 if decrement else 1
-    await session.commit()
-    await session.refresh(book)
-
-# Retrieves a borrow record by its ID.
-async def get_borrow_record(session: AsyncSession, borrow_id: int) -> BorrowedBook:
-    result = await session.execute(select(BorrowedBook).filter(BorrowedBook.id == borrow_id))
-    borrow = result.scalar_one_or_none()
-    return borrow
-
-# Updates borrow record's return date when a book is returned
-async def update_borrow_record(session: AsyncSession, borrow_id: int) -> BorrowedBook | None:
-    borrow = await get_borrow_record(session, borrow_id)
-
-    if not borrow:
-        return None
-
-    if borrow.return_date:
-        return borrow
-
-    borrow.return_date = date.today()
-    await session.commit()
-    await session.refresh(borrow)
-    return borrow
-
-# Checks whether a reader has already borrowed a book. If so, return True else False.
-async def has_active_borrow(session: AsyncSession, reader_id: int, book_id: int) -> bool:
-    stmt = select(BorrowedBook).where(
-        BorrowedBook.reader_id == reader_id,
-        BorrowedBook.book_id == book_id,
-        BorrowedBook.return_date.is_(None)
+# How many books a reader may hold at the same time.
+BORROW_LIMIT = 3
+
+# How many days a book is lent for, the due date is set when it is lent.
+LOAN_DAYS = 14
+
+# Relations a borrow listing can include, both are many-to-one so they are joined into the same query.
+BORROW_EXPANSIONS = {"book": BorrowedBook.book, "reader": BorrowedBook.reader}
+
+
+# Outcome of a lend or return, the endpoints translate it into an HTTP error.
+class BorrowStatus(str, Enum):
+    OK = "ok"
+    BOOK_NOT_FOUND = "book_not_found"
+    READER_NOT_FOUND = "reader_not_found"
+    NO_COPIES = "no_copies"
+    LIMIT_REACHED = "limit_reached"
+    ALREADY_BORROWED = "already_borrowed"
+    BORROW_NOT_FOUND = "borrow_not_found"
+    ALREADY_RETURNED = "already_returned"
+    WRONG_READER = "wrong_reader"
+
+
+# Borrows of a reader ordered by borrow_date, with the relations named in expand loaded through joins in the same query.
+# since and until bound borrow_date (both inclusive), so only the partitions of those years are read.
+def borrows_by_reader_query(reader_id: int, expand=(), skip: int = 0, limit: int | None = None,
+                            since: date | None = None, until: date | None = None):
+    stmt = (
+        select(BorrowedBook)
+        .where(BorrowedBook.reader_id == reader_id)
+        .options(*(joinedload(BORROW_EXPANSIONS[name], innerjoin=True) for name in expand))
+        .order_by(BorrowedBook.borrow_date, BorrowedBook.id)
+        .offset(skip)
+        .limit(limit)
     )
-    result = await session.execute(stmt)
-    return result.scalar_one_or_none() is not None
+    if since is not None:
+        stmt = stmt.where(BorrowedBook.borrow_date >= since)
+    if until is not None:
+        stmt = stmt.where(BorrowedBook.borrow_date <= until)
+    return stmt
 
 # Retrieves all borrowed books by a reader.
-async def get_borrowed_books_by_reader(session: AsyncSession, reader_id: int) -> list[BorrowedBook]:
-    result = await session.execute(select(BorrowedBook).where(BorrowedBook.reader_id == reader_id))
+async def get_borrowed_books_by_reader(session: AsyncSession, reader_id: int, expand=(), skip: int = 0,
+                                       limit: int | None = None, since: date | None = None,
+                                       until: date | None = None) -> list[BorrowedBook]:
+    result = await session.execute(borrows_by_reader_query(reader_id, expand, skip, limit, since, until))
     borrowed_books = result.scalars().all()
     return borrowed_books
 
-# Retrieves all not returned books by a reader.
-async def get_not_returned_books_by_reader(session: AsyncSession, reader_id: int) -> list[BorrowedBook]:
-    result = await session.execute(select(BorrowedBook).where(BorrowedBook.reader_id == reader_id, BorrowedBook.return_date.is_(None)))
+# Retrieves all not returned books by a reader, only from the years that still had open loans when
+# partitions.open_loans_since was last read (a listing, lending and returning never rely on it).
+async def get_not_returned_books_by_reader(session: AsyncSession, reader_id: int, expand=(), skip: int = 0,
+                                           limit: int | None = None) -> list[BorrowedBook]:
+    result = await session.execute(
+        borrows_by_reader_query(reader_id, expand, skip, limit, since=partitions.open_loans_since)
+        .where(BorrowedBook.return_date.is_(None))
+    )
     borrowed_books = result.scalars().all()
     return borrowed_books
+
+# The book's new values returned by the lend and return statements, prefixed so they do not clash with the borrow's.
+# The id is left out, the borrow's own book_id column carries it.
+# Once committed they are written through to the book cache, so its copies never lag behind.
+def book_columns(updated_book) -> list:
+    return [updated_book.c[column].label(f"book_{column}") for column in BOOK_CACHE_COLUMNS if column != "id"]
+
+
+def book_from_row(row: Row) -> Book:
+    return Book(**{column: getattr(row, f"book_{column}") for column in BOOK_CACHE_COLUMNS})
+
+
+# The second lend statement, built once with named parameters (book_id, reader_id, today, due_date and the reader's
+# shard) and precompiled, since its summary upserts keep SQLAlchemy from caching it.
+@lru_cache(maxsize=None)
+def lend_statement() -> TextClause:
+    book_id = bindparam("book_id", type_=Integer)
+    reader_id = bindparam("reader_id", type_=BIGINT)
+    duplicate = exists().where(
+        BorrowedBook.reader_id == reader_id,
+        BorrowedBook.book_id == book_id,
+        BorrowedBook.return_date.is_(None),
+    )
+    taken = (
+        update(Book)
+        .where(Book.id == book_id, Book.copy > 0, ~duplicate)
+        .values(copy=Book.copy - 1, version=Book.version + 1)
+        .returning(*(Book.__table__.c[column] for column in BOOK_CACHE_COLUMNS))
+        .cte("taken")
+    )
+    borrow = (
+        insert(BorrowedBook)
+        .from_select(
+            ["book_id", "reader_id", "borrow_date", "due_date"],
+            select(taken.c.id, reader_id, bindparam("today", type_=Date), bindparam("due_date", type_=Date)),
+        )
+        .returning(*BorrowedBook.__table__.c)
+        .cte("borrow")
+    )
+    counted = (
+        update(Reader)
+        .where(Reader.id == reader_id, exists().select_from(borrow))
+        .values(active_borrow_count=Reader.active_borrow_count + 1)
+        .returning(Reader.id)
+        .cte("counted")
+    )
+
+    recorded = record_borrow(borrow, bindparam("shard", type_=SmallInteger))
+
+    checked = select(duplicate.label("duplicate")).cte("checked")
+
+    joined = checked.outerjoin(borrow, true()).outerjoin(counted, true()).outerjoin(taken, true())
+    for summary in recorded:
+        joined = joined.outerjoin(summary, true())
+    return precompile(
+        select(checked.c.duplicate, counted.c.id.label("counted_id"), *borrow.c, *book_columns(taken))
+        .select_from(joined)
+    )
+
+
+# Lends a book in the session's transaction, which the caller commits. Any status but OK means the caller must roll
+# back (the endpoints do so by raising), the locks taken are then released.
+# The first statement locks the reader row, so concurrent lends for the same reader are serialized, and reads the
+# maintained active_borrow_count (the latest version, since the row is locked) together with the book's copies.
+# The second statement rejects duplicates through the partial active-borrow index, takes a copy with a conditional
+# UPDATE (copy > 0, re-checked by Postgres against the latest row version, so copies are never oversold),
+# inserts the borrow record, increments the reader's counter and records the borrow in the circulation summaries.
+async def lend_book_atomic(session: AsyncSession, book_id: int, reader_id: int) -> tuple[BorrowStatus, Row | None]:
+    # Sees the snapshot taken before the lock, good enough to fail fast, the UPDATE re-checks it.
+    copies = select(Book.copy).where(Book.id == book_id).scalar_subquery()
+    locked = await session.execute(
+        select(Reader.active_borrow_count, copies.label("copies"))
+        .where(Reader.id == reader_id)
+        .with_for_update(of=Reader, key_share=True)
+    )
+    reader = locked.one_or_none()
+    if reader is None:
+        book = await session.execute(select(Book.id).where(Book.id == book_id))
+        if book.scalar_one_or_none() is None:
+            return BorrowStatus.BOOK_NOT_FOUND, None
+        return BorrowStatus.READER_NOT_FOUND, None
+
+    status = None
+    if reader.copies is None:
+        status = BorrowStatus.BOOK_NOT_FOUND
+    elif reader.copies < 1:
+        status = BorrowStatus.NO_COPIES
+    elif reader.active_borrow_count >= BORROW_LIMIT:
+        status = BorrowStatus.LIMIT_REACHED
+    if status is not None:
+        return status, None
+
+    today = date.today()
+    result = await session.execute(lend_statement(), {
+        "book_id": book_id, "reader_id": reader_id, "today": today, "due_date": today + timedelta(days=LOAN_DAYS),
+        "shard": stats_shard(reader_id),
+    })
+    row = result.one()
+
+    if row.id is not None:
+        book = book_from_row(row)
+        after_commit(session, lambda: cache_book(book))
+        return BorrowStatus.OK, row
+
+    if row.duplicate:
+        return BorrowStatus.ALREADY_BORROWED, None
+    # The last copy was taken by a concurrent lend after our snapshot.
+    return BorrowStatus.NO_COPIES, None
+
+
+# The return statement, precompiled like lend_statement() with borrow_id, reader_id, today and shard parameters.
+# The borrow record is only updated while it is still open and belongs to the reader, the reader's active borrow
+# counter, the book's copies and the daily circulation are updated in the same statement, and the original record
+# is read alongside so failures can be told apart.
+@lru_cache(maxsize=None)
+def return_statement() -> TextClause:
+    borrow_id = bindparam("borrow_id", type_=Integer)
+    target = (
+        select(BorrowedBook.reader_id, BorrowedBook.return_date)
+        .where(BorrowedBook.id == borrow_id)
+        .cte("target")
+    )
+    returned = (
+        update(BorrowedBook)
+        .where(
+            BorrowedBook.id == borrow_id,
+            BorrowedBook.reader_id == bindparam("reader_id", type_=BIGINT),
+            BorrowedBook.return_date.is_(None),
+        )
+        .values(return_date=bindparam("today", type_=Date))
+        .returning(*BorrowedBook.__table__.c)
+        .cte("returned")
+    )
+    # The reader row is locked before the book row, in the same order as lending, so the two cannot deadlock.
+    uncounted = (
+        update(Reader)
+        .where(Reader.id == select(returned.c.reader_id).scalar_subquery())
+        .values(active_borrow_count=Reader.active_borrow_count - 1)
+        .returning(Reader.id)
+        .cte("uncounted")
+    )
+    restocked = (
+        update(Book)
+        .where(Book.id == select(returned.c.book_id).scalar_subquery(), exists().select_from(uncounted))
+        .values(copy=Book.copy + 1, version=Book.version + 1)
+        .returning(*(Book.__table__.c[column] for column in BOOK_CACHE_COLUMNS))
+        .cte("restocked")
+    )
+
+    recorded = record_return(returned, restocked, bindparam("shard", type_=SmallInteger))
+
+    return precompile(
+        select(
+            target.c.reader_id.label("owner_id"),
+            target.c.return_date.label("returned_on"),
+            restocked.c.id.label("restocked_id"),
+            *returned.c,
+            *book_columns(restocked),
+        )
+        .select_from(target.outerjoin(returned, true()).outerjoin(restocked, true()).outerjoin(recorded, true()))
+    )
+
+
+# Returns a book with a single statement, in the session's transaction like lending (roll back on any status but OK).
+async def return_book_atomic(session: AsyncSession, borrow_id: int, reader_id: int) -> tuple[BorrowStatus, Row | None]:
+    result = await session.execute(return_statement(), {
+        "borrow_id": borrow_id, "reader_id": reader_id, "today": date.today(), "shard": stats_shard(reader_id),
+    })
+    row = result.one_or_none()
+
+    if row is not None and row.id is not None and row.restocked_id is not None:
+        book = book_from_row(row)
+        after_commit(session, lambda: cache_book(book))
+        return BorrowStatus.OK, row
+
+    if row is None:
+        return BorrowStatus.BORROW_NOT_FOUND, None
+    if row.id is not None:
+        return BorrowStatus.BOOK_NOT_FOUND, None
+    if row.returned_on is not None:
+        return BorrowStatus.ALREADY_RETURNED, None
+    if row.owner_id != reader_id:
+        return BorrowStatus.WRONG_READER, None
+    # Returned by a concurrent request after our snapshot.
+    return BorrowStatus.ALREADY_RETURNED, None
+
+
+# Locks every row a circulation batch may update before running it: the returned borrow records, the readers, the
+# books, then the summaries, in the order a single return or lend takes them and by id within each table.
+# Concurrent batches and single requests then all acquire their locks in one global order and cannot deadlock
+# (short of two batches creating the same new per-book or per-reader summary row).
+async def lock_batch_rows(session: AsyncSession, operations: list[dict]) -> None:
+    borrow_ids = sorted({operation["borrow_id"] for operation in operations if operation["op"] == "return"})
+    reader_ids = sorted({operation["reader_id"] for operation in operations})
+    book_ids = {operation["book_id"] for operation in operations if operation["op"] == "lend"}
+    if borrow_ids:
+        result = await session.execute(
+            select(BorrowedBook.book_id).where(BorrowedBook.id.in_(borrow_ids))
+            .order_by(BorrowedBook.id).with_for_update(key_share=True)
+        )
+        book_ids.update(result.scalars())
+    await session.execute(
+        select(Reader.id).where(Reader.id.in_(reader_ids)).order_by(Reader.id).with_for_update(key_share=True)
+    )
+    book_ids = sorted(book_ids)
+    if book_ids:
+        await session.execute(
+            select(Book.id).where(Book.id.in_(book_ids)).order_by(Book.id).with_for_update(key_share=True)
+        )
+    await lock_circulation_summaries(session, book_ids, reader_ids)
+
+
+# Runs a circulation batch in the session's transaction, which the caller commits once. Operations run in the order
+# given, as if sent one by one, each in its own savepoint that is rolled back when its status is not OK, so a failed
+# lend or return is undone alone and the others stay. Returns (status, borrow row) per operation.
+async def run_circulation_batch(session: AsyncSession, operations: list[dict]) -> list[tuple[BorrowStatus, Row | None]]:
+    await lock_batch_rows(session, operations)
+    outcomes = []
+    for operation in operations:
+        async with session.begin_nested() as savepoint:
+            if operation["op"] == "lend":
+                outcome = await lend_book_atomic(session, operation["book_id"], operation["reader_id"])
+            else:
+                outcome = await return_book_atomic(session, operation["borrow_id"], operation["reader_id"])
+            if outcome[0] is not BorrowStatus.OK:
+                await savepoint.rollback()
+        outcomes.append(outcome)
+    return outcomes
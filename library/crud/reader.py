@@ -1,14 +1,57 @@
+from typing import AsyncIterator
+from sqlalchemy import update, Row
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from library.crud.stats import record_cancelled_borrows
 from library.models import Reader
 
+# How many readers are fetched from the server-side cursor at a time while streaming.
+READER_STREAM_BATCH = 500
 
-async def get_readers(session: AsyncSession) -> list[Reader]:
-    result = await session.execute(select(Reader))
-    readers = result.scalars().all()
+# Columns of ReaderOut plus version for the ETag, the list queries return them as plain rows
+READER_LIST_COLUMNS = (Reader.id, Reader.full_name, Reader.email, Reader.version)
+
+
+async def get_readers(session: AsyncSession, skip: int = 0, limit: int = 10) -> list[Row]:
+    result = await session.execute(select(*READER_LIST_COLUMNS).order_by(Reader.id).offset(skip).limit(limit))
+    readers = result.all()
+    return readers
+
+
+# Keyset pagination: seeks past after_id on the primary key instead of skipping rows with OFFSET.
+async def get_readers_after(session: AsyncSession, after_id: int | None = None, limit: int = 10) -> list[Row]:
+    stmt = select(*READER_LIST_COLUMNS).order_by(Reader.id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(Reader.id > after_id)
+    result = await session.execute(stmt)
+    readers = result.all()
     return readers
 
 
+# Yields all readers in batches from a server-side cursor, so only one batch is held in memory at a time.
+async def stream_readers(session: AsyncSession, batch_size: int = READER_STREAM_BATCH) -> AsyncIterator[list[Reader]]:
+    result = await session.stream_scalars(
+        select(Reader).order_by(Reader.id).execution_options(yield_per=batch_size)
+    )
+    async for readers in result.partitions():
+        yield readers
+
+
+# (id, version) of the rows get_readers or get_readers_after return for the same arguments, to tag a page without loading it.
+async def get_reader_versions(session: AsyncSession, skip: int = 0, limit: int = 10,
+                              after_id: int | None = None) -> list[tuple[int, int]]:
+    stmt = select(Reader.id, Reader.version).order_by(Reader.id).offset(skip).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(Reader.id > after_id)
+    result = await session.execute(stmt)
+    return result.all()
+
+
+async def get_reader_version(session: AsyncSession, reader_id: int) -> int | None:
+    result = await session.execute(select(Reader.version).where(Reader.id == reader_id))
+    return result.scalar_one_or_none()
+
+
 async def get_reader_by_id(session: AsyncSession, reader_id: int) -> Reader:
     result = await session.execute(select(Reader).filter(Reader.id == reader_id))
     reader = result.scalar_one_or_none()
@@ -18,27 +61,29 @@ async def get_reader_by_id(session: AsyncSession, reader_id: int) -> Reader:
 async def create_reader_db(session: AsyncSession, reader_data: dict) -> Reader:
     reader = Reader(**reader_data)
     session.add(reader)
-    await session.commit()
-    await session.refresh(reader)
+    await session.flush()
     return reader
 
 
+# A single UPDATE ... RETURNING, the version is bumped in SQL so concurrent writers never reuse one.
 async def update_reader_db(session: AsyncSession, reader_id: int, reader_data: dict) -> Reader:
-    reader = await get_reader_by_id(session, reader_id)
-    if reader:
-        for key, value in reader_data.items():
-            setattr(reader, key, value)
-
-        await session.commit()
-        await session.refresh(reader)
-        return reader
-    return None
+    result = await session.execute(
+        update(Reader)
+        .where(Reader.id == reader_id)
+        .values(**reader_data, version=Reader.version + 1)
+        .returning(Reader)
+        .execution_options(populate_existing=True)
+    )
+    reader = result.scalar_one_or_none()
+    return reader
 
 
 async def delete_reader_db(session: AsyncSession, reader_id: int) -> bool:
     reader = await get_reader_by_id(session, reader_id)
     if reader:
+        # Its open borrows go with it through the cascade
+        await record_cancelled_borrows(session, reader.active_borrow_count, reader.id)
         await session.delete(reader)
-        await session.commit()
+        await session.flush()
         return True
     return False
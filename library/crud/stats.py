@@ -0,0 +1,173 @@
+from datetime import date
+from sqlalchemy import func, literal, exists, text, Integer
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from library.models import Book, Reader, DailyCirculation, BookCirculation, ReaderCirculation
+
+# Rows each day is split into, a reader always lands on the same one.
+STATS_SHARDS = 16
+
+
+def stats_shard(reader_id: int) -> int:
+    return reader_id % STATS_SHARDS
+
+
+# Adds one to a (day, shard) row of daily_circulation for each row of source, creating the row on the day's first event.
+# shard is a SQL expression, the lend and return statements pass it as a parameter.
+def count_daily(source, day, shard, column: str):
+    stmt = insert(DailyCirculation).from_select(
+        ["day", "shard", column],
+        source.with_only_columns(day, shard, literal(1, Integer)),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[DailyCirculation.day, DailyCirculation.shard],
+        set_={column: getattr(DailyCirculation, column) + 1},
+    )
+
+
+# Adds one borrow to the per-book or per-reader summary of the borrow's book or reader.
+def count_borrow(model, key: str, borrow):
+    stmt = insert(model).from_select(
+        [key, "borrow_count", "last_borrowed"],
+        select(borrow.c[key], literal(1, Integer), borrow.c.borrow_date),
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=[getattr(model, key)],
+        set_={"borrow_count": model.borrow_count + 1, "last_borrowed": stmt.excluded.last_borrowed},
+    )
+
+
+# CTEs recording a new borrow in the summaries, borrow is the CTE returning the inserted record and shard the
+# expression giving stats_shard() of its reader.
+# They read from borrow, so Postgres only runs them after the reader and book rows are locked.
+def record_borrow(borrow, shard) -> list:
+    daily = count_daily(select(borrow.c.id), borrow.c.borrow_date, shard, "borrows")
+    return [
+        daily.returning(DailyCirculation.day).cte("daily_borrowed"),
+        count_borrow(BookCirculation, "book_id", borrow).returning(BookCirculation.book_id).cte("book_borrowed"),
+        count_borrow(ReaderCirculation, "reader_id", borrow).returning(ReaderCirculation.reader_id)
+        .cte("reader_borrowed"),
+    ]
+
+
+# CTE recording a return, only once the book was restocked (so after the book row lock, as in lending).
+def record_return(returned, restocked, shard):
+    source = select(returned.c.id).where(exists().select_from(restocked))
+    daily = count_daily(source, returned.c.return_date, shard, "returns")
+    return daily.returning(DailyCirculation.day).cte("daily_returned")
+
+
+# Open borrows that a book or reader deletion removes through the cascade, so books_out stays right.
+async def record_cancelled_borrows(session: AsyncSession, count: int, reader_id: int = 0) -> None:
+    if not count:
+        return
+    await session.execute(
+        insert(DailyCirculation)
+        .values(day=date.today(), shard=stats_shard(reader_id), cancelled=count)
+        .on_conflict_do_update(
+            index_elements=[DailyCirculation.day, DailyCirculation.shard],
+            set_={"cancelled": DailyCirculation.cancelled + count},
+        )
+    )
+
+
+# Creates and locks the summary rows a circulation batch updates, each table in key order, so concurrent batches take
+# them in the same order instead of deadlocking. Today's daily rows are created ahead of their first event,
+# the per-book and per-reader rows are only locked when they exist.
+async def lock_circulation_summaries(session: AsyncSession, book_ids: list[int], reader_ids: list[int]) -> None:
+    today = date.today()
+    shards = sorted({stats_shard(reader_id) for reader_id in reader_ids})
+    if shards:
+        await session.execute(
+            insert(DailyCirculation).values([{"day": today, "shard": shard} for shard in shards]).on_conflict_do_nothing()
+        )
+        await session.execute(
+            select(DailyCirculation.shard)
+            .where(DailyCirculation.day == today, DailyCirculation.shard.in_(shards))
+            .order_by(DailyCirculation.shard)
+            .with_for_update()
+        )
+    if book_ids:
+        await session.execute(
+            select(BookCirculation.book_id).where(BookCirculation.book_id.in_(book_ids))
+            .order_by(BookCirculation.book_id).with_for_update()
+        )
+    if reader_ids:
+        await session.execute(
+            select(ReaderCirculation.reader_id).where(ReaderCirculation.reader_id.in_(reader_ids))
+            .order_by(ReaderCirculation.reader_id).with_for_update()
+        )
+
+
+# Totals over the daily rows, which grow with the number of days and not with the borrow history.
+async def get_circulation_summary(session: AsyncSession) -> dict:
+    today = date.today()
+    result = await session.execute(select(
+        func.coalesce(func.sum(DailyCirculation.borrows), 0).label("total_borrows"),
+        func.coalesce(func.sum(DailyCirculation.returns), 0).label("total_returns"),
+        func.coalesce(func.sum(DailyCirculation.borrows - DailyCirculation.returns - DailyCirculation.cancelled), 0)
+        .label("books_out"),
+        func.coalesce(func.sum(DailyCirculation.borrows).filter(DailyCirculation.day == today), 0)
+        .label("borrows_today"),
+        func.coalesce(func.sum(DailyCirculation.returns).filter(DailyCirculation.day == today), 0)
+        .label("returns_today"),
+    ))
+    return dict(result.one()._mapping)
+
+
+async def get_daily_circulation(session: AsyncSession, start: date, end: date) -> list:
+    result = await session.execute(
+        select(
+            DailyCirculation.day,
+            func.sum(DailyCirculation.borrows).label("borrows"),
+            func.sum(DailyCirculation.returns).label("returns"),
+        )
+        .where(DailyCirculation.day.between(start, end))
+        .group_by(DailyCirculation.day)
+        .order_by(DailyCirculation.day)
+    )
+    return result.all()
+
+
+# Walks the borrow_count index from the top, so it reads about limit rows.
+async def get_top_books(session: AsyncSession, limit: int = 10) -> list:
+    result = await session.execute(
+        select(Book.id, Book.title, Book.author, BookCirculation.borrow_count, BookCirculation.last_borrowed)
+        .join(Book, Book.id == BookCirculation.book_id)
+        .order_by(BookCirculation.borrow_count.desc())
+        .limit(limit)
+    )
+    return result.all()
+
+
+async def get_top_readers(session: AsyncSession, limit: int = 10) -> list:
+    result = await session.execute(
+        select(Reader.id, Reader.full_name, ReaderCirculation.borrow_count, ReaderCirculation.last_borrowed)
+        .join(Reader, Reader.id == ReaderCirculation.reader_id)
+        .order_by(ReaderCirculation.borrow_count.desc())
+        .limit(limit)
+    )
+    return result.all()
+
+
+# Recomputes every summary from borrowed_books, after loading data that bypassed lending (seeding, restores).
+# This is the one place that scans the whole history.
+async def rebuild_circulation_stats(session: AsyncSession) -> None:
+    await session.execute(text("TRUNCATE daily_circulation, book_circulation, reader_circulation"))
+    await session.execute(text(
+        "INSERT INTO daily_circulation (day, shard, borrows, returns, cancelled) "
+        "SELECT day, shard, sum(borrows), sum(returns), 0 FROM ("
+        "SELECT borrow_date AS day, reader_id % :shards AS shard, 1 AS borrows, 0 AS returns FROM borrowed_books "
+        "UNION ALL "
+        "SELECT return_date, reader_id % :shards, 0, 1 FROM borrowed_books WHERE return_date IS NOT NULL"
+        ") AS events GROUP BY day, shard"
+    ), {"shards": STATS_SHARDS})
+    await session.execute(text(
+        "INSERT INTO book_circulation (book_id, borrow_count, last_borrowed) "
+        "SELECT book_id, count(*), max(borrow_date) FROM borrowed_books GROUP BY book_id"
+    ))
+    await session.execute(text(
+        "INSERT INTO reader_circulation (reader_id, borrow_count, last_borrowed) "
+        "SELECT reader_id, count(*), max(borrow_date) FROM borrowed_books GROUP BY reader_id"
+    ))
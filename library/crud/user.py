@@ -1,20 +1,30 @@
 from sqlalchemy.future import select
 from sqlalchemy.ext.asyncio import AsyncSession
+from library.database import after_commit
 from library.models import User
-from library.utils import hash_password
+from library.utils import hash_password, invalidate_principal, revoke_user_tokens, DELETED_USER_VERSION
 
 
 async def create_user(session: AsyncSession, user_data: dict) -> User:
     user_data['password'] = await hash_password(user_data['password'])
     user = User(**user_data)
     session.add(user)
-    await session.commit()
-    await session.refresh(user)
+    await session.flush()
     return user
 
 
 async def get_users(session: AsyncSession, skip: int = 0, limit: int = 10) -> list[User]:
-    result = await session.execute(select(User).offset(skip).limit(limit))
+    result = await session.execute(select(User).order_by(User.id).offset(skip).limit(limit))
+    users = result.scalars().all()
+    return users
+
+
+# Keyset pagination: seeks past after_id on the primary key instead of skipping rows with OFFSET.
+async def get_users_after(session: AsyncSession, after_id: int | None = None, limit: int = 10) -> list[User]:
+    stmt = select(User).order_by(User.id).limit(limit)
+    if after_id is not None:
+        stmt = stmt.where(User.id > after_id)
+    result = await session.execute(stmt)
     users = result.scalars().all()
     return users
 
@@ -31,14 +41,25 @@ async def get_user_by_id(session: AsyncSession, user_id: int) -> User:
     return user
 
 
+# Stores a rehashed password without touching token_version, so existing tokens stay valid.
+async def update_user_password_hash(session: AsyncSession, user: User, password_hash: str) -> User:
+    user.password = password_hash
+    await session.flush()
+    after_commit(session, lambda: invalidate_principal(user.email))
+    return user
+
+
 async def update_user(session: AsyncSession, user_id: int, user_data: dict) -> User:
     user = await get_user_by_id(session, user_id)
     if user:
+        old_email = user.email
         for key, value in user_data.items():
             setattr(user, key, value)
+        user.token_version += 1
 
-        await session.commit()
-        await session.refresh(user)
+        await session.flush()
+        after_commit(session, lambda: invalidate_principal(old_email))
+        after_commit(session, lambda: revoke_user_tokens(user.id, user.token_version))
         return user
     return None
 
@@ -47,6 +68,8 @@ async def delete_user(session: AsyncSession, user_id: int) -> bool:
     user = await get_user_by_id(session, user_id)
     if user:
         await session.delete(user)
-        await session.commit()
+        await session.flush()
+        after_commit(session, lambda: invalidate_principal(user.email))
+        after_commit(session, lambda: revoke_user_tokens(user.id, DELETED_USER_VERSION))
         return True
     return False
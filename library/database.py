@@ -1,23 +1,89 @@
-from typing import Annotated
+import inspect
+from typing import Annotated, Any, Callable
 from fastapi import Depends
+from sqlalchemy import bindparam, text, TextClause
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
 
 from library.config import DBConfig
+from library.metrics import instrument_engine
 
 DATABASE_URL = DBConfig.DB_URL
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+# Builds an engine with the pool settings from DBConfig (pool_size and max_overflow can be overridden),
+# extra server settings are sent on every new connection
+def create_engine_from_config(url: str, pool_size: int | None = None, max_overflow: int | None = None,
+                              **server_settings):
+    return create_async_engine(
+        url,
+        echo=DBConfig.DB_ECHO,
+        pool_size=DBConfig.DB_POOL_SIZE if pool_size is None else pool_size,
+        max_overflow=DBConfig.DB_MAX_OVERFLOW if max_overflow is None else max_overflow,
+        pool_timeout=DBConfig.DB_POOL_TIMEOUT,
+        pool_recycle=DBConfig.DB_POOL_RECYCLE,
+        pool_pre_ping=DBConfig.DB_POOL_PRE_PING,
+        connect_args={
+            "prepared_statement_cache_size": DBConfig.DB_STATEMENT_CACHE_SIZE,
+            "statement_cache_size": DBConfig.DB_STATEMENT_CACHE_SIZE,
+            "server_settings": {"statement_timeout": str(DBConfig.DB_STATEMENT_TIMEOUT), **server_settings},
+        },
+    )
+
+
+engine = create_engine_from_config(DATABASE_URL)
+instrument_engine(engine, "primary")
 
 AsyncSessionLocal = sessionmaker(
     engine, class_=AsyncSession, expire_on_commit=False
 )
 
 
+# One transaction per request: crud functions only flush, the transaction is committed once after the endpoint
+# returns (before the response is sent) and rolled back if it raises.
 async def get_session():
     async with AsyncSessionLocal() as session:
-        yield session
+        async with session.begin():
+            yield session
+        await run_after_commit(session)
 
 # Returns database session as a dependency for FastAPI endpoints.
 SessionDep = Annotated[AsyncSession, Depends(get_session)]
+
+
+# Registers work that must only happen once the session's transaction is committed, such as cache writes and
+# invalidations, so nothing outside the database ever sees uncommitted data. The callback may be async.
+def after_commit(session: AsyncSession, callback: Callable[[], Any]) -> None:
+    session.info.setdefault("after_commit", []).append(callback)
+
+
+async def run_after_commit(session: AsyncSession) -> None:
+    for callback in session.info.pop("after_commit", []):
+        result = callback()
+        if inspect.isawaitable(result):
+            await result
+
+
+# SQLAlchemy never caches the compiled SQL of a statement containing a Postgres INSERT ... ON CONFLICT, so such a
+# statement would be compiled again on every execution. This compiles one, built with bindparam() placeholders,
+# once into an equivalent text() statement that is executed with the same named parameters and no compilation.
+def precompile(stmt) -> TextClause:
+    compiled = stmt.compile(dialect=postgresql.dialect(paramstyle="named"))
+    return text(str(compiled)).bindparams(
+        *(bindparam(name, value=param.value, type_=param.type) for param, name in compiled.bind_names.items())
+    )
+
+
+# Current state of the connection pool, to size it from real numbers
+def get_pool_stats() -> dict:
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "max_overflow": DBConfig.DB_MAX_OVERFLOW,
+        "timeout": DBConfig.DB_POOL_TIMEOUT,
+        "status": pool.status(),
+    }
@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException
-from library.crud import get_user_by_email, create_user
+from fastapi import APIRouter, HTTPException, Query
+from library.crud import get_user_by_email, get_users, get_users_after, create_user, update_user_password_hash
 from library.database import SessionDep
-from library.schemas import UserCreate
-from library.utils import verify_password, create_access_token
+from library.pagination import decode_cursor, make_page
+from library.replicas import ReadSessionDep
+from library.schemas import UserCreate, UserOut, UserPage
+from library.serialization import json_response
+from library.utils import verify_and_update_password, create_access_token, revoke_token, CurrentUser, TokenPayload
 
 router = APIRouter(prefix="/auth", tags=["Authentication"])
 
@@ -25,8 +28,32 @@ async def login_user(session: SessionDep, user_data: UserCreate):
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    if not await verify_password(user_data.password, user.password):
+    verified, new_hash = await verify_and_update_password(user_data.password, user.password)
+    if not verified:
         raise HTTPException(status_code=401, detail="Incorrect password")
 
-    access_token = await create_access_token(data={"sub": user.email})
+    # The hash was made with an older BCRYPT_ROUNDS, store it with the current cost
+    if new_hash:
+        await update_user_password_hash(session, user, new_hash)
+
+    # uid and ver let stateless mode describe the user without a lookup, ver also allows revoking old tokens
+    access_token = await create_access_token(data={"sub": user.email, "uid": user.id, "ver": user.token_version})
     return {"access_token": access_token, "token_type": "bearer"}
+
+
+@router.post("/logout/")
+async def logout_user(current_user: CurrentUser, payload: TokenPayload):
+    if payload.get("jti"):
+        await revoke_token(payload["jti"])
+    return {"message": "Logged out successfully"}
+
+
+# Paginated like GET /books/: skip/limit returns a plain list, cursor (empty for the first page) a keyset UserPage.
+@router.get("/users/", response_model=list[UserOut] | UserPage)
+async def get_users_list(session: ReadSessionDep, current_user: CurrentUser,
+                         skip: int = 0, limit: int = Query(10, ge=1, le=100), cursor: str | None = None):
+    if cursor is None:
+        return json_response(list[UserOut], await get_users(session, skip, limit))
+
+    users = await get_users_after(session, decode_cursor(cursor), limit + 1)
+    return json_response(UserPage, make_page(users, limit))
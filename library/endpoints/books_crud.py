@@ -1,23 +1,62 @@
-from fastapi import APIRouter, HTTPException
-from library.crud.book import get_books, get_book_by_id, create_book_db, update_book_db, delete_book_db
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from library.book_import import iter_import_records, import_books
+from library.crud.book import get_books, get_books_after, get_book_versions, search_books, get_book_by_id, \
+    create_book_db, update_book_db, delete_book_db
 from library.database import SessionDep
-from library.schemas import BookOut, BookCreate, BookPutUpdate, BookPatchUpdate
+from library.etag import resource_etag, collection_etag, etag_matches, not_modified
+from library.replicas import ReadSessionDep
+from library.pagination import decode_cursor, make_page
+from library.schemas import BookOut, BookCreate, BookPutUpdate, BookPatchUpdate, BookPage
+from library.serialization import json_response
 from library.utils import CurrentUser
 
 router = APIRouter(prefix="/books", tags=["Books"])
 
 
-@router.get("/", response_model=list[BookOut])
-async def get_books_list(session: SessionDep, current_user: CurrentUser, skip: int = 0, limit: int = 10):
-    books = await get_books(session, skip, limit)
-    return books
+# Without a cursor it keeps the old skip/limit behaviour and returns a plain list.
+# Passing cursor (empty for the first page) switches to keyset pagination and returns a BookPage.
+# The page carries a collection ETag, a matching If-None-Match is answered from the ids and versions alone.
+# Rows are serialized in bulk by json_response, response_model only documents the shape.
+@router.get("/", response_model=list[BookOut] | BookPage)
+async def get_books_list(request: Request, session: ReadSessionDep, current_user: CurrentUser,
+                         skip: int = 0, limit: int = Query(10, ge=1, le=100), cursor: str | None = None):
+    after_id = decode_cursor(cursor) if cursor is not None else None
+    if request.headers.get("If-None-Match"):
+        versions = await get_book_versions(session, skip if cursor is None else 0,
+                                           limit if cursor is None else limit + 1, after_id)
+        if etag_matches(request, collection_etag(versions)):
+            return not_modified(collection_etag(versions))
 
+    if cursor is None:
+        books = await get_books(session, skip, limit)
+        etag = collection_etag([(book.id, book.version) for book in books])
+        return json_response(list[BookOut], books, headers={"ETag": etag})
 
+    books = await get_books_after(session, after_id, limit + 1)
+    etag = collection_etag([(book.id, book.version) for book in books])
+    return json_response(BookPage, make_page(books, limit), headers={"ETag": etag})
+
+
+# Declared before /{book_id} so "search" is not taken for an id.
+@router.get("/search", response_model=list[BookOut])
+async def search_books_list(session: ReadSessionDep, current_user: CurrentUser, q: str = Query(min_length=1),
+                            skip: int = 0, limit: int = Query(10, ge=1, le=100)):
+    books = await search_books(session, q, skip, limit)
+    return json_response(list[BookOut], books)
+
+
+# Served from the book cache and tagged with the book's version, a matching If-None-Match returns 304
 @router.get("/{book_id}", response_model=BookOut)
-async def get_book(book_id: int, session: SessionDep, current_user: CurrentUser):
-    book = await get_book_by_id(session, book_id)
+async def get_book(book_id: int, request: Request, response: Response, session: ReadSessionDep,
+                   current_user: CurrentUser):
+    book = await get_book_by_id(session, book_id, cached=True)
     if not book:
         raise HTTPException(status_code=404, detail="Book not found")
+
+    etag = resource_etag(book.id, book.version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    response.headers["ETag"] = etag
     return book
 
 
@@ -27,6 +66,14 @@ async def create_book(session: SessionDep, current_user: CurrentUser, book_data:
     return book
 
 
+# Imports a catalog streamed as CSV (with a header row) or NDJSON, upserting on isbn.
+# Valid rows are loaded with COPY in chunks, invalid ones are reported by line number.
+@router.post("/bulk")
+async def bulk_import_books(request: Request, session: SessionDep, current_user: CurrentUser):
+    report = await import_books(session, iter_import_records(request))
+    return report
+
+
 @router.patch("/patch/{book_id}", response_model=BookOut)
 async def patch_update_book(book_id: int, session: SessionDep, current_user: CurrentUser, book_data: BookPatchUpdate):
     update_data = {k: v for k, v in book_data.model_dump().items() if v is not None}
@@ -1,76 +1,110 @@
-from fastapi import APIRouter, HTTPException
-from library.crud import get_reader_by_id
-from library.crud.book import get_book_by_id
+from datetime import date
+from fastapi import APIRouter, HTTPException, Query
 from library.crud.borrow import *
 from library.database import SessionDep
-from library.schemas import BorrowOut, BorrowInput, ReturnInput
+from library.replicas import ReadSessionDep
+from library.schemas import BorrowOut, BorrowExpandedOut, BorrowInput, ReturnInput, CirculationBatch, \
+    CirculationBatchOut
 from library.utils import CurrentUser
 
 router = APIRouter(prefix="/books", tags=["Borrowing"])
 
 
-@router.post("/lend", response_model=BorrowOut)
-async def lend_book(data: BorrowInput, session: SessionDep, current_user: CurrentUser):
-    book = await get_book_by_id(session, data.book_id)
-    if not book:
-        raise HTTPException(status_code=404, detail="Book not found")
-
-    reader = await get_reader_by_id(session, data.reader_id)
-    if not reader:
-        raise HTTPException(status_code=404, detail="Reader not found")
+# Maps a failed lend to the HTTP error returned to the client.
+LEND_ERRORS = {
+    BorrowStatus.BOOK_NOT_FOUND: (404, "Book not found"),
+    BorrowStatus.READER_NOT_FOUND: (404, "Reader not found"),
+    BorrowStatus.NO_COPIES: (400, "No available copies"),
+    BorrowStatus.LIMIT_REACHED: (400, f"Reader has reached the borrow limit ({BORROW_LIMIT} books)"),
+    BorrowStatus.ALREADY_BORROWED: (400, "Reader already borrowed this book and has not returned it"),
+}
 
-    if book.copy < 1:
-        raise HTTPException(status_code=400, detail="No available copies")
 
-    active_borrows = await count_active_borrows(session, data.reader_id)
-    if active_borrows >= 3:
-        raise HTTPException(status_code=400, detail="Reader has reached the borrow limit (3 books)")
+@router.post("/lend", response_model=BorrowOut)
+async def lend_book(data: BorrowInput, session: SessionDep, current_user: CurrentUser):
+    status, borrow_record = await lend_book_atomic(session, data.book_id, data.reader_id)
+    if status is not BorrowStatus.OK:
+        status_code, detail = LEND_ERRORS[status]
+        raise HTTPException(status_code=status_code, detail=detail)
 
-    already_borrowed = await has_active_borrow(session, data.reader_id, data.book_id)
-    if already_borrowed:
-        raise HTTPException(status_code=400, detail="Reader already borrowed this book and has not returned it")
+    return borrow_record
 
-    await update_book_copies(session, book, decrement=True)
-    borrow_record = await create_borrow_record(session, data.book_id, data.reader_id)
 
-    return borrow_record
+# Maps a failed return to the HTTP error returned to the client.
+RETURN_ERRORS = {
+    BorrowStatus.BORROW_NOT_FOUND: (404, "Borrow record not found"),
+    BorrowStatus.ALREADY_RETURNED: (400, "Book already returned"),
+    BorrowStatus.WRONG_READER: (403, "This book was not borrowed by this reader"),
+    BorrowStatus.BOOK_NOT_FOUND: (404, "Book not found"),
+}
 
 
 @router.post("/return", response_model=BorrowOut)
 async def return_book(data: ReturnInput, session: SessionDep, current_user: CurrentUser):
-    borrow = await get_borrow_record(session, data.borrow_id)
-    if not borrow:
-        raise HTTPException(status_code=404, detail="Borrow record not found")
-
-    if borrow.return_date is not None:
-        raise HTTPException(status_code=400, detail="Book already returned")
-
-    if borrow.reader_id != data.reader_id:
-        raise HTTPException(status_code=403, detail="This book was not borrowed by this reader")
-
-    book = await get_book_by_id(session, borrow.book_id)
-    if not book:
-        raise HTTPException(status_code=404, detail="Book not found")
-
-    await update_borrow_record(session, borrow.id)
-
-    await update_book_copies(session, book, decrement=False)
+    status, borrow = await return_book_atomic(session, data.borrow_id, data.reader_id)
+    if status is not BorrowStatus.OK:
+        status_code, detail = RETURN_ERRORS[status]
+        raise HTTPException(status_code=status_code, detail=detail)
 
-    await session.refresh(borrow)
     return borrow
 
 
-@router.get("/borrows/{reader_id}", response_model=list[BorrowOut])
-async def get_borrows_by_reader(reader_id: int, session: SessionDep, current_user: CurrentUser):
-    borrows = await get_borrowed_books_by_reader(session, reader_id)
+# Lends and returns in one request and one transaction, each operation with its own savepoint.
+# The batch always answers 200, every result carries the status code the single endpoint would have returned.
+@router.post("/circulation/batch", response_model=CirculationBatchOut)
+async def circulation_batch(data: CirculationBatch, session: SessionDep, current_user: CurrentUser):
+    outcomes = await run_circulation_batch(session, [operation.model_dump() for operation in data.operations])
+
+    results = []
+    for index, (operation, (status, borrow)) in enumerate(zip(data.operations, outcomes)):
+        errors = LEND_ERRORS if operation.op == "lend" else RETURN_ERRORS
+        status_code, detail = errors.get(status, (200, None))
+        results.append({"index": index, "op": operation.op, "status": status.value, "status_code": status_code,
+                        "detail": detail, "borrow": borrow})
+    succeeded = sum(result["status_code"] == 200 for result in results)
+    return {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
+
+
+# Turns expand=book,reader into the relations to load along with the borrows.
+def parse_expand(expand: str | None) -> list[str]:
+    names = [name.strip() for name in expand.split(",") if name.strip()] if expand else []
+    unknown = sorted(set(names) - BORROW_EXPANSIONS.keys())
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Cannot expand: {', '.join(unknown)}")
+    return list(dict.fromkeys(names))
+
+
+# Only the expanded relations are set, so with exclude_unset the others are left out instead of sent as null.
+def expanded_borrows(borrows: list[BorrowedBook], expand: list[str]) -> list[dict]:
+    return [
+        {
+            **{field: getattr(borrow, field) for field in BorrowOut.model_fields},
+            **{name: getattr(borrow, name) for name in expand},
+        }
+        for borrow in borrows
+    ]
+
+
+# Borrow history ordered by borrow_date. skip/limit page through it (all of it without a limit),
+# expand=book,reader includes the related rows, loaded in the same query, and since/until limit it to a range of
+# borrow dates, which only reads the years in that range.
+@router.get("/borrows/{reader_id}", response_model=list[BorrowExpandedOut], response_model_exclude_unset=True)
+async def get_borrows_by_reader(reader_id: int, session: ReadSessionDep, current_user: CurrentUser,
+                                expand: str | None = None, skip: int = 0, limit: int | None = Query(None, ge=1),
+                                since: date | None = None, until: date | None = None):
+    expand = parse_expand(expand)
+    borrows = await get_borrowed_books_by_reader(session, reader_id, expand, skip, limit, since, until)
     if not borrows:
         raise HTTPException(status_code=404, detail="Reader has no borrowed books")
-    return borrows
+    return expanded_borrows(borrows, expand)
 
 
-@router.get("/borrows/notreturn/{reader_id}", response_model=list[BorrowOut])
-async def get_borrows_by_reader(reader_id: int, session: SessionDep, current_user: CurrentUser):
-    borrows = await get_not_returned_books_by_reader(session, reader_id)
+@router.get("/borrows/notreturn/{reader_id}", response_model=list[BorrowExpandedOut],
+            response_model_exclude_unset=True)
+async def get_borrows_by_reader(reader_id: int, session: ReadSessionDep, current_user: CurrentUser,
+                                expand: str | None = None, skip: int = 0, limit: int | None = Query(None, ge=1)):
+    expand = parse_expand(expand)
+    borrows = await get_not_returned_books_by_reader(session, reader_id, expand, skip, limit)
     if not borrows:
         raise HTTPException(status_code=404, detail="Reader has no borrowed books")
-    return borrows
+    return expanded_borrows(borrows, expand)
@@ -0,0 +1,40 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from library.crud.book import get_book_cache_stats
+from library.database import get_pool_stats
+from library.hashing import get_hashing_stats
+from library.jobs import overdue_totals
+from library.metrics import Counter, Gauge, render_metrics
+from library.replicas import replicas
+from library.utils import principal_cache
+
+router = APIRouter(tags=["System"])
+
+# Values the app already tracks elsewhere, read when /metrics is scraped so they cost nothing per request
+Gauge("db_pool_connections", "Connections of the primary pool by state", ("state",), collect=lambda: {
+    (state,): value for state, value in get_pool_stats().items() if state in ("size", "checked_in", "checked_out",
+                                                                              "overflow")
+})
+Gauge("db_replica_lag_seconds", "Last measured lag of each replica", ("replica",), collect=lambda: {
+    (replica.name,): replica.lag for replica in replicas
+})
+Gauge("hashing_in_flight", "bcrypt calls queued or running", collect=lambda: {(): get_hashing_stats()["in_flight"]})
+Gauge("hashing_queued", "bcrypt calls waiting for a pool worker", collect=lambda: {(): get_hashing_stats()["queued"]})
+Counter("hashing_rejected_total", "bcrypt calls rejected because the pool was full",
+        collect=lambda: {(): get_hashing_stats()["rejected"]})
+Counter("overdue_loans_total", "Overdue loans handled by the overdue scan by outcome", ("outcome",), collect=lambda: {
+    (outcome,): count for outcome, count in overdue_totals.items()
+})
+Counter("cache_hits_total", "Cache hits", ("cache",), collect=lambda: {
+    ("principal",): principal_cache.stats()["hits"], ("book",): get_book_cache_stats()["hits"],
+})
+Counter("cache_misses_total", "Cache misses", ("cache",), collect=lambda: {
+    ("principal",): principal_cache.stats()["misses"], ("book",): get_book_cache_stats()["misses"],
+})
+
+
+# Prometheus text exposition of the HTTP, SQL, pool, cache and bcrypt metrics.
+# Unauthenticated like most scrape targets, keep it off the public network.
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
@@ -1,23 +1,65 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from library.crud.reader import *
 from library.database import SessionDep
-from library.schemas import ReaderOut, ReaderCreate, ReaderPutUpdate, ReaderPatchUpdate
+from library.etag import resource_etag, collection_etag, etag_matches, not_modified
+from library.replicas import ReadSessionDep, choose_read_sessionmaker
+from library.pagination import decode_cursor, make_page
+from library.schemas import ReaderOut, ReaderCreate, ReaderPutUpdate, ReaderPatchUpdate, ReaderPage
+from library.serialization import dump_json, json_response
 from library.utils import CurrentUser
 
 router = APIRouter(prefix="/readers", tags=["Readers"])
 
 
-@router.get("/", response_model=list[ReaderOut])
-async def get_readers_list(session: SessionDep, current_user: CurrentUser):
-    readers = await get_readers(session)
-    return readers
+# Serializes readers as NDJSON, one batch per chunk.
+# It opens its own session because the request session is closed before a streaming body is sent.
+async def readers_ndjson(session_factory):
+    async with session_factory() as session:
+        async for readers in stream_readers(session):
+            yield b"".join(dump_json(ReaderOut, reader) + b"\n" for reader in readers)
 
 
+# Paginated like GET /books/ (skip/limit, or cursor for keyset pages) and tagged the same way.
+# stream=true returns every reader as NDJSON with flat memory use instead.
+@router.get("/", response_model=list[ReaderOut] | ReaderPage)
+async def get_readers_list(request: Request, session: ReadSessionDep, current_user: CurrentUser,
+                           skip: int = 0, limit: int = Query(10, ge=1, le=100), cursor: str | None = None,
+                           stream: bool = False):
+    if stream:
+        return StreamingResponse(readers_ndjson(await choose_read_sessionmaker(request)),
+                                 media_type="application/x-ndjson")
+
+    after_id = decode_cursor(cursor) if cursor is not None else None
+    if request.headers.get("If-None-Match"):
+        versions = await get_reader_versions(session, skip if cursor is None else 0,
+                                             limit if cursor is None else limit + 1, after_id)
+        if etag_matches(request, collection_etag(versions)):
+            return not_modified(collection_etag(versions))
+
+    if cursor is None:
+        readers = await get_readers(session, skip, limit)
+        etag = collection_etag([(reader.id, reader.version) for reader in readers])
+        return json_response(list[ReaderOut], readers, headers={"ETag": etag})
+
+    readers = await get_readers_after(session, after_id, limit + 1)
+    etag = collection_etag([(reader.id, reader.version) for reader in readers])
+    return json_response(ReaderPage, make_page(readers, limit), headers={"ETag": etag})
+
+
+# Tagged with the reader's version, a matching If-None-Match only reads the version column and returns 304
 @router.get("/{reader_id}", response_model=ReaderOut)
-async def get_reader(reader_id: int, session: SessionDep, current_user: CurrentUser):
+async def get_reader(reader_id: int, request: Request, response: Response, session: ReadSessionDep,
+                     current_user: CurrentUser):
+    if request.headers.get("If-None-Match"):
+        version = await get_reader_version(session, reader_id)
+        if version is not None and etag_matches(request, resource_etag(reader_id, version)):
+            return not_modified(resource_etag(reader_id, version))
+
     reader = await get_reader_by_id(session, reader_id)
     if not reader:
         raise HTTPException(status_code=404, detail="Reader not found")
+    response.headers["ETag"] = resource_etag(reader.id, reader.version)
     return reader
 
 
@@ -0,0 +1,39 @@
+from datetime import date, timedelta
+from fastapi import APIRouter, HTTPException, Query
+from library.crud.stats import get_circulation_summary, get_daily_circulation, get_top_books, get_top_readers
+from library.replicas import ReadSessionDep
+from library.schemas import CirculationSummary, DailyCirculationOut, TopBookOut, TopReaderOut
+from library.utils import CurrentUser
+
+router = APIRouter(prefix="/stats", tags=["Statistics"])
+
+# Longest range /stats/daily returns at once.
+MAX_DAILY_RANGE = 366
+
+
+@router.get("/summary", response_model=CirculationSummary)
+async def circulation_summary(session: ReadSessionDep, current_user: CurrentUser):
+    return await get_circulation_summary(session)
+
+
+# Borrows and returns per day from start to end (inclusive), the last 30 days by default.
+@router.get("/daily", response_model=list[DailyCirculationOut])
+async def daily_circulation(session: ReadSessionDep, current_user: CurrentUser, start: date | None = None,
+                            end: date | None = None):
+    end = end or date.today()
+    start = start or end - timedelta(days=29)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    if (end - start).days >= MAX_DAILY_RANGE:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_DAILY_RANGE} days at once")
+    return await get_daily_circulation(session, start, end)
+
+
+@router.get("/top-books", response_model=list[TopBookOut])
+async def top_books(session: ReadSessionDep, current_user: CurrentUser, limit: int = Query(10, ge=1, le=100)):
+    return await get_top_books(session, limit)
+
+
+@router.get("/top-readers", response_model=list[TopReaderOut])
+async def top_readers(session: ReadSessionDep, current_user: CurrentUser, limit: int = Query(10, ge=1, le=100)):
+    return await get_top_readers(session, limit)
@@ -0,0 +1,45 @@
+from fastapi import APIRouter
+from library.crud.book import get_book_cache_stats
+from library.database import get_pool_stats
+from library.hashing import get_hashing_stats
+from library.jobs import get_job_stats
+from library.replicas import get_replica_stats
+from library.utils import CurrentUser, principal_cache
+
+router = APIRouter(prefix="/system", tags=["System"])
+
+
+# Hit and miss counters of the authenticated-principal cache
+@router.get("/auth-cache")
+async def get_auth_cache_stats(current_user: CurrentUser):
+    return principal_cache.stats()
+
+
+# Queue depth and latency of the bcrypt process pool
+@router.get("/hashing")
+async def get_hashing_pool_stats(current_user: CurrentUser):
+    return get_hashing_stats()
+
+
+# Checked-out and overflow connections of the database pool
+@router.get("/pool")
+async def get_database_pool_stats(current_user: CurrentUser):
+    return get_pool_stats()
+
+
+# Replica lag and how many reads each side served
+@router.get("/replicas")
+async def get_replica_routing_stats(current_user: CurrentUser):
+    return get_replica_stats()
+
+
+# Hit ratio of the book cache and how many concurrent misses were coalesced into one load
+@router.get("/book-cache")
+async def get_book_cache_statistics(current_user: CurrentUser):
+    return get_book_cache_stats()
+
+
+# Runs, failures and last outcome of the background jobs, such as the overdue scan
+@router.get("/jobs")
+async def get_background_job_stats(current_user: CurrentUser):
+    return get_job_stats()
@@ -0,0 +1,30 @@
+import hashlib
+from fastapi import Request, Response
+
+
+# Strong entity tag of a single row, its representation only changes together with its version.
+def resource_etag(row_id: int, version: int) -> str:
+    return f'"{row_id}-{version}"'
+
+
+# Strong entity tag of a page, derived from the (id, version) pairs of its rows in order.
+# Rows added, removed, reordered or changed all give a different tag.
+def collection_etag(versions: list[tuple[int, int]]) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for row_id, version in versions:
+        digest.update(f"{row_id}-{version};".encode())
+    return f'"{digest.hexdigest()}"'
+
+
+# If-None-Match uses the weak comparison, so W/ prefixes are ignored and * matches anything.
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("If-None-Match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+# Empty 304 response, sent instead of serializing a representation the client already has
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag})
@@ -0,0 +1,107 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from fastapi import HTTPException
+from passlib.context import CryptContext
+from library.config import AuthConfig
+from library.metrics import hashing_queue_seconds, hashing_run_seconds
+
+# Password hashing context, a changed BCRYPT_ROUNDS makes older hashes "need update" so they are rehashed on login
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=AuthConfig.BCRYPT_ROUNDS)
+
+# bcrypt is CPU bound, so it runs in its own process pool instead of the default thread executor
+hashing_pool: Executor | None = None
+
+# Counters for /system/hashing, latency is measured from submission, so it includes the time spent queued
+hashing_stats = {
+    "in_flight": 0,
+    "completed": 0,
+    "rejected": 0,
+    "latency_seconds_total": 0.0,
+    "latency_seconds_max": 0.0,
+}
+
+
+# These run inside the worker processes and must stay importable module-level functions.
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return pwd_context.verify_and_update(password, hashed_password)
+
+
+# Runs fn in the worker and reports when it started and finished, wall clock times so the parent can compare them
+def _timed(fn, *args):
+    started = time.time()
+    result = fn(*args)
+    return started, time.time(), result
+
+
+def get_hashing_pool() -> Executor:
+    global hashing_pool
+    if hashing_pool is None:
+        workers = AuthConfig.BCRYPT_WORKERS or os.cpu_count() or 1
+        hashing_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    return hashing_pool
+
+
+def shutdown_hashing_pool() -> None:
+    global hashing_pool
+    if hashing_pool is not None:
+        hashing_pool.shutdown(cancel_futures=True)
+        hashing_pool = None
+
+
+# Runs a bcrypt call in the pool, rejecting it right away once BCRYPT_MAX_PENDING calls are queued or running,
+# so a login burst turns into fast 503s instead of an ever growing queue.
+async def run_in_hashing_pool(fn, *args):
+    if hashing_stats["in_flight"] >= AuthConfig.BCRYPT_MAX_PENDING:
+        hashing_stats["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Too many password operations in progress, try again later",
+                            headers={"Retry-After": "1"})
+
+    hashing_stats["in_flight"] += 1
+    submitted = time.time()
+    started = time.perf_counter()
+    try:
+        worker_started, worker_finished, result = await asyncio.get_running_loop().run_in_executor(
+            get_hashing_pool(), _timed, fn, *args
+        )
+        hashing_queue_seconds.observe(max(worker_started - submitted, 0.0))
+        hashing_run_seconds.observe(max(worker_finished - worker_started, 0.0))
+        return result
+    finally:
+        elapsed = time.perf_counter() - started
+        hashing_stats["in_flight"] -= 1
+        hashing_stats["completed"] += 1
+        hashing_stats["latency_seconds_total"] += elapsed
+        hashing_stats["latency_seconds_max"] = max(hashing_stats["latency_seconds_max"], elapsed)
+
+
+# Hash the password
+async def hash_password(password: str) -> str:
+    return await run_in_hashing_pool(_hash, password)
+
+
+# Verify the hashed password
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    verified, _ = await run_in_hashing_pool(_verify_and_update, plain_password, hashed_password)
+    return verified
+
+
+# Verify the hashed password, also returns a new hash when the stored one was made with outdated settings
+async def verify_and_update_password(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return await run_in_hashing_pool(_verify_and_update, plain_password, hashed_password)
+
+
+# Queue depth and latency summary of the hashing pool
+def get_hashing_stats() -> dict:
+    workers = AuthConfig.BCRYPT_WORKERS or os.cpu_count() or 1
+    stats = dict(hashing_stats)
+    stats["workers"] = workers
+    stats["queued"] = max(0, stats["in_flight"] - workers)
+    stats["latency_seconds_avg"] = stats["latency_seconds_total"] / stats["completed"] if stats["completed"] else 0.0
+    return stats
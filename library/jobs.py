@@ -0,0 +1,210 @@
+import asyncio
+import time
+from contextlib import suppress
+from datetime import date
+from typing import Any, Awaitable, Callable
+from sqlalchemy import select, update, func, tuple_, literal
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from library import partitions, replicas
+from library.config import DBConfig, JobConfig
+from library.database import create_engine_from_config, engine
+from library.metrics import instrument_engine, job_failures, job_run_seconds
+from library.models import BorrowedBook
+
+# Background jobs get their own small pool, so a long scan never makes a request wait for a connection
+job_engine = create_engine_from_config(
+    DBConfig.DB_URL, pool_size=JobConfig.JOB_DB_POOL_SIZE, max_overflow=0, application_name="library-jobs"
+)
+instrument_engine(job_engine, "jobs")
+JobSessionLocal = sessionmaker(job_engine, class_=AsyncSession, expire_on_commit=False)
+
+
+# Sends the overdue notice of one loan (id, book_id, reader_id, due_date). There is no mail or SMS integration yet,
+# so by default the loan is only flagged, replace it with set_overdue_notifier(). A notifier that raises has its
+# loan unflagged, so the next scan tries again.
+async def skip_notification(loan: Row) -> None:
+    return None
+
+
+overdue_notifier: Callable[[Row], Awaitable[None]] = skip_notification
+
+# Totals over every scan of this process, for /system/jobs and /metrics
+overdue_totals = {"flagged": 0, "notified": 0, "failed": 0}
+
+
+def set_overdue_notifier(notifier: Callable[[Row], Awaitable[None]]) -> None:
+    global overdue_notifier
+    overdue_notifier = notifier
+
+
+# Flags up to limit overdue loans after the (due_date, id) keyset position and returns them. Rows locked by a
+# concurrent return (or another worker's scan) are skipped rather than waited for, the next scan picks them up.
+async def flag_overdue_chunk(session: AsyncSession, today: date, after: tuple[date, int], limit: int) -> list[Row]:
+    picked = (
+        select(BorrowedBook.id)
+        .where(
+            BorrowedBook.return_date.is_(None),
+            BorrowedBook.overdue_notified_at.is_(None),
+            BorrowedBook.due_date < today,
+            tuple_(BorrowedBook.due_date, BorrowedBook.id) > tuple_(literal(after[0]), literal(after[1])),
+        )
+        .order_by(BorrowedBook.due_date, BorrowedBook.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await session.execute(
+        update(BorrowedBook)
+        .where(BorrowedBook.id.in_(picked))
+        .values(overdue_notified_at=func.now())
+        .returning(BorrowedBook.id, BorrowedBook.book_id, BorrowedBook.reader_id, BorrowedBook.due_date)
+    )
+    return sorted(result.all(), key=lambda loan: (loan.due_date, loan.id))
+
+
+# Notifies the readers of a flagged chunk, at most `concurrency` at a time, and returns the loans that failed
+async def notify_overdue_chunk(loans: list[Row], concurrency: int) -> list[Row]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def notify(loan: Row) -> bool:
+        async with semaphore:
+            try:
+                await overdue_notifier(loan)
+                return True
+            except Exception:
+                return False
+
+    sent = await asyncio.gather(*(notify(loan) for loan in loans))
+    return [loan for loan, ok in zip(loans, sent) if not ok]
+
+
+# Walks the open loans past their due date through the partial overdue index in keyset order, one short
+# transaction per chunk, flags them, then notifies their readers outside the transaction. Pauses between chunks,
+# and longer while requests are using overflow connections, so a large backlog is worked off without slowing
+# request traffic down.
+async def scan_overdue_loans(session_factory: sessionmaker | None = None, chunk_size: int | None = None,
+                             pause: float | None = None) -> dict:
+    session_factory = session_factory or JobSessionLocal
+    chunk_size = chunk_size or JobConfig.OVERDUE_SCAN_CHUNK_SIZE
+    pause = JobConfig.OVERDUE_SCAN_PAUSE if pause is None else pause
+    today = date.today()
+    after = (date.min, 0)
+    result = {"chunks": 0, "flagged": 0, "notified": 0, "failed": 0}
+
+    while True:
+        async with session_factory() as session:
+            async with session.begin():
+                loans = await flag_overdue_chunk(session, today, after, chunk_size)
+        if not loans:
+            break
+        after = (loans[-1].due_date, loans[-1].id)
+
+        failed = await notify_overdue_chunk(loans, JobConfig.OVERDUE_NOTIFY_CONCURRENCY)
+        if failed:
+            async with session_factory() as session:
+                async with session.begin():
+                    await session.execute(
+                        update(BorrowedBook)
+                        .where(BorrowedBook.id.in_([loan.id for loan in failed]))
+                        .values(overdue_notified_at=None)
+                    )
+
+        result["chunks"] += 1
+        for totals in (result, overdue_totals):
+            totals["flagged"] += len(loans)
+            totals["notified"] += len(loans) - len(failed)
+            totals["failed"] += len(failed)
+        if len(loans) < chunk_size:
+            break
+        await asyncio.sleep(pause * 10 if engine.pool.overflow() > 0 else pause)
+    return result
+
+
+# A coroutine function run every interval seconds in the event loop of the worker that started it.
+# A failed run is counted and the job carries on with the next one.
+class PeriodicJob:
+    def __init__(self, name: str, interval: float, run: Callable[[], Awaitable[Any]]):
+        self.name = name
+        self.interval = interval
+        self.run = run
+        self.task: asyncio.Task | None = None
+        self.stats = {"runs": 0, "failures": 0, "last_started": None, "last_duration_seconds": None,
+                      "last_result": None, "last_error": None}
+
+    async def run_once(self) -> Any:
+        self.stats["runs"] += 1
+        self.stats["last_started"] = time.time()
+        started = time.perf_counter()
+        try:
+            result = await self.run()
+        except Exception as error:
+            self.stats["failures"] += 1
+            self.stats["last_error"] = repr(error)
+            job_failures.inc(self.name)
+            return None
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stats["last_duration_seconds"] = elapsed
+            job_run_seconds.observe(elapsed, self.name)
+        self.stats["last_result"] = result
+        return result
+
+    async def loop(self) -> None:
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.loop(), name=f"job-{self.name}")
+
+    async def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self.task
+            self.task = None
+
+
+# Creates the coming years' partitions of borrowed_books in long running processes
+async def maintain_partitions() -> list[str]:
+    async with job_engine.begin() as conn:
+        return await partitions.ensure_partitions(conn)
+
+
+# Moves partitions.open_loans_since forward as old loans are returned, so open-loan listings prune more years
+async def refresh_open_loans_since() -> date:
+    async with job_engine.connect() as conn:
+        return await partitions.refresh_open_loans_since(conn)
+
+
+overdue_scan = PeriodicJob("overdue_scan", JobConfig.OVERDUE_SCAN_INTERVAL, scan_overdue_loans)
+partition_maintenance = PeriodicJob("partition_maintenance", 24 * 60 * 60, maintain_partitions)
+open_loans_refresh = PeriodicJob("open_loans_since", JobConfig.OPEN_LOANS_REFRESH_INTERVAL, refresh_open_loans_since)
+replica_lag_check = PeriodicJob("replica_lag", DBConfig.DB_REPLICA_LAG_CHECK_INTERVAL, replicas.check_replica_lag)
+jobs = [overdue_scan, partition_maintenance, open_loans_refresh, replica_lag_check]
+
+
+# Started and stopped with the app, every worker process runs its own jobs (scans skip the loans another one has
+# locked, so they do not notify a reader twice)
+def start_jobs() -> None:
+    partition_maintenance.start()
+    open_loans_refresh.start()
+    if replicas.replicas:
+        replica_lag_check.start()
+    if JobConfig.OVERDUE_SCAN_ENABLED:
+        overdue_scan.start()
+
+
+async def stop_jobs() -> None:
+    for job in jobs:
+        await job.stop()
+    await job_engine.dispose()
+
+
+def get_job_stats() -> dict:
+    stats = {job.name: {"running": job.task is not None, "interval": job.interval, **job.stats} for job in jobs}
+    stats["overdue_scan"]["totals"] = dict(overdue_totals)
+    return stats
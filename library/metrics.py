@@ -0,0 +1,213 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable
+from sqlalchemy import event
+from library.config import DBConfig
+
+# Default latency buckets in seconds, from sub-millisecond SQL to multi-second bcrypt queues
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Every metric, in the order they are exposed
+registry = []
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# Metrics are only updated from the event loop thread (SQLAlchemy's async events included), so they need no locks.
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        registry.append(self)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+# A counter is either incremented directly or, given collect, read at scrape time from {label values: value}
+# (for counters the app already keeps, such as the cache hit counts).
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 collect: Callable[[], dict[tuple, float]] | None = None):
+        super().__init__(name, documentation, labelnames)
+        self.values: dict[tuple, float] = {}
+        self.collect = collect
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> list[str]:
+        values = self.collect() if self.collect else self.values
+        return self.header() + [
+            f"{self.name}{format_labels(self.labelnames, labels)} {value}" for labels, value in values.items()
+        ]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1.0) -> None:
+        self.values[labels] = self.values.get(labels, 0.0) - amount
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = buckets
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+# Text exposition format, as served at /metrics
+def render_metrics() -> str:
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+http_requests = Counter("http_requests_total", "HTTP requests handled", ("method", "route", "status"))
+http_request_seconds = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+http_in_flight = Gauge("http_requests_in_flight", "HTTP requests being handled", ("method",))
+
+db_statement_seconds = Histogram("db_statement_duration_seconds", "SQL statement latency", ("engine", "operation"))
+db_statement_errors = Counter("db_statement_errors_total", "SQL statements that raised", ("engine", "operation"))
+
+hashing_queue_seconds = Histogram("hashing_queue_seconds", "Time bcrypt calls waited for a pool worker")
+hashing_run_seconds = Histogram("hashing_run_seconds", "Time bcrypt calls ran in a pool worker")
+
+job_run_seconds = Histogram("job_run_seconds", "Background job run time", ("job",))
+job_failures = Counter("job_failures_total", "Background job runs that raised", ("job",))
+
+
+# Database work done on behalf of one request: statements run, rows they returned and time spent waiting on them
+class RequestDBStats:
+    __slots__ = ("statements", "rows", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.seconds = 0.0
+
+    # Server-Timing value, e.g. db;dur=1.250, db-statements;desc=2, db-rows;desc=1 (dur is in milliseconds)
+    def server_timing(self) -> str:
+        return f"db;dur={self.seconds * 1000:.3f}, db-statements;desc={self.statements}, db-rows;desc={self.rows}"
+
+
+# Set by MetricsMiddleware for each request. Dependencies, tasks and SQLAlchemy's greenlets started by the request
+# copy the context, so they all share the request's RequestDBStats object.
+request_db_stats: ContextVar[RequestDBStats | None] = ContextVar("request_db_stats", default=None)
+
+
+# Records every HTTP request under its route template (not the raw path, which would explode the label set),
+# and reports the request's database work in a Server-Timing header.
+# A plain ASGI middleware, so it adds two clock reads and a few dict updates per request.
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+        db_stats = RequestDBStats()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                # The session dependency has committed by now, so this covers everything but a streamed body
+                if DBConfig.DB_SERVER_TIMING:
+                    headers = list(message.get("headers", []))
+                    headers.append((b"server-timing", db_stats.server_timing().encode()))
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        http_in_flight.inc(method)
+        token = request_db_stats.set(db_stats)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            request_db_stats.reset(token)
+            http_in_flight.dec(method)
+            # The router stores the matched route in the scope it shares with us
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            http_requests.inc(method, path, str(status))
+            http_request_seconds.observe(elapsed, method, path)
+
+
+# First keyword of a statement, e.g. SELECT, INSERT or WITH for the lend/return CTEs
+def statement_operation(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+
+
+# Rows a statement returned, 0 for statements without a result (and for server-side cursors, which report none)
+def statement_rows(cursor) -> int:
+    return max(cursor.rowcount, 0) if cursor.description is not None else 0
+
+
+# Times every statement an engine runs, labelled with the engine's name, and adds it to the current request's stats
+def instrument_engine(engine, name: str) -> None:
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        context.metrics_started = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context.metrics_started
+        db_statement_seconds.observe(elapsed, name, statement_operation(statement))
+        stats = request_db_stats.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.rows += statement_rows(cursor)
+            stats.seconds += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        statement = exception_context.statement or ""
+        db_statement_errors.inc(name, statement_operation(statement))
@@ -1,5 +1,7 @@
-from datetime import date
-from sqlalchemy import String, BIGINT, Integer, text, Date, ForeignKey
+from datetime import date, datetime
+from sqlalchemy import String, BIGINT, Integer, SmallInteger, text, Date, DateTime, ForeignKey, Computed, Index, \
+    CheckConstraint
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
@@ -12,20 +14,42 @@ class User(Base):
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, autoincrement=True)
     email: Mapped[str] = mapped_column(String, unique=True, index=True, nullable=False)
     password: Mapped[str] = mapped_column(String, nullable=False)
+    # Bumped whenever the user changes, tokens issued with an older version are rejected
+    token_version: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default=text("0"))
 
 
 class Reader(Base):
     __tablename__ = "readers"
+    __table_args__ = (
+        CheckConstraint("active_borrow_count >= 0", name="ck_readers_active_borrow_count"),
+    )
 
     id: Mapped[int] = mapped_column(BIGINT, primary_key=True, index=True, autoincrement=True)
     full_name: Mapped[str] = mapped_column(String, nullable=False)
     email: Mapped[str] = mapped_column(String, unique=True, index=True, nullable=False)
+    # Number of books borrowed and not returned yet, kept up to date in the lend and return transactions
+    active_borrow_count: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default=text("0"))
+    # Bumped on every change to the fields readers are served with, it is the entity tag of GET /readers/{id}
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default=text("1"))
 
     borrowed_books = relationship("BorrowedBook", back_populates="reader", passive_deletes=True)
 
 
+# Weighted full-text document of a book, title ranks above author and author above description
+BOOK_SEARCH_VECTOR = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(author, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'C')"
+)
+
+
 class Book(Base):
     __tablename__ = "books"
+    __table_args__ = (
+        Index("ix_books_search_vector", "search_vector", postgresql_using="gin"),
+    )
+    # Inserts would otherwise return the generated search_vector, which is never read back
+    __mapper_args__ = {"eager_defaults": False}
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, autoincrement=True)
     title: Mapped[str] = mapped_column(String, nullable=False)
@@ -33,19 +57,77 @@ class Book(Base):
     author: Mapped[str] = mapped_column(String, nullable=False)
     year: Mapped[int] = mapped_column(Integer, nullable=True)
     isbn: Mapped[str] = mapped_column(String, unique=True, index=True, nullable=True)
-    copy: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text("1"))
+    copy: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default=text("1"))
+    # Bumped on every change, including copies taken and given back by lending, it is the entity tag of GET /books/{id}
+    version: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default=text("1"))
+    # Generated by Postgres and only used in WHERE clauses, so it is never loaded
+    search_vector: Mapped[str] = mapped_column(TSVECTOR, Computed(BOOK_SEARCH_VECTOR, persisted=True), deferred=True)
 
     borrowed_books = relationship("BorrowedBook", back_populates="book", passive_deletes=True)
 
 
+# Range-partitioned on borrow_date, one partition per year (see library/partitions.py), so old years can be detached
+# and queries bounded by borrow_date only read the years they need. The primary key has to include borrow_date,
+# ids stay unique because they all come from one sequence.
 class BorrowedBook(Base):
     __tablename__ = "borrowed_books"
-
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True, autoincrement=True)
+    __table_args__ = (
+        # Only open borrows are indexed, so lend-time checks never touch the returned history
+        Index("ix_borrowed_books_active", "reader_id", "book_id", postgresql_where=text("return_date IS NULL")),
+        # Only open loans nobody has been told about yet, the overdue scanner walks it in (due_date, id) order
+        Index("ix_borrowed_books_overdue", "due_date", "id",
+              postgresql_where=text("return_date IS NULL AND overdue_notified_at IS NULL")),
+        # The oldest open loan, read through it to bound open-loan queries to the years that have any
+        Index("ix_borrowed_books_open", "borrow_date", postgresql_where=text("return_date IS NULL")),
+        # Reader history in borrow_date order
+        Index("ix_borrowed_books_reader_history", "reader_id", "borrow_date"),
+        {"postgresql_partition_by": "RANGE (borrow_date)"},
+    )
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
     book_id: Mapped[int] = mapped_column(Integer, ForeignKey("books.id", ondelete="CASCADE"), nullable=False)
     reader_id: Mapped[int] = mapped_column(BIGINT, ForeignKey("readers.id", ondelete="CASCADE"), nullable=False)
-    borrow_date: Mapped[date] = mapped_column(Date, nullable=False)
+    borrow_date: Mapped[date] = mapped_column(Date, primary_key=True)
     return_date: Mapped[date] = mapped_column(Date, nullable=True)
+    due_date: Mapped[date] = mapped_column(Date, nullable=False)
+    # Set by the overdue scanner once the reader has been notified, so a loan is only flagged once
+    overdue_notified_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
 
     book = relationship("Book", back_populates="borrowed_books")
     reader = relationship("Reader", back_populates="borrowed_books")
+
+
+# Circulation summaries, maintained by the lend and return statements so reports never scan borrowed_books.
+# Each day is split into shards (by reader) so concurrent lends do not all queue on a single row.
+class DailyCirculation(Base):
+    __tablename__ = "daily_circulation"
+
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    shard: Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    borrows: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text("0"))
+    returns: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text("0"))
+    # Open borrows that ended because their book or reader was deleted
+    cancelled: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text("0"))
+
+
+class BookCirculation(Base):
+    __tablename__ = "book_circulation"
+    __table_args__ = (
+        # Top-N queries walk it backwards
+        Index("ix_book_circulation_borrow_count", "borrow_count"),
+    )
+
+    book_id: Mapped[int] = mapped_column(Integer, ForeignKey("books.id", ondelete="CASCADE"), primary_key=True)
+    borrow_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text("0"))
+    last_borrowed: Mapped[date] = mapped_column(Date, nullable=True)
+
+
+class ReaderCirculation(Base):
+    __tablename__ = "reader_circulation"
+    __table_args__ = (
+        Index("ix_reader_circulation_borrow_count", "borrow_count"),
+    )
+
+    reader_id: Mapped[int] = mapped_column(BIGINT, ForeignKey("readers.id", ondelete="CASCADE"), primary_key=True)
+    borrow_count: Mapped[int] = mapped_column(Integer, nullable=False, server_default=text("0"))
+    last_borrowed: Mapped[date] = mapped_column(Date, nullable=True)
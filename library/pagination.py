@@ -0,0 +1,31 @@
+import base64
+import binascii
+import json
+from fastapi import HTTPException
+
+
+# Turns the id of the last row on a page into an opaque cursor for the next page.
+def encode_cursor(last_id: int) -> str:
+    payload = json.dumps({"id": last_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip("=")
+
+
+# Reads the id back from a cursor. An empty cursor asks for the first page.
+def decode_cursor(cursor: str) -> int | None:
+    if not cursor:
+        return None
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        last_id = json.loads(payload)["id"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(last_id, int):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return last_id
+
+
+# Builds a page out of limit + 1 fetched rows, the extra row only tells whether there is a next page.
+def make_page(rows: list, limit: int) -> dict:
+    items = rows[:limit]
+    next_cursor = encode_cursor(items[-1].id) if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
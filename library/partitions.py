@@ -0,0 +1,168 @@
+import argparse
+import asyncio
+from datetime import date
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from library.database import engine
+from library.models import BorrowedBook
+
+# borrowed_books is range-partitioned on borrow_date, one partition per year plus a default partition that catches
+# rows outside every year created so far. The app creates the current and next years at startup and once a day,
+# old years without open loans can be detached and archived from the command line:
+#
+#     python -m library.partitions list
+#     python -m library.partitions create 2015 --through 2027
+#     python -m library.partitions detach 2015 --archive-schema archive
+
+PARENT = BorrowedBook.__tablename__
+DEFAULT_PARTITION = f"{PARENT}_default"
+# Years created ahead of the current one, so lending never falls into the default partition on January 1st
+YEARS_AHEAD = 1
+# Serializes partition changes between app workers starting at the same time
+PARTITION_LOCK_ID = 0x6C6962726172
+
+COLUMNS = ", ".join(column.name for column in BorrowedBook.__table__.columns)
+
+# The oldest borrow_date among open loans when last read, refreshed by a background job and date.min (no pruning)
+# until then. Loans imported or reopened with an older borrow_date make it stale, so it only bounds read-only
+# listings of open loans, letting Postgres prune the years without any. Lending, returning, deletes and the
+# overdue scan never use it, they find open loans through the partial open-loan indexes of every partition.
+open_loans_since = date.min
+
+
+def partition_name(year: int) -> str:
+    return f"{PARENT}_{year}"
+
+
+def year_bounds(year: int) -> dict:
+    return {"start": date(year, 1, 1), "end": date(year + 1, 1, 1)}
+
+
+async def is_partitioned(conn: AsyncConnection) -> bool:
+    return await conn.scalar(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:name)"),
+                             {"name": PARENT}) or False
+
+
+# Partitions with their bounds and estimated row counts, in bound order with the default partition last
+async def list_partitions(conn: AsyncConnection) -> list[dict]:
+    result = await conn.execute(text(
+        "SELECT child.relname AS name, pg_get_expr(child.relpartbound, child.oid) AS bounds, "
+        "greatest(child.reltuples, 0)::bigint AS estimated_rows "
+        "FROM pg_inherits JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(:name) "
+        "ORDER BY pg_get_expr(child.relpartbound, child.oid) = 'DEFAULT', child.relname"
+    ), {"name": PARENT})
+    return [dict(row._mapping) for row in result]
+
+
+# Creates the partition of a year, returns False when it already exists. Rows of that year already in the default
+# partition are moved into it: the default partition is detached for the move, which locks borrowed_books
+# exclusively until the transaction commits, so keep the default partition small by creating years ahead of time.
+async def create_partition(conn: AsyncConnection, year: int) -> bool:
+    name = partition_name(year)
+    if await conn.scalar(text("SELECT to_regclass(:name)"), {"name": name}) is not None:
+        return False
+    bounds = year_bounds(year)
+    create = (f"CREATE TABLE {name} PARTITION OF {PARENT} "
+              f"FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')")
+
+    has_default = await conn.scalar(text("SELECT to_regclass(:name)"), {"name": DEFAULT_PARTITION}) is not None
+    strays = has_default and await conn.scalar(text(
+        f"SELECT exists(SELECT FROM {DEFAULT_PARTITION} WHERE borrow_date >= :start AND borrow_date < :end)"
+    ), bounds)
+    if not strays:
+        await conn.execute(text(create))
+        return True
+
+    await conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {DEFAULT_PARTITION}"))
+    await conn.execute(text(create))
+    await conn.execute(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE borrow_date >= :start AND borrow_date < :end "
+        f"RETURNING {COLUMNS}) INSERT INTO {PARENT} ({COLUMNS}) SELECT {COLUMNS} FROM moved"
+    ), bounds)
+    await conn.execute(text(f"ALTER TABLE {PARENT} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+    return True
+
+
+# Creates the partitions of first_year through last_year that are missing, returns the names created
+async def create_partitions(conn: AsyncConnection, first_year: int, last_year: int) -> list[str]:
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": PARTITION_LOCK_ID})
+    return [partition_name(year) for year in range(first_year, last_year + 1) if await create_partition(conn, year)]
+
+
+# Makes sure the default partition and the partitions of this year and the next YEARS_AHEAD exist.
+# Does nothing while borrowed_books is not partitioned yet (before its migration).
+async def ensure_partitions(conn: AsyncConnection) -> list[str]:
+    if not await is_partitioned(conn):
+        return []
+    await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": PARTITION_LOCK_ID})
+    await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {PARENT} DEFAULT"))
+    year = date.today().year
+    return await create_partitions(conn, year, year + YEARS_AHEAD)
+
+
+# Detaches the partition of a year, then moves it to archive_schema (or drops it when archive_schema is None).
+# Refuses while it still has open loans, returning them would no longer find them.
+# DETACH briefly locks borrowed_books exclusively (CONCURRENTLY is not allowed next to a default partition), so it
+# gives up after lock_timeout instead of queueing lending behind a long running query.
+# The circulation summaries keep counting the detached years, rebuild_circulation_stats() would not.
+async def detach_partition(conn: AsyncConnection, year: int, archive_schema: str | None = "archive",
+                           lock_timeout: str = "5s") -> None:
+    name = partition_name(year)
+    if await conn.scalar(text("SELECT to_regclass(:name)"), {"name": name}) is None:
+        raise ValueError(f"{name} does not exist")
+    open_loans = await conn.scalar(text(f"SELECT count(*) FROM {name} WHERE return_date IS NULL"))
+    if open_loans:
+        raise ValueError(f"{name} still has {open_loans} open loans")
+
+    await conn.execute(text("SELECT set_config('lock_timeout', :timeout, true)"), {"timeout": lock_timeout})
+    await conn.execute(text(f"ALTER TABLE {PARENT} DETACH PARTITION {name}"))
+    if archive_schema is None:
+        await conn.execute(text(f"DROP TABLE {name}"))
+    else:
+        await conn.execute(text(f'CREATE SCHEMA IF NOT EXISTS "{archive_schema}"'))
+        await conn.execute(text(f'ALTER TABLE {name} SET SCHEMA "{archive_schema}"'))
+
+
+# Reads the oldest borrow_date among open loans (through the partial ix_borrowed_books_open index of each
+# partition) into open_loans_since, today when nothing is open
+async def refresh_open_loans_since(conn: AsyncConnection) -> date:
+    global open_loans_since
+    today = date.today()
+    oldest = await conn.scalar(text(f"SELECT min(borrow_date) FROM {PARENT} WHERE return_date IS NULL"))
+    open_loans_since = min(oldest or today, today)
+    return open_loans_since
+
+
+async def main(args) -> None:
+    if args.command == "list":
+        async with engine.connect() as conn:
+            for partition in await list_partitions(conn):
+                print(f"{partition['name']:<28} {partition['bounds']:<60} ~{partition['estimated_rows']:,} rows")
+    elif args.command == "create":
+        async with engine.begin() as conn:
+            created = await create_partitions(conn, args.year, args.through or args.year)
+        print(f"Created {', '.join(created)}" if created else "Nothing to create")
+    elif args.command == "detach":
+        try:
+            async with engine.begin() as conn:
+                await detach_partition(conn, args.year, None if args.drop else args.archive_schema, args.lock_timeout)
+        except ValueError as error:
+            raise SystemExit(str(error))
+        print(f"Detached {partition_name(args.year)}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lists, creates and detaches the yearly partitions of borrowed_books")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="partitions with their bounds and estimated rows")
+    create = commands.add_parser("create", help="create the partitions of a year or a range of years")
+    create.add_argument("year", type=int)
+    create.add_argument("--through", type=int, help="last year to create, defaults to year")
+    detach = commands.add_parser("detach", help="detach a year without open loans and archive or drop it")
+    detach.add_argument("year", type=int)
+    detach.add_argument("--archive-schema", default="archive", help="schema the detached partition is moved to")
+    detach.add_argument("--drop", action="store_true", help="drop the detached partition instead of archiving it")
+    detach.add_argument("--lock-timeout", default="5s", help="how long to wait for the lock on borrowed_books")
+    asyncio.run(main(parser.parse_args()))
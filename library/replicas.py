@@ -0,0 +1,134 @@
+import asyncio
+import itertools
+import time
+from typing import Annotated
+from fastapi import Depends, Request
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from library.config import DBConfig
+from library.database import AsyncSessionLocal, create_engine_from_config
+from library.metrics import instrument_engine
+
+READ_YOUR_WRITES_HEADER = "X-Read-Your-Writes"
+READ_YOUR_WRITES_COOKIE = "read_your_writes"
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+# Seconds the replica is behind the primary. 0 when it has replayed everything it received
+# (an idle replica has an old replay timestamp without being behind), and also 0 on a primary.
+REPLICA_LAG_QUERY = text("""
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+""")
+
+
+# One replica engine with its last measured lag
+class Replica:
+    def __init__(self, url: str, name: str = "replica"):
+        # Replica connections are read-only, a write routed here by mistake fails instead of diverging
+        self.engine = create_engine_from_config(url, default_transaction_read_only="on")
+        self.name = name
+        instrument_engine(self.engine, name)
+        self.sessionmaker = sessionmaker(self.engine, class_=AsyncSession, expire_on_commit=False)
+        self.lag = float("inf")
+        self.checked_at = None
+
+    # Measures the lag, run by the replica_lag background job. A replica that does not answer within
+    # DB_REPLICA_LAG_CHECK_TIMEOUT counts as infinitely behind.
+    async def check_lag(self) -> float:
+        try:
+            async with asyncio.timeout(DBConfig.DB_REPLICA_LAG_CHECK_TIMEOUT):
+                async with self.engine.connect() as conn:
+                    self.lag = float(await conn.scalar(REPLICA_LAG_QUERY))
+        except Exception:
+            self.lag = float("inf")
+        self.checked_at = time.monotonic()
+        return self.lag
+
+    # The last measured lag, requests never probe the replica themselves. Until the first check, and when the job
+    # has missed a few checks, the replica counts as infinitely behind so reads stay on the primary.
+    def current_lag(self) -> float:
+        stale_after = 3 * DBConfig.DB_REPLICA_LAG_CHECK_INTERVAL + DBConfig.DB_REPLICA_LAG_CHECK_TIMEOUT
+        if self.checked_at is None or time.monotonic() - self.checked_at > stale_after:
+            return float("inf")
+        return self.lag
+
+
+replicas = [Replica(url, f"replica{number}") for number, url in enumerate(DBConfig.DB_REPLICA_URLS)]
+replica_cycle = itertools.cycle(replicas)
+routing_stats = {"primary": 0, "replica": 0, "read_your_writes": 0, "lagging": 0}
+
+
+# True when the client asked for, or recently made, a write it expects to see
+def wants_primary(request: Request) -> bool:
+    if request.headers.get(READ_YOUR_WRITES_HEADER, "").lower() in ("1", "true", "yes"):
+        return True
+    try:
+        return float(request.cookies.get(READ_YOUR_WRITES_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+# Picks where a read-only request runs: the next replica within the lag budget, otherwise the primary
+async def choose_read_sessionmaker(request: Request) -> sessionmaker:
+    if not replicas:
+        return AsyncSessionLocal
+    if wants_primary(request):
+        routing_stats["read_your_writes"] += 1
+        routing_stats["primary"] += 1
+        return AsyncSessionLocal
+
+    for _ in range(len(replicas)):
+        replica = next(replica_cycle)
+        if replica.current_lag() <= DBConfig.DB_REPLICA_MAX_LAG:
+            routing_stats["replica"] += 1
+            return replica.sessionmaker
+
+    routing_stats["lagging"] += 1
+    routing_stats["primary"] += 1
+    return AsyncSessionLocal
+
+
+async def get_read_session(request: Request):
+    async with (await choose_read_sessionmaker(request))() as session:
+        yield session
+
+# Returns a session for read-only endpoints, on a replica when one is configured and fresh enough.
+ReadSessionDep = Annotated[AsyncSession, Depends(get_read_session)]
+
+
+# After a successful write, pins the client to the primary for DB_READ_YOUR_WRITES_WINDOW seconds
+async def read_your_writes_middleware(request: Request, call_next):
+    response = await call_next(request)
+    if replicas and request.method not in SAFE_METHODS and response.status_code < 400:
+        window = DBConfig.DB_READ_YOUR_WRITES_WINDOW
+        response.set_cookie(READ_YOUR_WRITES_COOKIE, str(time.time() + window), max_age=int(window) or 1,
+                            httponly=True, samesite="lax")
+    return response
+
+
+# Lag and routing counters, to check the replicas actually take the reads
+def get_replica_stats() -> dict:
+    return {
+        "replicas": [
+            {"url": replica.engine.url.render_as_string(hide_password=True),
+             "lag": replica.lag if replica.lag != float("inf") else None}
+            for replica in replicas
+        ],
+        "max_lag": DBConfig.DB_REPLICA_MAX_LAG,
+        "routing": dict(routing_stats),
+    }
+
+
+# Measures the lag of every replica at once, for the replica_lag job
+async def check_replica_lag() -> dict:
+    lags = await asyncio.gather(*(replica.check_lag() for replica in replicas))
+    return {replica.name: lag if lag != float("inf") else None for replica, lag in zip(replicas, lags)}
+
+
+async def dispose_replicas():
+    for replica in replicas:
+        await replica.engine.dispose()
@@ -0,0 +1,113 @@
+import time
+
+
+# Raised when a revocation cannot be stored or checked. Callers fail closed: the token is rejected, or the logout
+# reports the failure, instead of carrying on as if nothing was revoked.
+class RevocationStoreError(Exception):
+    pass
+
+
+# Revocations of this process only, for a single worker. Entries are never evicted before they expire (there is no
+# size cap), expired ones are swept as new revocations come in. Everything is lost on restart.
+class LocalRevocationStore:
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.tokens: dict[str, float] = {}
+        self.users: dict[int, tuple[float, int]] = {}
+        self.writes = 0
+
+    def sweep(self) -> None:
+        self.writes += 1
+        if self.writes % 1000:
+            return
+        now = time.monotonic()
+        self.tokens = {jti: expires for jti, expires in self.tokens.items() if expires > now}
+        self.users = {user_id: entry for user_id, entry in self.users.items() if entry[0] > now}
+
+    async def revoke_token(self, jti: str) -> None:
+        self.sweep()
+        self.tokens[jti] = time.monotonic() + self.ttl
+
+    async def revoke_user(self, user_id: int, valid_from: int) -> None:
+        self.sweep()
+        now = time.monotonic()
+        expires, current = self.users.get(user_id, (now, 0))
+        self.users[user_id] = (now + self.ttl, max(valid_from, current if expires > now else 0))
+
+    async def is_revoked(self, jti: str | None, user_id: int | None, version: int | None) -> bool:
+        now = time.monotonic()
+        if jti is not None and self.tokens.get(jti, 0) > now:
+            return True
+        if user_id is None or version is None:
+            return False
+        expires, valid_from = self.users.get(user_id, (0, 0))
+        return expires > now and version < valid_from
+
+
+# Revocations in Redis, shared by every worker and kept across restarts. A user's lowest valid version only ever
+# grows: concurrent revocations retry their compare-and-set instead of dropping the entry. Redis errors are raised
+# as RevocationStoreError, never treated as "not revoked".
+class RedisRevocationStore:
+    MAX_ATTEMPTS = 10
+
+    def __init__(self, client, ttl: float, prefix: str = "revoked:"):
+        self.client = client
+        self.ttl_ms = int(ttl * 1000)
+        self.prefix = prefix
+
+    @classmethod
+    def from_url(cls, url: str, ttl: float, prefix: str = "revoked:"):
+        from redis import asyncio as redis
+
+        return cls(redis.from_url(url), ttl, prefix)
+
+    async def revoke_token(self, jti: str) -> None:
+        try:
+            await self.client.set(f"{self.prefix}token:{jti}", 1, px=self.ttl_ms)
+        except Exception as error:
+            raise RevocationStoreError(f"Could not store the revoked token: {error!r}") from error
+
+    async def revoke_user(self, user_id: int, valid_from: int) -> None:
+        from redis.exceptions import WatchError
+
+        key = f"{self.prefix}user:{user_id}"
+        try:
+            for _ in range(self.MAX_ATTEMPTS):
+                try:
+                    async with self.client.pipeline() as pipe:
+                        await pipe.watch(key)
+                        current = await pipe.get(key)
+                        pipe.multi()
+                        pipe.set(key, max(valid_from, int(current or 0)), px=self.ttl_ms)
+                        await pipe.execute()
+                        return
+                except WatchError:
+                    continue
+        except Exception as error:
+            raise RevocationStoreError(f"Could not store the revoked user version: {error!r}") from error
+        raise RevocationStoreError(f"Gave up revoking the tokens of user {user_id} after {self.MAX_ATTEMPTS} attempts")
+
+    async def is_revoked(self, jti: str | None, user_id: int | None, version: int | None) -> bool:
+        checks_user = user_id is not None and version is not None
+        keys = []
+        if jti is not None:
+            keys.append(f"{self.prefix}token:{jti}")
+        if checks_user:
+            keys.append(f"{self.prefix}user:{user_id}")
+        if not keys:
+            return False
+        try:
+            values = await self.client.mget(*keys)
+        except Exception as error:
+            raise RevocationStoreError(f"Could not check revocations: {error!r}") from error
+        if jti is not None and values[0] is not None:
+            return True
+        return checks_user and values[-1] is not None and version < int(values[-1])
+
+
+def create_revocation_store(backend: str, ttl: float, redis_url: str | None = None):
+    if backend == "redis":
+        return RedisRevocationStore.from_url(redis_url, ttl)
+    if backend == "local":
+        return LocalRevocationStore(ttl)
+    raise ValueError(f"Unknown revocation backend {backend!r}, use local or redis")
@@ -1,8 +1,11 @@
 from datetime import date
-from typing import Optional
-from pydantic import BaseModel
+from typing import Annotated, Literal, Optional, Union
+from pydantic import BaseModel, Field
 from pydantic import EmailStr
 
+# Most operations a single circulation batch may carry.
+CIRCULATION_BATCH_LIMIT = 500
+
 
 # It is used for creating a user.
 class UserCreate(BaseModel):
@@ -13,6 +16,18 @@ class UserCreate(BaseModel):
         from_attributes = True
 
 
+# It is used for listing users, without the password hash
+class UserOut(BaseModel):
+    id: int
+    email: EmailStr
+
+
+# A page of users for cursor pagination, next_cursor is None on the last page.
+class UserPage(BaseModel):
+    items: list[UserOut]
+    next_cursor: Optional[str] = None
+
+
 # Main pydantic model for Book
 class BookBase(BaseModel):
     title: str
@@ -27,13 +42,14 @@ class BookBase(BaseModel):
 
 
 # While creating a book, it doesn't require the id.
+# copy is re-declared because an inherited default would resolve to the BaseModel.copy method it shadows.
 class BookCreate(BookBase):
-    pass
+    copy: int = 1
 
 
 # While creating a book, it doesn't require the id from here, but from path parameters.
 class BookPutUpdate(BookBase):
-    pass
+    copy: int = 1
 
 
 # While creating a book, it doesn't require the id from here, but from path parameters.
@@ -52,6 +68,12 @@ class BookOut(BookBase):
     id: int
 
 
+# A page of books for cursor pagination, next_cursor is None on the last page.
+class BookPage(BaseModel):
+    items: list[BookOut]
+    next_cursor: Optional[str] = None
+
+
 # Main pydantic model for Reader
 class ReaderBase(BaseModel):
     full_name: str
@@ -79,6 +101,12 @@ class ReaderOut(ReaderBase):
     id: int
 
 
+# A page of readers for cursor pagination, next_cursor is None on the last page.
+class ReaderPage(BaseModel):
+    items: list[ReaderOut]
+    next_cursor: Optional[str] = None
+
+
 # It is used for creating borrow record
 class BorrowInput(BaseModel):
     book_id: int
@@ -91,10 +119,84 @@ class BorrowOut(BaseModel):
     book_id: int
     reader_id: int
     borrow_date: date
+    due_date: date
     return_date: Optional[date] = None
 
 
+# A borrow record with the book and reader it refers to, each only present when asked for with expand.
+class BorrowExpandedOut(BorrowOut):
+    book: Optional[BookOut] = None
+    reader: Optional[ReaderOut] = None
+
+
 # It is used for returning borrow record.
 class ReturnInput(BaseModel):
     borrow_id: int
     reader_id: int
+
+
+# A lend inside a circulation batch, op tells it apart from a return.
+class LendOperation(BorrowInput):
+    op: Literal["lend"]
+
+
+# A return inside a circulation batch.
+class ReturnOperation(ReturnInput):
+    op: Literal["return"]
+
+
+# Lends and returns sent together by a circulation desk or a sync client.
+class CirculationBatch(BaseModel):
+    operations: list[Annotated[Union[LendOperation, ReturnOperation], Field(discriminator="op")]] = Field(
+        min_length=1, max_length=CIRCULATION_BATCH_LIMIT
+    )
+
+
+# Outcome of one operation of a batch, status_code and detail are what /books/lend or /books/return would answer.
+class CirculationResult(BaseModel):
+    index: int
+    op: str
+    status: str
+    status_code: int
+    detail: Optional[str] = None
+    borrow: Optional[BorrowOut] = None
+
+
+# Results in the order of the operations sent.
+class CirculationBatchOut(BaseModel):
+    succeeded: int
+    failed: int
+    results: list[CirculationResult]
+
+
+# Circulation totals for the dashboard, books_out is how many borrows are still open.
+class CirculationSummary(BaseModel):
+    total_borrows: int
+    total_returns: int
+    books_out: int
+    borrows_today: int
+    returns_today: int
+
+
+# Borrows and returns of one day.
+class DailyCirculationOut(BaseModel):
+    day: date
+    borrows: int
+    returns: int
+
+
+# A book with how many times it was borrowed.
+class TopBookOut(BaseModel):
+    id: int
+    title: str
+    author: str
+    borrow_count: int
+    last_borrowed: Optional[date] = None
+
+
+# A reader with how many books they borrowed.
+class TopReaderOut(BaseModel):
+    id: int
+    full_name: str
+    borrow_count: int
+    last_borrowed: Optional[date] = None
@@ -0,0 +1,23 @@
+from functools import lru_cache
+from typing import Any
+from fastapi import Response
+from pydantic import TypeAdapter
+
+
+# Building a TypeAdapter compiles its validator and serializer, so each response type gets one for the process lifetime
+@lru_cache(maxsize=None)
+def type_adapter(response_type: Any) -> TypeAdapter:
+    return TypeAdapter(response_type)
+
+
+# Validates rows (ORM objects, Row tuples or anything with the fields as attributes) in one call and dumps them
+# straight to JSON bytes in pydantic-core, the same output FastAPI's response_model path produces.
+def dump_json(response_type: Any, data: Any) -> bytes:
+    adapter = type_adapter(response_type)
+    return adapter.dump_json(adapter.validate_python(data, from_attributes=True))
+
+
+# For list endpoints: returned as is, FastAPI skips its per-object validation and the json module encode.
+# The endpoint keeps its response_model for the OpenAPI schema.
+def json_response(response_type: Any, data: Any, headers: dict | None = None) -> Response:
+    return Response(dump_json(response_type, data), media_type="application/json", headers=headers)
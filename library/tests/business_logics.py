@@ -1,42 +1,24 @@
+import asyncio
+import json
+import uuid
+from datetime import date, timedelta
 import pytest
-from httpx import ASGITransport, AsyncClient
+from fakeredis import aioredis
+from jose import jwt
+from pydantic import TypeAdapter
+from sqlalchemy import delete, literal_column, select, text, update
 from sqlalchemy.ext.asyncio import AsyncSession
-from library.crud import get_book_by_id
-from library.database import AsyncSessionLocal
-from main import app
-
-
-# Yields a test client
-@pytest.fixture
-async def client():
-    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
-        yield ac
-
-
-# Yields a database session
-@pytest.fixture
-async def db_session():
-    async with AsyncSessionLocal() as session:
-        yield session
-
-
-# Creates a custom test user (librarian) and logs in and generates a token
-@pytest.fixture
-async def token(client):
-    REGISTER_URL = "/auth/register/"
-    LOGIN_URL = "/auth/login/"
-    user_data = {
-        "email": "testuser@example.com",
-        "password": "testpassword123"
-    }
-
-    await client.post(REGISTER_URL, json=user_data)
-
-    response = await client.post(LOGIN_URL, json=user_data)
-    assert response.status_code == 200, f"Login failed: {response.json()}"
-
-    token = response.json()["access_token"]
-    return token
+from library import book_import, jobs, partitions, replicas, utils
+from library.cache import RedisCacheBackend
+from library.revocations import RedisRevocationStore
+from library.config import DBConfig
+from library.database import engine
+from library.crud import book as book_crud
+from library.crud.borrow import LOAN_DAYS
+from library.crud import get_book_by_id, get_user_by_email
+from library.hashing import pwd_context
+from library.models import Book, BorrowedBook, Reader, User
+from library.schemas import BookOut
 
 
 # Main test for lending and returning books (Business logics)
@@ -78,6 +60,82 @@ class TestAPI:
         assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
 
 
+    async def test_circulation_batch(self, client, token, queries, created_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        book = (await client.post("/books/create", json={"title": "Batched", "author": "Tester", "copy": 2},
+                                  headers=headers)).json()
+        created_rows(Book, book["id"])
+        readers = [
+            (await client.post("/readers/create", headers=headers, json={
+                "full_name": "Batcher", "email": f"batch-{uuid.uuid4().hex}@example.com",
+            })).json()
+            for _ in range(3)
+        ]
+        for reader in readers:
+            created_rows(Reader, reader["id"])
+        borrow = (await client.post("/books/lend", json={"book_id": book["id"], "reader_id": readers[0]["id"]},
+                                    headers=headers)).json()
+
+        queries.reset()
+        response = await client.post("/books/circulation/batch", headers=headers, json={"operations": [
+            {"op": "lend", "book_id": book["id"], "reader_id": readers[1]["id"]},
+            {"op": "lend", "book_id": book["id"], "reader_id": readers[2]["id"]},
+            {"op": "return", "borrow_id": borrow["id"], "reader_id": readers[0]["id"]},
+            {"op": "return", "borrow_id": borrow["id"], "reader_id": readers[0]["id"]},
+            {"op": "lend", "book_id": 999999, "reader_id": readers[0]["id"]},
+        ]})
+        assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
+        assert queries.commits == 1
+
+        body = response.json()
+        assert [result["status"] for result in body["results"]] == [
+            "ok", "no_copies", "ok", "already_returned", "book_not_found"
+        ]
+        assert [result["status_code"] for result in body["results"]] == [200, 400, 200, 400, 404]
+        assert (body["succeeded"], body["failed"]) == (2, 3)
+        assert body["results"][0]["borrow"]["reader_id"] == readers[1]["id"]
+        assert body["results"][2]["borrow"]["return_date"] is not None
+
+        # The failed operations were rolled back on their own, the successful ones were kept
+        assert (await client.get(f"/books/{book['id']}", headers=headers)).json()["copy"] == 1
+        response = await client.get(f"/books/borrows/notreturn/{readers[2]['id']}", headers=headers)
+        assert response.status_code == 404
+
+        response = await client.post("/books/circulation/batch", headers=headers,
+                                     json={"operations": [{"op": "renew", "borrow_id": 1, "reader_id": 1}]})
+        assert response.status_code == 422
+
+    async def test_expanded_borrow_history(self, client, token, queries, created_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        email = f"history-{uuid.uuid4().hex}@example.com"
+        reader = (await client.post("/readers/create", json={"full_name": "History", "email": email},
+                                    headers=headers)).json()
+        created_rows(Reader, reader["id"])
+        for title in ("First", "Second"):
+            book = (await client.post("/books/create", json={"title": title, "author": "Tester"},
+                                      headers=headers)).json()
+            created_rows(Book, book["id"])
+            await client.post("/books/lend", json={"book_id": book["id"], "reader_id": reader["id"]}, headers=headers)
+
+        queries.reset()
+        response = await client.get(f"/books/borrows/{reader['id']}", params={"expand": "book,reader", "limit": 5},
+                                    headers=headers)
+        assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
+        assert len(queries.statements) == 1
+
+        borrows = response.json()
+        assert [borrow["book"]["title"] for borrow in borrows] == ["First", "Second"]
+        assert all(borrow["reader"]["email"] == email for borrow in borrows)
+        assert all(borrow["return_date"] is None for borrow in borrows)
+
+        response = await client.get(f"/books/borrows/notreturn/{reader['id']}", params={"skip": 1}, headers=headers)
+        assert [set(borrow) for borrow in response.json()] == [{"id", "book_id", "reader_id", "borrow_date",
+                                                                "due_date", "return_date"}]
+
+        response = await client.get(f"/books/borrows/{reader['id']}", params={"expand": "author"}, headers=headers)
+        assert response.status_code == 400
+
+
 class TestBooksAPI:
     async def test_get_books(self, client, token):
         headers = {"Authorization": f"Bearer {token}"}
@@ -85,11 +143,142 @@ class TestBooksAPI:
         response = await client.get("/books/", headers=headers)
         assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
 
+    async def test_get_books_cursor(self, client, token):
+        headers = {"Authorization": f"Bearer {token}"}
+
+        seen = []
+        cursor = ""
+        while cursor is not None:
+            response = await client.get("/books/", params={"cursor": cursor, "limit": 3}, headers=headers)
+            assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
+            page = response.json()
+            seen.extend(book["id"] for book in page["items"])
+            cursor = page["next_cursor"]
+
+        assert seen == sorted(seen)
+        assert len(seen) == len(set(seen))
+
+        response = await client.get("/books/", params={"limit": 100}, headers=headers)
+        assert [book["id"] for book in response.json()] == seen
+
+    # The bulk serialization path sends the same bytes FastAPI's response_model path did for the ORM objects
+    async def test_list_wire_format(self, client, db_session: AsyncSession, token, created_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        book = (await client.post("/books/create", json={"title": "Çalıkuşu", "author": "Reşat Nuri", "copy": 1},
+                                  headers=headers)).json()
+        created_rows(Book, book["id"])
+
+        response = await client.get("/books/", params={"limit": 100}, headers=headers)
+        assert response.headers["content-type"] == "application/json"
+        books = (await db_session.execute(select(Book).order_by(Book.id).limit(100))).scalars().all()
+        adapter = TypeAdapter(list[BookOut])
+        expected = adapter.dump_python(adapter.validate_python(books, from_attributes=True), mode="json")
+        assert response.content == json.dumps(expected, ensure_ascii=False, separators=(",", ":")).encode()
+
+        response = await client.get("/readers/", params={"cursor": "", "limit": 2}, headers=headers)
+        page = response.json()
+        assert set(page) == {"items", "next_cursor"}
+        assert [set(reader) for reader in page["items"]] == [{"id", "full_name", "email"}] * len(page["items"])
+
+    async def test_search_books(self, client, token, created_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        # A word no other book has, letters only so the parser keeps it as one word
+        word = uuid.uuid4().hex.translate(str.maketrans("0123456789", "ghijklmnop"))
+        data = {"title": f"Searchable {word} Atlas", "author": "Quentin Mapmaker", "copy": 1}
+        book = (await client.post("/books/create", json=data, headers=headers)).json()
+        created_rows(Book, book["id"])
+
+        response = await client.get("/books/search", params={"q": f"{word} mapmaker"}, headers=headers)
+        assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
+        assert [found["id"] for found in response.json()] == [book["id"]]
+
+        response = await client.get("/books/search", params={"q": f"{word} -atlas"}, headers=headers)
+        assert response.json() == []
+
+    async def test_reads_use_replica(self, client, token, monkeypatch, created_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        # The primary stands in for a replica, its lag is always 0
+        replica = replicas.Replica(DBConfig.DB_URL)
+        monkeypatch.setattr(replicas, "replicas", [replica])
+        monkeypatch.setattr(replicas, "replica_cycle", iter(lambda: replica, None))
+
+        try:
+            # Until the lag job has checked it, the replica takes no reads
+            assert replica.current_lag() == float("inf")
+            assert await jobs.replica_lag_check.run_once() == {replica.name: 0.0}
+
+            before = (await client.get("/system/replicas", headers=headers)).json()["routing"]
+            response = await client.get("/books/", headers=headers)
+            assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
+
+            data = {"title": "Fresh Write", "author": "Tester", "copy": 1}
+            response = await client.post("/books/create", json=data, headers=headers)
+            created_rows(Book, response.json()["id"])
+            assert replicas.READ_YOUR_WRITES_COOKIE in response.cookies
+
+            response = await client.get(f"/books/{response.json()['id']}", headers=headers)
+            assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
+
+            after = (await client.get("/system/replicas", headers=headers)).json()["routing"]
+            assert after["replica"] == before["replica"] + 1
+            assert after["read_your_writes"] == before["read_your_writes"] + 1
+        finally:
+            client.cookies.clear()
+            await replica.engine.dispose()
+
     async def test_get_book_by_id(self, client, token):
         headers = {"Authorization": f"Bearer {token}"}
         response = await client.get("/books/1", headers=headers)
         assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
 
+    async def test_book_etag(self, client, token, created_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        data = {"title": "Tagged", "author": "Tester", "copy": 2}
+        book = (await client.post("/books/create", json=data, headers=headers)).json()
+        created_rows(Book, book["id"])
+
+        response = await client.get(f"/books/{book['id']}", headers=headers)
+        etag = response.headers["ETag"]
+        response = await client.get(f"/books/{book['id']}", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+        page = await client.get("/books/", params={"cursor": "", "limit": 5}, headers=headers)
+        response = await client.get("/books/", params={"cursor": "", "limit": 5},
+                                    headers={**headers, "If-None-Match": page.headers["ETag"]})
+        assert response.status_code == 304
+
+        await client.patch(f"/books/patch/{book['id']}", json={"copy": 3}, headers=headers)
+        response = await client.get(f"/books/{book['id']}", headers={**headers, "If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["ETag"] != etag
+
+    async def test_book_cache_follows_lending(self, client, token, monkeypatch, created_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        monkeypatch.setattr(book_crud, "book_cache", RedisCacheBackend(aioredis.FakeRedis(), ttl=30, prefix="book:"))
+
+        book = (await client.post("/books/create", json={"title": "Cached", "author": "Tester", "copy": 2},
+                                  headers=headers)).json()
+        reader = (await client.post("/readers/create", json={"full_name": "Cache Reader",
+                                                             "email": f"cachereader-{uuid.uuid4().hex}@example.com"},
+                                    headers=headers)).json()
+        created_rows(Reader, reader["id"])
+
+        response = await client.get(f"/books/{book['id']}", headers=headers)
+        assert response.json()["copy"] == 2
+        assert book_crud.book_cache.hits == 1
+
+        borrow = (await client.post("/books/lend", json={"book_id": book["id"], "reader_id": reader["id"]},
+                                    headers=headers)).json()
+        assert (await client.get(f"/books/{book['id']}", headers=headers)).json()["copy"] == 1
+
+        await client.post("/books/return", json={"borrow_id": borrow["id"], "reader_id": reader["id"]}, headers=headers)
+        assert (await client.get(f"/books/{book['id']}", headers=headers)).json()["copy"] == 2
+
+        await client.delete(f"/books/delete/{book['id']}", headers=headers)
+        assert (await client.get(f"/books/{book['id']}", headers=headers)).status_code == 404
+        assert book_crud.book_cache.hits == 3
+
     async def test_create_book(self, client, token):
         headers = {"Authorization": f"Bearer {token}"}
         data = {
@@ -103,6 +292,49 @@ class TestBooksAPI:
         response = await client.post("/books/create", json=data, headers=headers)
         assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
 
+    async def test_bulk_import_books(self, client, db_session: AsyncSession, token, created_rows):
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": "text/csv"}
+        isbn = f"bulk-{uuid.uuid4().hex[:12]}"
+        body = (
+            "title,author,description,year,isbn,copy\n"
+            f"Bulk One,Author,\"multi\nline\",2001,{isbn}-1,2\n"
+            f"Bulk Two,Author,,not-a-year,{isbn}-2,1\n"
+            f",Author,,,{isbn}-3,1\n"
+            f"Bulk One Again,Author,,2002,{isbn}-1,4\n"
+        )
+        response = await client.post("/books/bulk", content=body, headers=headers)
+        assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
+        for book_id in (await db_session.scalars(select(Book.id).where(Book.isbn.startswith(isbn)))).all():
+            created_rows(Book, book_id)
+        report = response.json()
+        assert (report["inserted"], report["updated"], report["failed"]) == (1, 0, 2)
+        assert [error["line"] for error in report["errors"]] == [4, 5]
+
+        headers["Content-Type"] = "application/x-ndjson"
+        body = json.dumps({"title": "Bulk One Updated", "author": "Author", "isbn": f"{isbn}-1"}) + "\nnot json\n"
+        response = await client.post("/books/bulk", content=body, headers=headers)
+        report = response.json()
+        assert (report["inserted"], report["updated"], report["failed"]) == (0, 1, 1)
+
+    async def test_large_import_clears_book_cache(self, client, token, monkeypatch, created_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        redis = aioredis.FakeRedis()
+        monkeypatch.setattr(book_crud, "book_cache", RedisCacheBackend(redis, ttl=30, prefix="book:"))
+        monkeypatch.setattr(book_import, "MAX_INVALIDATED_BOOKS", 0)
+        isbn = f"clear-{uuid.uuid4().hex[:12]}"
+        book = (await client.post("/books/create", json={"title": "Before", "author": "Tester", "isbn": isbn, "copy": 1},
+                                  headers=headers)).json()
+        created_rows(Book, book["id"])
+        await client.get(f"/books/{book['id']}", headers=headers)
+        assert await redis.exists(f"book:{book['id']}")
+
+        body = json.dumps({"title": "After", "author": "Tester", "isbn": isbn}) + "\n"
+        response = await client.post("/books/bulk", content=body,
+                                     headers={**headers, "Content-Type": "application/x-ndjson"})
+        assert response.json()["updated"] == 1
+        assert not await redis.keys("book:*")
+        assert (await client.get(f"/books/{book['id']}", headers=headers)).json()["title"] == "After"
+
     async def test_update_patch_book(self, client, token):
         headers = {"Authorization": f"Bearer {token}"}
         data = {
@@ -124,3 +356,389 @@ class TestBooksAPI:
 
         response = await client.delete("/books/delete/16", headers=headers)
         assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
+
+
+# Every mutation is one transaction with a single commit, and no SELECT is spent re-reading what was just written
+class TestUnitOfWork:
+    async def test_mutations_commit_once(self, client, token, queries, created_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        await client.get("/system/auth-cache", headers=headers)
+
+        async def call(method, url, json=None):
+            queries.reset()
+            response = await client.request(method, url, json=json, headers=headers)
+            assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
+            return response.json(), len(queries.statements), queries.commits
+
+        book, statements, commits = await call("POST", "/books/create", {"title": "Counted", "author": "Tester"})
+        assert (statements, commits) == (1, 1)
+        created_rows(Book, book["id"])
+
+        _, statements, commits = await call("PATCH", f"/books/patch/{book['id']}", {"copy": 2})
+        assert (statements, commits) == (1, 1)
+
+        email = f"counted-{uuid.uuid4().hex}@example.com"
+        reader, statements, commits = await call("POST", "/readers/create", {"full_name": "Counted", "email": email})
+        assert (statements, commits) == (1, 1)
+        created_rows(Reader, reader["id"])
+
+        _, statements, commits = await call("PUT", f"/readers/put/{reader['id']}",
+                                            {"full_name": "Recounted", "email": email})
+        assert (statements, commits) == (1, 1)
+
+        borrow, statements, commits = await call("POST", "/books/lend",
+                                                 {"book_id": book["id"], "reader_id": reader["id"]})
+        assert (statements, commits) == (2, 1)
+
+        _, statements, commits = await call("POST", "/books/return",
+                                            {"borrow_id": borrow["id"], "reader_id": reader["id"]})
+        assert (statements, commits) == (1, 1)
+
+        _, statements, commits = await call("GET", f"/books/{book['id']}")
+        assert (statements, commits) == (0, 0)
+
+    # Statement and row budgets of the hot paths, as reported in Server-Timing
+    async def test_request_budgets(self, client, token, queries, db_budget, created_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        await client.get("/system/auth-cache", headers=headers)
+
+        book = (await client.post("/books/create", json={"title": "Budgeted", "author": "Tester", "copy": 2},
+                                  headers=headers)).json()
+        created_rows(Book, book["id"])
+        reader = (await client.post("/readers/create", headers=headers, json={
+            "full_name": "Budgeted", "email": f"budget-{uuid.uuid4().hex}@example.com",
+        })).json()
+        created_rows(Reader, reader["id"])
+
+        queries.reset()
+        response = await client.post("/books/lend", json={"book_id": book["id"], "reader_id": reader["id"]},
+                                     headers=headers)
+        assert response.status_code == 200
+        timing = db_budget(response, statements=3, rows=3)
+        assert timing["db-statements"] == len(queries.statements) and timing["db"] > 0
+
+        queries.reset()
+        response = await client.post("/books/return", json={"borrow_id": response.json()["id"],
+                                                             "reader_id": reader["id"]}, headers=headers)
+        assert response.status_code == 200
+        db_budget(response, statements=2, rows=2)
+
+        queries.reset()
+        response = await client.get("/books/", params={"limit": 5}, headers=headers)
+        assert response.status_code == 200
+        db_budget(response, statements=1, rows=5)
+
+        queries.reset()
+        response = await client.get(f"/books/borrows/{reader['id']}", params={"expand": "book"},
+                                    headers=headers)
+        assert response.status_code == 200
+        db_budget(response, statements=1, rows=1)
+
+
+class TestStatsAPI:
+    async def test_circulation_stats_follow_lending(self, client, token, created_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        book = (await client.post("/books/create", json={"title": "Charted", "author": "Tester", "copy": 5},
+                                  headers=headers)).json()
+        created_rows(Book, book["id"])
+        readers = [
+            (await client.post("/readers/create", headers=headers, json={
+                "full_name": "Statistician", "email": f"stats-{uuid.uuid4().hex}@example.com",
+            })).json()
+            for _ in range(3)
+        ]
+        for reader in (readers[0], readers[2]):
+            created_rows(Reader, reader["id"])
+
+        before = (await client.get("/stats/summary", headers=headers)).json()
+        borrows = [
+            (await client.post("/books/lend", json={"book_id": book["id"], "reader_id": reader["id"]},
+                               headers=headers)).json()
+            for reader in readers
+        ]
+        await client.post("/books/return", json={"borrow_id": borrows[0]["id"], "reader_id": readers[0]["id"]},
+                          headers=headers)
+
+        after = (await client.get("/stats/summary", headers=headers)).json()
+        assert after["borrows_today"] == before["borrows_today"] + 3
+        assert after["returns_today"] == before["returns_today"] + 1
+        assert after["books_out"] == before["books_out"] + 2
+
+        top = (await client.get("/stats/top-books", params={"limit": 1}, headers=headers)).json()
+        assert top[0]["id"] == book["id"] and top[0]["borrow_count"] == 3
+
+        daily = (await client.get("/stats/daily", headers=headers)).json()
+        assert daily[-1]["borrows"] >= 3
+
+        await client.delete(f"/readers/delete/{readers[1]['id']}", headers=headers)
+        after_delete = (await client.get("/stats/summary", headers=headers)).json()
+        assert after_delete["books_out"] == after["books_out"] - 1
+
+
+class TestOverdueScan:
+    async def test_scan_flags_and_notifies_overdue_loans(self, client, db_session: AsyncSession, token, monkeypatch,
+                                                         created_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        book = (await client.post("/books/create", json={"title": "Overdue", "author": "Tester", "copy": 5},
+                                  headers=headers)).json()
+        created_rows(Book, book["id"])
+        readers = [
+            (await client.post("/readers/create", headers=headers, json={
+                "full_name": "Latecomer", "email": f"late-{uuid.uuid4().hex}@example.com",
+            })).json()
+            for _ in range(3)
+        ]
+        for reader in readers:
+            created_rows(Reader, reader["id"])
+        borrows = [
+            (await client.post("/books/lend", json={"book_id": book["id"], "reader_id": reader["id"]},
+                               headers=headers)).json()
+            for reader in readers
+        ]
+        assert borrows[0]["due_date"] == str(date.today() + timedelta(days=LOAN_DAYS))
+        await client.post("/books/return", json={"borrow_id": borrows[2]["id"], "reader_id": readers[2]["id"]},
+                          headers=headers)
+        ids = [borrow["id"] for borrow in borrows]
+        await db_session.execute(
+            update(BorrowedBook).where(BorrowedBook.id.in_(ids)).values(due_date=date.today() - timedelta(days=1))
+        )
+        await db_session.commit()
+
+        notified = []
+
+        async def notifier(loan):
+            if loan.id == ids[1] and ids[1] not in notified:
+                notified.append(loan.id)
+                raise ConnectionError("mail server down")
+            notified.append(loan.id)
+
+        monkeypatch.setattr(jobs, "overdue_notifier", notifier)
+        result = await jobs.scan_overdue_loans(chunk_size=1, pause=0)
+        assert result["chunks"] >= 2 and result["failed"] == 1
+        # The returned loan is skipped, the failed notification is unflagged and retried by the next scan
+        assert set(notified) & set(ids) == {ids[0], ids[1]}
+        flags = dict((await db_session.execute(
+            select(BorrowedBook.id, BorrowedBook.overdue_notified_at).where(BorrowedBook.id.in_(ids))
+        )).all())
+        assert flags[ids[0]] is not None and flags[ids[1]] is None and flags[ids[2]] is None
+
+        notified.clear()
+        await jobs.scan_overdue_loans(pause=0)
+        assert ids[1] in notified and ids[0] not in notified
+
+        stats = (await client.get("/system/jobs", headers=headers)).json()
+        assert stats["overdue_scan"]["totals"]["failed"] >= 1
+
+
+class TestPartitions:
+    async def test_yearly_partitions(self, client, db_session: AsyncSession, token, monkeypatch, created_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        book = (await client.post("/books/create", json={"title": "Archived", "author": "Tester", "copy": 5},
+                                  headers=headers)).json()
+        created_rows(Book, book["id"])
+        reader = (await client.post("/readers/create", headers=headers, json={
+            "full_name": "Archivist", "email": f"archive-{uuid.uuid4().hex}@example.com",
+        })).json()
+        created_rows(Reader, reader["id"])
+        try:
+            await self.check_yearly_partitions(client, db_session, headers, book, reader, monkeypatch)
+        finally:
+            await db_session.rollback()
+            async with engine.begin() as conn:
+                await conn.execute(text("DROP TABLE IF EXISTS borrowed_books_1990"))
+                await conn.execute(text("DROP SCHEMA IF EXISTS archive_test CASCADE"))
+
+    async def check_yearly_partitions(self, client, db_session: AsyncSession, headers, book, reader, monkeypatch):
+        old = BorrowedBook(book_id=book["id"], reader_id=reader["id"], borrow_date=date(1990, 5, 1),
+                           due_date=date(1990, 5, 15), return_date=date(1990, 5, 10))
+        db_session.add(old)
+        await db_session.commit()
+        old_id = old.id
+        located = select(literal_column("tableoid::regclass::text")).where(BorrowedBook.id == old_id)
+        assert await db_session.scalar(located) == partitions.DEFAULT_PARTITION
+        await db_session.rollback()
+
+        # Creating the year moves its rows out of the default partition
+        async with engine.begin() as conn:
+            assert await partitions.create_partitions(conn, 1990, 1990) == ["borrowed_books_1990"]
+        assert await db_session.scalar(located) == "borrowed_books_1990"
+        await db_session.rollback()
+
+        response = await client.get(f"/books/borrows/{reader['id']}",
+                                    params={"since": "1990-01-01", "until": "1990-12-31"}, headers=headers)
+        assert [borrow["id"] for borrow in response.json()] == [old_id]
+
+        # Open-loan listings are bounded by the oldest open loan, lending and returning never are
+        async with engine.connect() as conn:
+            monkeypatch.setattr(partitions, "open_loans_since", date.min)
+            since = await partitions.refresh_open_loans_since(conn)
+        assert since <= date.today()
+        borrow = (await client.post("/books/lend", json={"book_id": book["id"], "reader_id": reader["id"]},
+                                    headers=headers)).json()
+        response = await client.post("/books/lend", json={"book_id": book["id"], "reader_id": reader["id"]},
+                                     headers=headers)
+        assert response.status_code == 400
+        assert len((await client.get(f"/books/borrows/notreturn/{reader['id']}", headers=headers)).json()) == 1
+        response = await client.post("/books/return", json={"borrow_id": borrow["id"], "reader_id": reader["id"]},
+                                     headers=headers)
+        assert response.status_code == 200
+
+        # A loan reopened before the bound is still found by returns
+        await db_session.execute(update(BorrowedBook).where(BorrowedBook.id == old_id).values(return_date=None))
+        await db_session.execute(
+            update(Reader).where(Reader.id == reader["id"]).values(active_borrow_count=Reader.active_borrow_count + 1)
+        )
+        await db_session.commit()
+        monkeypatch.setattr(partitions, "open_loans_since", date.today())
+        response = await client.post("/books/return", json={"borrow_id": old_id, "reader_id": reader["id"]},
+                                     headers=headers)
+        assert response.status_code == 200
+
+        # A year with open loans stays attached, otherwise it is moved to the archive schema
+        await db_session.execute(update(BorrowedBook).where(BorrowedBook.id == old_id).values(return_date=None))
+        await db_session.commit()
+        with pytest.raises(ValueError):
+            async with engine.begin() as conn:
+                await partitions.detach_partition(conn, 1990, "archive_test")
+        await db_session.execute(
+            update(BorrowedBook).where(BorrowedBook.id == old_id).values(return_date=date(1990, 5, 10))
+        )
+        await db_session.commit()
+        async with engine.begin() as conn:
+            await partitions.detach_partition(conn, 1990, "archive_test")
+        assert await db_session.scalar(located) is None
+        assert await db_session.scalar(text("SELECT count(*) FROM archive_test.borrowed_books_1990")) == 1
+
+
+class TestMetricsAPI:
+    async def test_metrics_exposition(self, client, token):
+        headers = {"Authorization": f"Bearer {token}"}
+        await client.get("/books/1", headers=headers)
+        await client.get("/books/999999", headers=headers)
+
+        response = await client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        text = response.text
+
+        # Routes are labelled by template, so every book id shares one series
+        assert 'http_requests_total{method="GET",route="/books/{book_id}",status="200"}' in text
+        assert 'http_requests_total{method="GET",route="/books/{book_id}",status="404"}' in text
+        assert 'http_request_duration_seconds_bucket{method="GET",route="/books/{book_id}",le="+Inf"}' in text
+        assert 'db_statement_duration_seconds_count{engine="primary",operation="SELECT"}' in text
+        assert 'db_pool_connections{state="checked_out"}' in text
+        assert 'cache_hits_total{cache="principal"}' in text
+        assert "# TYPE hashing_queue_seconds histogram" in text
+
+
+class TestReadersAPI:
+    async def test_stream_readers(self, client, token):
+        headers = {"Authorization": f"Bearer {token}"}
+
+        response = await client.get("/readers/", params={"stream": True}, headers=headers)
+        assert response.status_code == 200, f"Got {response.status_code}: {response.text}"
+        assert response.headers["content-type"] == "application/x-ndjson"
+
+        lines = response.text.splitlines()
+        ids = [json.loads(line)["id"] for line in lines]
+        assert ids == sorted(ids)
+
+        response = await client.get("/readers/", params={"limit": len(ids) + 1}, headers=headers)
+        assert [reader["id"] for reader in response.json()] == ids
+
+
+class TestAuthAPI:
+    async def test_principal_cache(self, client, token):
+        headers = {"Authorization": f"Bearer {token}"}
+
+        before = (await client.get("/system/auth-cache", headers=headers)).json()
+        response = await client.get("/system/auth-cache", headers=headers)
+        assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
+
+        after = response.json()
+        assert after["hits"] == before["hits"] + 1
+        assert after["misses"] == before["misses"]
+
+    async def test_users_cursor(self, client, token):
+        headers = {"Authorization": f"Bearer {token}"}
+
+        seen = []
+        cursor = ""
+        while cursor is not None:
+            response = await client.get("/auth/users/", params={"cursor": cursor, "limit": 2}, headers=headers)
+            assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
+            page = response.json()
+            assert all(set(user) == {"id", "email"} for user in page["items"])
+            seen.extend(user["id"] for user in page["items"])
+            cursor = page["next_cursor"]
+
+        assert seen == sorted(seen) and len(seen) == len(set(seen))
+        response = await client.get("/auth/users/", params={"limit": 100}, headers=headers)
+        assert [user["id"] for user in response.json()] == seen[:100]
+
+    async def test_logout_revokes_token(self, client):
+        user_data = {"email": "logoutuser@example.com", "password": "testpassword123"}
+        await client.post("/auth/register/", json=user_data)
+        token = (await client.post("/auth/login/", json=user_data)).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+
+        response = await client.post("/auth/logout/", headers=headers)
+        assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
+
+        response = await client.get("/books/", headers=headers)
+        assert response.status_code == 401
+
+    async def test_revocations_are_shared(self, client, db_session: AsyncSession, monkeypatch):
+        user_data = {"email": f"revoked-{uuid.uuid4().hex}@example.com", "password": "testpassword123"}
+        await client.post("/auth/register/", json=user_data)
+        redis = aioredis.FakeRedis()
+        monkeypatch.setattr(utils, "revocations", RedisRevocationStore(redis, ttl=60))
+        tokens = [(await client.post("/auth/login/", json=user_data)).json()["access_token"] for _ in range(2)]
+        assert (await client.post("/auth/logout/", headers={"Authorization": f"Bearer {tokens[0]}"})).status_code == 200
+
+        # Another worker has its own store on the same Redis
+        monkeypatch.setattr(utils, "revocations", RedisRevocationStore(redis, ttl=60))
+        response = await client.get("/books/", headers={"Authorization": f"Bearer {tokens[0]}"})
+        assert response.status_code == 401
+        response = await client.get("/books/", headers={"Authorization": f"Bearer {tokens[1]}"})
+        assert response.status_code == 200
+
+        # Racing revocations all land, the highest version wins and the entry is never dropped
+        uid = jwt.get_unverified_claims(tokens[1])["uid"]
+        await asyncio.gather(*(utils.revoke_user_tokens(uid, version) for version in (3, 1, 0, 2, 1)))
+        assert int(await redis.get(f"revoked:user:{uid}")) == 3
+        response = await client.get("/books/", headers={"Authorization": f"Bearer {tokens[1]}"})
+        assert response.status_code == 401
+        await db_session.execute(delete(User).where(User.id == uid))
+        await db_session.commit()
+
+    # Without its store no token is accepted and a logout is not reported as done
+    async def test_revocations_fail_closed(self, client, token, monkeypatch):
+        class UnreachableRedis:
+            async def mget(self, *keys):
+                raise ConnectionError("redis is down")
+
+            async def set(self, *args, **kwargs):
+                raise ConnectionError("redis is down")
+
+        headers = {"Authorization": f"Bearer {token}"}
+        monkeypatch.setattr(utils, "revocations", RedisRevocationStore(UnreachableRedis(), ttl=60))
+        assert (await client.get("/books/", headers=headers)).status_code == 503
+        assert (await client.post("/auth/logout/", headers=headers)).status_code == 503
+
+    async def test_login_rehashes_outdated_password(self, client, db_session: AsyncSession, token):
+        user_data = {"email": "rehashuser@example.com", "password": "testpassword123"}
+        await client.post("/auth/register/", json=user_data)
+
+        user = await get_user_by_email(db_session, user_data["email"])
+        user.password = pwd_context.hash(user_data["password"], rounds=4)
+        await db_session.commit()
+
+        response = await client.post("/auth/login/", json=user_data)
+        assert response.status_code == 200, f"Got {response.status_code}: {response.json()}"
+
+        await db_session.refresh(user)
+        assert not pwd_context.needs_update(user.password)
+
+        stats = (await client.get("/system/hashing", headers={"Authorization": f"Bearer {token}"})).json()
+        assert stats["completed"] > 0 and stats["in_flight"] == 0
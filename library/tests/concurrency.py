@@ -0,0 +1,102 @@
+import asyncio
+import uuid
+import pytest
+from sqlalchemy import func, select
+from library.crud import book as book_crud
+from library.models import Book, BorrowedBook, Reader
+
+
+# Lending must never oversell copies or exceed the borrow limit, however many requests race each other
+@pytest.mark.asyncio
+class TestLendConcurrency:
+    async def test_parallel_lends_never_oversell(self, client, db_session, token, make_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        copies = 5
+        lends = 300
+
+        book = await make_rows(Book, title="Contended", author="Tester", copy=copies)
+        readers = [
+            await make_rows(Reader, full_name="Reader", email=f"{uuid.uuid4().hex}@example.com")
+            for _ in range(lends)
+        ]
+
+        responses = await asyncio.gather(*[
+            client.post("/books/lend", json={"book_id": book.id, "reader_id": reader.id}, headers=headers)
+            for reader in readers
+        ])
+
+        codes = [response.status_code for response in responses]
+        assert codes.count(200) == copies, codes
+        assert all(response.json() == {"detail": "No available copies"}
+                   for response in responses if response.status_code != 200)
+
+        await db_session.refresh(book)
+        assert book.copy == 0
+
+        borrowed = await db_session.scalar(
+            select(func.count()).select_from(BorrowedBook).where(BorrowedBook.book_id == book.id)
+        )
+        assert borrowed == copies
+
+    async def test_parallel_lends_respect_borrow_limit(self, client, db_session, token, make_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+
+        reader = await make_rows(Reader, full_name="Reader", email=f"{uuid.uuid4().hex}@example.com")
+        books = [await make_rows(Book, title="Popular", author="Tester", copy=1) for _ in range(20)]
+
+        responses = await asyncio.gather(*[
+            client.post("/books/lend", json={"book_id": book.id, "reader_id": reader.id}, headers=headers)
+            for book in books
+        ])
+
+        codes = [response.status_code for response in responses]
+        assert codes.count(200) == 3, codes
+
+        active = await db_session.scalar(
+            select(func.count()).select_from(BorrowedBook)
+            .where(BorrowedBook.reader_id == reader.id, BorrowedBook.return_date.is_(None))
+        )
+        assert active == 3
+
+        await db_session.refresh(reader)
+        assert reader.active_borrow_count == 3
+
+    async def test_parallel_returns_restock_once(self, client, db_session, token, make_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+
+        reader = await make_rows(Reader, full_name="Reader", email=f"{uuid.uuid4().hex}@example.com")
+        book = await make_rows(Book, title="Returned", author="Tester", copy=1)
+
+        response = await client.post("/books/lend", json={"book_id": book.id, "reader_id": reader.id}, headers=headers)
+        assert response.status_code == 200, response.json()
+        borrow_id = response.json()["id"]
+
+        responses = await asyncio.gather(*[
+            client.post("/books/return", json={"borrow_id": borrow_id, "reader_id": reader.id}, headers=headers)
+            for _ in range(50)
+        ])
+
+        codes = [response.status_code for response in responses]
+        assert codes.count(200) == 1, codes
+        assert all(response.json() == {"detail": "Book already returned"}
+                   for response in responses if response.status_code != 200)
+
+        await db_session.refresh(book)
+        assert book.copy == 1
+
+        await db_session.refresh(reader)
+        assert reader.active_borrow_count == 0
+
+
+# A burst of requests for a book that is not cached yet must reach the database once
+@pytest.mark.asyncio
+class TestBookCacheStampede:
+    async def test_parallel_misses_load_once(self, client, token, make_rows):
+        headers = {"Authorization": f"Bearer {token}"}
+        book = await make_rows(Book, title="Hot", author="Tester", copy=1)
+        before = dict(book_crud.book_load_stats)
+
+        responses = await asyncio.gather(*[client.get(f"/books/{book.id}", headers=headers) for _ in range(50)])
+
+        assert all(response.status_code == 200 for response in responses)
+        assert book_crud.book_load_stats["loads"] == before["loads"] + 1
@@ -0,0 +1,129 @@
+import pytest
+from httpx import ASGITransport, AsyncClient
+from sqlalchemy import delete, event
+from library.crud import delete_book_db, delete_reader_db
+from library.database import AsyncSessionLocal, engine, run_after_commit
+from library.models import Book, Reader
+from main import app
+
+
+# Yields a test client
+@pytest.fixture
+async def client():
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as ac:
+        yield ac
+
+
+# Yields a database session
+@pytest.fixture
+async def db_session():
+    async with AsyncSessionLocal() as session:
+        yield session
+
+
+# Returns track(model, id) for rows a test created through the API, they are deleted (newest first) when it ends.
+# Readers and books are deleted the way the app deletes them, with their loans, so the borrow counters, circulation
+# summaries and book cache stay consistent.
+@pytest.fixture
+async def created_rows(db_session):
+    rows = []
+    yield lambda model, row_id: rows.append((model, row_id))
+
+    await db_session.rollback()
+    deleters = {Book: delete_book_db, Reader: delete_reader_db}
+    for model, row_id in reversed(rows):
+        if model in deleters:
+            await deleters[model](db_session, row_id)
+        else:
+            await db_session.execute(delete(model).where(model.id == row_id))
+    await db_session.commit()
+    await run_after_commit(db_session)
+
+
+# Creates rows (readers, books) that only this test uses, and removes them afterwards
+@pytest.fixture
+async def make_rows(db_session, created_rows):
+    async def make(model, **data):
+        row = model(**data)
+        db_session.add(row)
+        await db_session.commit()
+        created_rows(model, row.id)
+        return row
+
+    return make
+
+
+# SQL statements and commits sent through the primary engine
+class QueryLog:
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def reset(self):
+        self.statements.clear()
+        self.commits = 0
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def on_commit(self, conn):
+        self.commits += 1
+
+
+# Yields a QueryLog recording everything the test does against the database
+@pytest.fixture
+def queries():
+    log = QueryLog()
+    event.listen(engine.sync_engine, "before_cursor_execute", log.on_execute)
+    event.listen(engine.sync_engine, "commit", log.on_commit)
+    yield log
+    event.remove(engine.sync_engine, "before_cursor_execute", log.on_execute)
+    event.remove(engine.sync_engine, "commit", log.on_commit)
+
+
+# Database work of a response as reported in its Server-Timing header: {"db": ms, "db-statements": n, "db-rows": n}
+def db_timing(response) -> dict:
+    timing = {}
+    for metric in response.headers.get("server-timing", "").split(","):
+        name, _, params = metric.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key in ("dur", "desc"):
+                timing[name] = float(value) if key == "dur" else int(value)
+    return timing
+
+
+# Returns check(response, statements=..., rows=...), which fails when a request used more statements or rows than its
+# budget. Run the request with queries reset first, the failure then lists the statements that were sent.
+@pytest.fixture
+def db_budget(queries):
+    def check(response, statements: int | None = None, rows: int | None = None):
+        timing = db_timing(response)
+        sent = "\n".join(queries.statements)
+        if statements is not None:
+            assert timing["db-statements"] <= statements, (
+                f"{timing['db-statements']} statements, budget is {statements}:\n{sent}"
+            )
+        if rows is not None:
+            assert timing["db-rows"] <= rows, f"{timing['db-rows']} rows, budget is {rows}:\n{sent}"
+        return timing
+    return check
+
+
+# Creates a custom test user (librarian) and logs in and generates a token
+@pytest.fixture
+async def token(client):
+    REGISTER_URL = "/auth/register/"
+    LOGIN_URL = "/auth/login/"
+    user_data = {
+        "email": "testuser@example.com",
+        "password": "testpassword123"
+    }
+
+    await client.post(REGISTER_URL, json=user_data)
+
+    response = await client.post(LOGIN_URL, json=user_data)
+    assert response.status_code == 200, f"Login failed: {response.json()}"
+
+    token = response.json()["access_token"]
+    return token
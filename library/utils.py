@@ -1,29 +1,19 @@
 import asyncio
 import os
+import uuid
 from datetime import datetime, timedelta
-from typing import Annotated
+from typing import Annotated, Callable, NamedTuple
 from dotenv import load_dotenv
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError
 from jose import jwt
-from passlib.context import CryptContext
+from library.cache import TTLCache
+from library.config import AuthConfig, CacheConfig
 from library.database import SessionDep
+from library.hashing import pwd_context, hash_password, verify_password, verify_and_update_password
 from library.models import User
-
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
-# Hash the password (run sync function in a thread)
-async def hash_password(password: str) -> str:
-    return await asyncio.to_thread(pwd_context.hash, password)
-
-
-# Verify the hashed password
-async def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return await asyncio.to_thread(pwd_context.verify, plain_password, hashed_password)
-
+from library.revocations import RevocationStoreError, create_revocation_store
 
 load_dotenv()
 # Secret key to encode and decode JWT tokens
@@ -37,17 +27,94 @@ async def create_access_token(data: dict,
                               expires_delta: timedelta = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)) -> str:
     to_encode = data.copy()
     expire = datetime.utcnow() + expires_delta
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "jti": uuid.uuid4().hex})
     return await asyncio.to_thread(jwt.encode, to_encode, SECRET_KEY, ALGORITHM)
 
 
 security = HTTPBearer()  # just expects "Authorization: Bearer <token>"
 
+# Maps the subject (email) of a verified token to its user, so most requests skip the users query
+principal_cache = TTLCache(maxsize=AuthConfig.PRINCIPAL_CACHE_SIZE, ttl=AuthConfig.PRINCIPAL_CACHE_TTL)
+principal_invalidation_hooks: list[Callable[[str], None]] = []
+
+
+# Registers a callback that is told about every invalidated email, e.g. to publish it to the other workers.
+def add_principal_invalidation_hook(hook: Callable[[str], None]) -> None:
+    principal_invalidation_hooks.append(hook)
+
+
+# Drops a user from the principal cache. Messages coming from other workers should pass propagate=False.
+def invalidate_principal(email: str, propagate: bool = True) -> None:
+    principal_cache.pop(email)
+    if propagate:
+        for hook in principal_invalidation_hooks:
+            hook(email)
 
+
+# The authenticated user as described by the token claims, returned by get_current_user in stateless mode.
+class Principal(NamedTuple):
+    id: int
+    email: str
+    token_version: int
+
+
+# Revocations only have to outlive the tokens they reject. They are kept in the AUTH_REVOCATION_BACKEND, which has
+# to be redis when several workers serve requests, so a logout or password change on one is seen by all of them,
+# and in stateless mode, where it is the only revocation check and must survive restarts.
+if AuthConfig.STATELESS and AuthConfig.REVOCATION_BACKEND != "redis":
+    raise RuntimeError("AUTH_STATELESS needs AUTH_REVOCATION_BACKEND=redis, revocations would be lost on restart")
+revocations = create_revocation_store(AuthConfig.REVOCATION_BACKEND, ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+                                      CacheConfig.REDIS_URL)
+revocation_hooks: list[Callable[[str, str | int, int | None], None]] = []
+
+# Version recorded for deleted users, no token can reach it
+DELETED_USER_VERSION = 2 ** 62
+
+revocation_unavailable = HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                       detail="Token revocations are unavailable, try again later")
+
+
+# Registers a callback that is told about every revocation (kind, key, version), e.g. to publish it to other workers.
+def add_revocation_hook(hook: Callable[[str, str | int, int | None], None]) -> None:
+    revocation_hooks.append(hook)
+
+
+# Rejects a single token until it would have expired anyway. Answers 503 when the revocation could not be stored.
+async def revoke_token(jti: str, propagate: bool = True) -> None:
+    try:
+        await revocations.revoke_token(jti)
+    except RevocationStoreError:
+        raise revocation_unavailable
+    if propagate:
+        for hook in revocation_hooks:
+            hook("token", jti, None)
+
+
+# Rejects every token of a user issued with a version lower than valid_from.
+async def revoke_user_tokens(user_id: int, valid_from: int, propagate: bool = True) -> None:
+    try:
+        await revocations.revoke_user(user_id, valid_from)
+    except RevocationStoreError:
+        raise revocation_unavailable
+    if propagate:
+        for hook in revocation_hooks:
+            hook("user", user_id, valid_from)
+
+
+# Fails closed: while revocations cannot be checked no token is accepted
+async def is_token_revoked(payload: dict) -> bool:
+    try:
+        return await revocations.is_revoked(payload.get("jti"), payload.get("uid"), payload.get("ver"))
+    except RevocationStoreError:
+        raise revocation_unavailable
+
+
+# In the default mode the user is loaded from the database (through the principal cache).
+# With AUTH_STATELESS the token claims alone describe the user and no SQL is issued.
 async def get_current_user(
         session: SessionDep,
         credentials: HTTPAuthorizationCredentials = Depends(security),
-) -> User:
+) -> User | Principal:
     token = credentials.credentials  # extract token string
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -62,11 +129,38 @@ async def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    from library.crud import get_user_by_email
+    if await is_token_revoked(payload):
+        raise credentials_exception
 
-    user = await get_user_by_email(session, email)
+    if AuthConfig.STATELESS:
+        if payload.get("uid") is None or payload.get("ver") is None:
+            raise credentials_exception
+        return Principal(id=payload["uid"], email=email, token_version=payload["ver"])
+
+    user = principal_cache.get(email)
     if user is None:
+        from library.crud import get_user_by_email
+
+        user = await get_user_by_email(session, email)
+        if user is None:
+            raise credentials_exception
+
+        # A detached copy, so the cached object never belongs to a request's session
+        principal_cache.set(email, User(id=user.id, email=user.email, password=user.password,
+                                        token_version=user.token_version))
+
+    if payload.get("ver") is not None and payload["ver"] < user.token_version:
         raise credentials_exception
     return user
 
-CurrentUser = Annotated[User, Depends(get_current_user)]
+
+# Returns the claims of the token of the current request, for endpoints that need the jti or expiry.
+async def get_token_payload(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    try:
+        return jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Could not validate credentials",
+                            headers={"WWW-Authenticate": "Bearer"})
+
+CurrentUser = Annotated[User | Principal, Depends(get_current_user)]
+TokenPayload = Annotated[dict, Depends(get_token_payload)]
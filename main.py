@@ -1,21 +1,44 @@
 from fastapi import FastAPI
 from library.database import engine
+from library.hashing import shutdown_hashing_pool
+from library.jobs import start_jobs, stop_jobs
+from library.metrics import MetricsMiddleware
 from library.models import Base
+from library.partitions import ensure_partitions
+from library.replicas import dispose_replicas, read_your_writes_middleware
 from library.endpoints.auth import router as user_router
 from library.endpoints.books_crud import router as books_router
 from library.endpoints.readers_crud import router as readers_router
 from library.endpoints.lend_or_return import router as borrow_router
+from library.endpoints.system import router as system_router
+from library.endpoints.stats import router as stats_router
+from library.endpoints.metrics import router as metrics_router
 
 app = FastAPI()
+app.middleware("http")(read_your_writes_middleware)
+# Added last so it is the outermost middleware and times everything else
+app.add_middleware(MetricsMiddleware)
 
 
 @app.on_event("startup")
 async def on_startup():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await ensure_partitions(conn)
+    start_jobs()
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    await stop_jobs()
+    shutdown_hashing_pool()
+    await dispose_replicas()
 
 
 app.include_router(user_router)
 app.include_router(books_router)
 app.include_router(readers_router)
 app.include_router(borrow_router)
+app.include_router(system_router)
+app.include_router(stats_router)
+app.include_router(metrics_router)
@@ -1,39 +1,266 @@
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
-from sqlalchemy.orm import sessionmaker
-from library.config import DBConfig
-from library.models import Reader, Book
+"""Synthetic data generator for development and performance testing.
+
+Generates books, readers and a borrow history with realistic skew: book popularity and reader activity follow
+Zipf distributions, so a few titles and readers account for most borrows. Rows are generated with Faker in worker
+processes, each loading its chunks with COPY over its own connection.
+
+    python seed_data.py                                                  # a small dataset to click around in
+    python seed_data.py --books 2000000 --readers 1000000 --borrows 30000000 --workers 8 --truncate
+
+The same --seed, sizes and --as-of date always produce the same rows, whatever the number of workers or the day
+it runs (pass --as-of $(date +%F) for a history that ends today). Afterwards the open borrows are brought within the
+lending rules (BORROW_LIMIT per reader, one open borrow of a book per reader, no more open borrows of a book than
+its copies), the reader counters, available copies and circulation summaries are recomputed and the id sequences
+moved past the generated ids. The yearly borrowed_books partitions the history spans are created before it is loaded.
+"""
+import argparse
 import asyncio
+import itertools
+import multiprocessing
+import os
 import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+import asyncpg
 from faker import Faker
+from sqlalchemy import text
+from library.config import DBConfig
+from library.crud.borrow import BORROW_LIMIT, LOAN_DAYS
+from library.crud.stats import rebuild_circulation_stats
+from library.database import AsyncSessionLocal, engine
+from library.partitions import create_partitions, is_partitioned
+
+# The workers talk to Postgres through asyncpg directly
+DSN = DBConfig.DB_URL.replace("postgresql+asyncpg://", "postgresql://", 1)
+
+TABLE_COLUMNS = {
+    "books": ("id", "title", "description", "author", "year", "isbn", "copy"),
+    "readers": ("id", "full_name", "email"),
+    "borrowed_books": ("id", "book_id", "reader_id", "borrow_date", "due_date", "return_date"),
+}
+
+# Borrow popularity tables, built once per worker process on its first borrow chunk
+popularity = {}
+
+
+# Each chunk has its own generators seeded from (seed, table, chunk), so chunks come out the same in any process
+def chunk_random(seed: int, table: str, index: int) -> tuple[random.Random, Faker]:
+    fake = Faker()
+    fake.seed_instance(f"{seed}:{table}:{index}")
+    return random.Random(f"{seed}:{table}:{index}"), fake
+
+
+# A valid ISBN-13 derived from the book id, so isbns are unique without any coordination between workers
+def isbn13(number: int) -> str:
+    digits = f"978{number % 10 ** 9:09d}"
+    checksum = sum(int(digit) * (3 if position % 2 else 1) for position, digit in enumerate(digits))
+    return digits + str(-checksum % 10)
+
+
+def make_books(rng: random.Random, fake: Faker, first_id: int, count: int) -> list[tuple]:
+    return [
+        (book_id, fake.sentence(nb_words=rng.randint(2, 6)).rstrip("."), fake.text(max_nb_chars=200), fake.name(),
+         rng.randint(1900, 2024), isbn13(book_id), rng.randint(1, 5))
+        for book_id in range(first_id, first_id + count)
+    ]
+
+
+def make_readers(rng: random.Random, fake: Faker, first_id: int, count: int) -> list[tuple]:
+    return [
+        (reader_id, fake.name(), f"{fake.user_name()}.{reader_id}@{fake.free_email_domain()}")
+        for reader_id in range(first_id, first_id + count)
+    ]
+
+
+# Cumulative Zipf weights over ranks and a seeded shuffle mapping each rank to an id,
+# so the popular rows are spread over the id range instead of being the oldest ones.
+def zipf_table(seed: int, name: str, first_id: int, count: int, skew: float) -> tuple[list[float], list[int]]:
+    cum_weights = list(itertools.accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+    ids = list(range(first_id, first_id + count))
+    random.Random(f"{seed}:{name}").shuffle(ids)
+    return cum_weights, ids
+
+
+def get_popularity(plan: dict) -> dict:
+    key = (plan["seed"], plan["books"], plan["readers"], plan["book_skew"], plan["reader_skew"])
+    if popularity.get("key") != key:
+        popularity.clear()
+        popularity["key"] = key
+        popularity["books"] = zipf_table(plan["seed"], "books", *plan["books"], plan["book_skew"])
+        popularity["readers"] = zipf_table(plan["seed"], "readers", *plan["readers"], plan["reader_skew"])
+    return popularity
 
-DATABASE_URL = DBConfig.DB_URL
 
-engine = create_async_engine(DATABASE_URL, echo=True)
-AsyncSessionLocal = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+# Borrow dates are spread over the plan["days"] days up to plan["as_of"] and loans last 3 to 42 days, so some run
+# past their due date. A loan that has not ended by the as-of date is still open.
+def make_borrows(rng: random.Random, fake: Faker, first_id: int, count: int, plan: dict) -> list[tuple]:
+    tables = get_popularity(plan)
+    book_weights, book_ids = tables["books"]
+    reader_weights, reader_ids = tables["readers"]
+    book_ranks = rng.choices(range(len(book_ids)), cum_weights=book_weights, k=count)
+    reader_ranks = rng.choices(range(len(reader_ids)), cum_weights=reader_weights, k=count)
+    as_of = date.fromisoformat(plan["as_of"])
 
-fake = Faker()
+    records = []
+    for borrow_id, book_rank, reader_rank in zip(range(first_id, first_id + count), book_ranks, reader_ranks):
+        borrow_date = as_of - timedelta(days=rng.randint(0, plan["days"]))
+        return_date = borrow_date + timedelta(days=rng.randint(3, 42))
+        records.append((borrow_id, book_ids[book_rank], reader_ids[reader_rank], borrow_date,
+                        borrow_date + timedelta(days=LOAN_DAYS), return_date if return_date <= as_of else None))
+    return records
 
-async def seed_data():
+
+async def copy_chunk(table: str, index: int, first_id: int, count: int, plan: dict) -> int:
+    rng, fake = chunk_random(plan["seed"], table, index)
+    if table == "books":
+        records = make_books(rng, fake, first_id, count)
+    elif table == "readers":
+        records = make_readers(rng, fake, first_id, count)
+    else:
+        records = make_borrows(rng, fake, first_id, count, plan)
+
+    conn = await asyncpg.connect(DSN)
+    try:
+        await conn.copy_records_to_table(table, records=records, columns=TABLE_COLUMNS[table])
+    finally:
+        await conn.close()
+    return count
+
+
+# Runs in the worker processes and must stay an importable module-level function.
+def load_chunk(table: str, index: int, first_id: int, count: int, plan: dict) -> int:
+    return asyncio.run(copy_chunk(table, index, first_id, count, plan))
+
+
+# Splits rows starting at first_id into chunks, loads them in the pool and reports progress
+async def load_table(pool: ProcessPoolExecutor, table: str, first_id: int, rows: int, chunk_size: int,
+                     plan: dict) -> None:
+    if not rows:
+        return
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    jobs = [
+        loop.run_in_executor(pool, load_chunk, table, index, first_id + start, min(chunk_size, rows - start), plan)
+        for index, start in enumerate(range(0, rows, chunk_size))
+    ]
+    loaded = 0
+    for job in asyncio.as_completed(jobs):
+        loaded += await job
+        elapsed = time.perf_counter() - started
+        print(f"  {table}: {loaded:,}/{rows:,} rows, {loaded / elapsed:,.0f} rows/s", flush=True)
+
+
+async def next_ids(conn) -> dict:
+    return {table: await conn.scalar(text(f"SELECT coalesce(max(id), 0) + 1 FROM {table}")) for table in TABLE_COLUMNS}
+
+
+# Brings the generated history in line with what lending maintains: at most BORROW_LIMIT open borrows per reader,
+# one per book and reader, and no more per generated book than its copies (the rest are returned after LOAN_DAYS),
+# then the derived columns and summaries. The copies generated are the book's stock, what is left after the open
+# borrows becomes its available copies.
+async def finish(first_ids: dict, as_of: date) -> None:
     async with AsyncSessionLocal() as session:
-        readers = [
-            Reader(full_name=fake.name(), email=fake.unique.email())
-            for _ in range(10)
-        ]
-
-        books = [
-            Book(
-                title=fake.sentence(nb_words=3),
-                description=fake.text(max_nb_chars=200),
-                author=fake.name(),
-                year=random.randint(1900, 2023),
-                isbn=fake.unique.isbn13(),
-                copy=random.randint(1, 5)
-            )
-            for _ in range(10)
-        ]
-
-        session.add_all(readers + books)
-        await session.commit()
+        async with session.begin():
+            print("Closing open borrows beyond the lending rules ...", flush=True)
+            await session.execute(text(
+                "UPDATE borrowed_books SET return_date = least(borrowed_books.borrow_date + CAST(:loan_days AS integer), CAST(:as_of AS date)) "
+                "FROM (SELECT id, "
+                "row_number() OVER (PARTITION BY reader_id ORDER BY borrow_date DESC, id) AS reader_rank, "
+                "row_number() OVER (PARTITION BY reader_id, book_id ORDER BY borrow_date DESC, id) AS copy_rank "
+                "FROM borrowed_books WHERE return_date IS NULL) AS open_borrows "
+                "WHERE borrowed_books.id = open_borrows.id "
+                "AND (open_borrows.reader_rank > :limit OR open_borrows.copy_rank > 1)"
+            ), {"limit": BORROW_LIMIT, "loan_days": LOAN_DAYS, "as_of": as_of})
+            # Ranked among the borrows still open, so a book keeps its most recent borrows up to its copies
+            await session.execute(text(
+                "UPDATE borrowed_books SET return_date = least(borrowed_books.borrow_date + CAST(:loan_days AS integer), CAST(:as_of AS date)) "
+                "FROM (SELECT borrowed_books.id, books.copy, "
+                "row_number() OVER (PARTITION BY book_id ORDER BY borrow_date DESC, borrowed_books.id) AS book_rank "
+                "FROM borrowed_books JOIN books ON books.id = borrowed_books.book_id "
+                "WHERE return_date IS NULL AND book_id >= :first_book) AS open_borrows "
+                "WHERE borrowed_books.id = open_borrows.id AND open_borrows.book_rank > open_borrows.copy"
+            ), {"loan_days": LOAN_DAYS, "as_of": as_of, "first_book": first_ids["books"]})
+
+            print("Updating reader counters and available copies ...", flush=True)
+            await session.execute(text(
+                "UPDATE readers SET active_borrow_count = open_borrows.count "
+                "FROM (SELECT reader_id, count(*) AS count FROM borrowed_books WHERE return_date IS NULL "
+                "GROUP BY reader_id) AS open_borrows WHERE readers.id = open_borrows.reader_id"
+            ))
+            await session.execute(text(
+                "UPDATE books SET copy = books.copy - open_borrows.count "
+                "FROM (SELECT book_id, count(*) AS count FROM borrowed_books WHERE return_date IS NULL "
+                "AND book_id >= :first_book GROUP BY book_id) AS open_borrows WHERE books.id = open_borrows.book_id"
+            ), {"first_book": first_ids["books"]})
+
+            print("Rebuilding circulation summaries ...", flush=True)
+            await rebuild_circulation_stats(session)
+
+            for table in TABLE_COLUMNS:
+                await session.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), max(id)) FROM {table} HAVING count(*) > 0"
+                ))
+
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        for table in (*TABLE_COLUMNS, "daily_circulation", "book_circulation", "reader_circulation"):
+            await conn.execute(text(f"ANALYZE {table}"))
+
+
+async def seed_data(args) -> None:
+    async with engine.begin() as conn:
+        if args.truncate:
+            await conn.execute(text(
+                "TRUNCATE books, readers, borrowed_books, daily_circulation, book_circulation, reader_circulation "
+                "RESTART IDENTITY CASCADE"
+            ))
+        first_ids = await next_ids(conn)
+        # Borrows are copied into the yearly partitions of their borrow dates rather than the default partition
+        if await is_partitioned(conn):
+            await create_partitions(conn, (args.as_of - timedelta(days=args.days)).year, args.as_of.year)
+
+    # Borrows only reference the books and readers generated in this run
+    plan = {
+        "seed": args.seed,
+        "books": (first_ids["books"], args.books),
+        "readers": (first_ids["readers"], args.readers),
+        "book_skew": args.book_skew,
+        "reader_skew": args.reader_skew,
+        "days": args.days,
+        "as_of": args.as_of.isoformat(),
+    }
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        print(f"Loading {args.books:,} books and {args.readers:,} readers with {args.workers} workers ...", flush=True)
+        await asyncio.gather(
+            load_table(pool, "books", first_ids["books"], args.books, args.chunk_size, plan),
+            load_table(pool, "readers", first_ids["readers"], args.readers, args.chunk_size, plan),
+        )
+        print(f"Loading {args.borrows:,} borrow records ...", flush=True)
+        await load_table(pool, "borrowed_books", first_ids["borrowed_books"], args.borrows, args.chunk_size, plan)
+
+    await finish(first_ids, args.as_of)
+    await engine.dispose()
+    print(f"Done in {time.perf_counter() - started:,.1f} s", flush=True)
+
 
 if __name__ == "__main__":
-    asyncio.run(seed_data())
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--books", type=int, default=10_000)
+    parser.add_argument("--readers", type=int, default=10_000)
+    parser.add_argument("--borrows", type=int, default=100_000, help="borrow records, returned and open")
+    parser.add_argument("--days", type=int, default=3650, help="how far back the borrow history goes")
+    parser.add_argument("--as-of", type=date.fromisoformat, default=date(2026, 1, 1),
+                        help="date the history ends on, loans not returned by then stay open (YYYY-MM-DD)")
+    parser.add_argument("--book-skew", type=float, default=1.1, help="Zipf exponent of book popularity")
+    parser.add_argument("--reader-skew", type=float, default=0.8, help="Zipf exponent of reader activity")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="generator processes")
+    parser.add_argument("--chunk-size", type=int, default=50_000, help="rows per COPY")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--truncate", action="store_true", help="empty the library tables first")
+    args = parser.parse_args()
+    if args.borrows and not (args.books and args.readers):
+        parser.error("--borrows needs --books and --readers")
+    asyncio.run(seed_data(args))